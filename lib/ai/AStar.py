@@ -1,11 +1,18 @@
 import math
 import glm
 
+from .AStarSearch import AStarSearch
+
 
 class AStar:
 
+    # extra step cost per unit of height difference
+    Z_PENALTY = 5
+
     def __init__(self, waypoints):
         self.nodes = waypoints
+        # number of nodes evaluated by the last search
+        self.num_expanded = 0
 
     def heuristic_goal_cost(self, n1, n2):
         if n1 == n2:
@@ -22,14 +29,34 @@ class AStar:
         d = self.nodes.distance(n1, n2)
         p1 = self.nodes.id_to_pos[n1]
         p2 = self.nodes.id_to_pos[n2]
-        d += abs(p1[2]-p2[2]) * 5
+        d += abs(p1[2]-p2[2]) * self.Z_PENALTY
         if 0:  # avoid towards goal
             dir1 = self.nodes.direction(n1, n2)
             dir2 = self.nodes.direction(n1, goal)
             return glm.dot(dir1, dir2) * d
         return d
 
+    def graph(self):
+        return self.nodes.csr(z_penalty=self.Z_PENALTY)
+
+    def search_incremental(self, start_node, end_node):
+        """Returns an AStarSearch that runs the same search in steps"""
+        return AStarSearch(self.graph(), start_node, end_node)
+
     def search(self, start_node, end_node):
+        """
+        Returns the list of node ids from start_node to end_node or None.
+
+        Runs an AStarSearch on the WayPointsCSR of the waypoints to completion.
+        The step costs are those of heuristic_step_cost
+        and the goal costs those of heuristic_goal_cost.
+        """
+        search = self.search_incremental(start_node, end_node)
+        path = search.run()
+        self.num_expanded = search.num_expanded
+        return path
+
+    def search_old(self, start_node, end_node):
         infinity = 2 << 31
 
         closed_set = set()
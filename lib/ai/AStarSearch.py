@@ -0,0 +1,107 @@
+import heapq
+import math
+from typing import Optional, List
+
+
+class AStarSearch:
+    """
+    A single A* search on a WayPointsCSR that can be advanced in steps.
+
+    It is the search of AStar.search and HierarchicalAStar, the state is kept
+    in this object, so many searches can be interleaved.
+
+    Step costs are those of the graph, or of `adjacency`, a dict of
+    node -> [(adjacent node, step cost), ...] that is used instead of the graph's edges.
+    `extra` adds more of those edges, e.g. temporary ones to the start and end node.
+    The heuristic is the euclidean distance to the end node.
+    """
+
+    def __init__(
+            self, graph, start_node: int, end_node: int,
+            adjacency: Optional[dict] = None, extra: Optional[dict] = None,
+    ):
+        self.graph = graph
+        self.start_node = start_node
+        self.end_node = end_node
+        self.adjacency = adjacency
+        self.extra = extra
+        self.path: Optional[List[int]] = None
+        self.finished = False
+        self.num_expanded = 0
+        # per-node state, indexed by node id, created on the first step
+        self._g_score: Optional[List[float]] = None
+        self._came_from: Optional[List[int]] = None
+        self._closed: Optional[bytearray] = None
+        self._heap = [(0., start_node)]
+
+    def run(self) -> Optional[List[int]]:
+        """Finish the search and return the path or None"""
+        self.step(math.inf)
+        return self.path
+
+    def step(self, max_expansions: int = 1) -> bool:
+        """
+        Evaluate up to `max_expansions` nodes.
+        Returns True when the search is finished, the result is in `path`.
+        """
+        if self.finished:
+            return True
+        positions, indptr, indices, costs = self.graph.to_lists()
+        adjacency, extra, empty = self.adjacency, self.extra, []
+        if self._g_score is None:
+            self._g_score = [math.inf] * len(positions)
+            self._came_from = [-1] * len(positions)
+            self._closed = bytearray(len(positions))
+            self._g_score[self.start_node] = 0.
+        g_score, came_from, closed, heap = self._g_score, self._came_from, self._closed, self._heap
+        sqrt, heappush, heappop = math.sqrt, heapq.heappush, heapq.heappop
+        end_node = self.end_node
+        ex, ey, ez = positions[end_node]
+
+        # counted locally and stored when returning
+        num_expanded, max_expanded = self.num_expanded, self.num_expanded + max_expansions
+        while num_expanded < max_expanded:
+            if not heap:
+                self.finished = True
+                break
+
+            current_node = heappop(heap)[1]
+            if closed[current_node]:
+                continue
+
+            # found!
+            if current_node == end_node:
+                path = [current_node]
+                while came_from[current_node] >= 0:
+                    current_node = came_from[current_node]
+                    path.append(current_node)
+                self.path = list(reversed(path))
+                self.finished = True
+                break
+
+            closed[current_node] = 1
+            num_expanded += 1
+            current_g = g_score[current_node]
+
+            if adjacency is None:
+                k0, k1 = indptr[current_node], indptr[current_node + 1]
+                neighbors = zip(indices[k0:k1], costs[k0:k1])
+            else:
+                neighbors = adjacency.get(current_node, empty)
+            if extra and current_node in extra:
+                neighbors = list(neighbors) + extra[current_node]
+
+            for neighbor_node, cost in neighbors:
+                if closed[neighbor_node]:
+                    continue
+                g = current_g + cost
+                if g >= g_score[neighbor_node]:
+                    continue
+                came_from[neighbor_node] = current_node
+                g_score[neighbor_node] = g
+                x, y, z = positions[neighbor_node]
+                x, y, z = x - ex, y - ey, z - ez
+                heappush(heap, (g + sqrt(x*x+y*y+z*z), neighbor_node))
+
+        self.num_expanded = num_expanded
+        return self.finished
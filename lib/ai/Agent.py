@@ -1,75 +1,128 @@
 import glm
 from lib.world.render.AgentRenderer import AgentRenderer
+from .AgentArrays import AgentArrays
 
 
 class Agent:
+    """
+    View on one row of an AgentArrays.
 
-    def __init__(self, chunk, renderer=None):
+    The state (position, sposition, velocity, anim_stage, direction)
+    lives in the arrays, the properties return copies and write back on
+    assignment. A standalone Agent has its own AgentArrays until it is
+    attached to a shared one, e.g. by Agents.add_agent.
+
+    A `headless` agent has no renderer and needs no OpenGL context.
+    """
+
+    def __init__(self, chunk, renderer=None, arrays=None, headless=False):
         self.name = ""
         self.chunk = chunk
-        self.position = glm.vec3(0,0,0)
-        self.velocity = glm.vec3(0)
-        self.sposition = glm.vec3(self.position)
-        self.renderer = renderer if renderer is not None else AgentRenderer()
+        self.arrays = arrays if arrays is not None else AgentArrays(capacity=1)
+        self.index = self.arrays.add()
+        if headless:
+            self.renderer = None
+        else:
+            self.renderer = renderer if renderer is not None else AgentRenderer()
+
+    def attach(self, arrays: AgentArrays):
+        """Move the state of this agent to `arrays`"""
+        if arrays is self.arrays:
+            return
+        index = arrays.add()
+        for name in ("position", "sposition", "velocity", "anim_stage", "direction"):
+            getattr(arrays, name)[index] = getattr(self.arrays, name)[self.index]
+        self.arrays.remove(self.index)
+        self.arrays, self.index = arrays, index
+
+    def release(self):
+        if self.renderer is not None:
+            self.renderer.release()
+        self.arrays.remove(self.index)
+
+    @property
+    def position(self):
+        return glm.vec3(*self.arrays.position[self.index])
+
+    @position.setter
+    def position(self, pos):
+        self.arrays.position[self.index] = tuple(pos)
+
+    @property
+    def sposition(self):
+        return glm.vec3(*self.arrays.sposition[self.index])
+
+    @sposition.setter
+    def sposition(self, pos):
+        self.arrays.sposition[self.index] = tuple(pos)
 
-        self.anim_stage = 0.
-        self.direction = renderer.DOWN
+    @property
+    def velocity(self):
+        return glm.vec3(*self.arrays.velocity[self.index])
+
+    @velocity.setter
+    def velocity(self, vel):
+        self.arrays.velocity[self.index] = tuple(vel)
+
+    @property
+    def anim_stage(self):
+        return float(self.arrays.anim_stage[self.index])
+
+    @anim_stage.setter
+    def anim_stage(self, stage):
+        self.arrays.anim_stage[self.index] = stage
+
+    @property
+    def direction(self):
+        return int(self.arrays.direction[self.index])
+
+    @direction.setter
+    def direction(self, direction):
+        self.arrays.direction[self.index] = direction
 
     def set_position(self, pos):
         self.position = glm.vec3(pos)
         self.sposition = glm.vec3(pos)
 
     def jump(self, amt=1):
-        if self.chunk.is_wall(int(self.sposition.x), int(self.sposition.y), int(self.sposition.z-.5), self.chunk.TOP):
-            self.velocity += (0, 0, amt)
+        self.arrays.jump(self.chunk, self.index, amt)
 
     def move(self, dir):
-        self.position = self.sposition + dir
-        #if self.chunk.block(int(newpos.x), int(newpos.y), int(newpos.z)).space_type == 0:
-        #    self.position = newpos
-        #newpos = self.position + glm.vec3(0,0,-.1)
-        #if self.chunk.block(int(newpos.x), int(newpos.y), int(newpos.z)).space_type == 0:
-        #    self.position = newpos
-        #self.position.z -= self.velocity.z
-
-        adir = glm.abs(dir)
-        if adir.z > adir.x and adir.z > adir.y:
-            return
-
-        if adir.x > adir.y:
-            self.direction = self.renderer.RIGHT if dir.x > 0 else self.renderer.LEFT
-        else:
-            self.direction = self.renderer.UP if dir.y > 0 else self.renderer.DOWN
+        self.arrays.move(self.index, tuple(dir))
 
     def update(self, dt):
+        self.arrays.update(dt, self.chunk, [self.index])
+
+    def update_old(self, dt):
         d = min(1, dt*5)
 
         # gravity
         if 1:
             newpos = self.position + d * glm.vec3(0,0,-3)
             if int(newpos.z) >= 1:
-                if self.chunk.block(int(newpos.x), int(newpos.y), int(newpos.z)).space_type == 0:
+                if not self.chunk.is_occupied(int(newpos.x), int(newpos.y), int(newpos.z)):
                     self.position = newpos
         else:
             t, hit = self.chunk.cast_voxel_ray(self.position+(0,0,0), (0,0,-1))
             if hit:
-                self.position.z -= t
-                self.sposition.z -= t
+                self.position -= (0, 0, t)
+                self.sposition -= (0, 0, t)
 
         # advance spos to pos
-        move = (self.position - self.sposition) + self.velocity
+        sposition = self.sposition
+        move = (self.position - sposition) + self.velocity
         if 0:
-            newpos = self.sposition + d * move
-            if self.chunk.block(int(newpos.x), int(newpos.y), int(newpos.z)).space_type == 0:
+            newpos = sposition + d * move
+            if not self.chunk.is_occupied(int(newpos.x), int(newpos.y), int(newpos.z)):
                 self.sposition = newpos
         else:
-            nextpos = glm.vec3(self.sposition)
+            nextpos = glm.vec3(sposition)
             for i, ax in enumerate(((1,0,0), (0,1,0), (0,0,1))):
-                newpos = self.sposition + d * move * ax
-                if self.chunk.block(int(newpos.x-.2), int(newpos.y-.2), int(newpos.z)).space_type == 0\
-                    and self.chunk.block(int(newpos.x+.2), int(newpos.y-.2), int(newpos.z)).space_type == 0\
-                    and self.chunk.block(int(newpos.x-.2), int(newpos.y+.2), int(newpos.z)).space_type == 0\
-                    and self.chunk.block(int(newpos.x+.2), int(newpos.y+.2), int(newpos.z)).space_type == 0:
+                newpos = sposition + d * move * ax
+                if not self.chunk.is_occupied(int(newpos.x-.2), int(newpos.y-.2), int(newpos.z))\
+                    and not self.chunk.is_occupied(int(newpos.x+.2), int(newpos.y-.2), int(newpos.z))\
+                    and not self.chunk.is_occupied(int(newpos.x-.2), int(newpos.y+.2), int(newpos.z))\
+                    and not self.chunk.is_occupied(int(newpos.x+.2), int(newpos.y+.2), int(newpos.z)):
                     nextpos[i] = newpos[i]
             self.sposition = nextpos
 
@@ -84,4 +137,6 @@ class Agent:
             self.anim_stage = 0.
 
     def render(self, projection):
-        self.renderer.render(projection, self.sposition, self.direction, int(self.anim_stage))
\ No newline at end of file
+        if self.renderer is None:
+            return
+        self.renderer.render(projection, self.sposition, self.direction, int(self.anim_stage))
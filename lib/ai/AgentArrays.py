@@ -0,0 +1,147 @@
+from typing import Optional
+
+import numpy as np
+
+
+class AgentArrays:
+    """
+    Struct-of-arrays storage of the simulation state of many agents.
+
+    Each agent is a row index into `position`, `sposition` (smoothed
+    position), `velocity`, `anim_stage` and `direction`. `update` advances
+    all agents at once with the same rules as the per-agent update:
+    gravity, smoothing towards the target position and axis-separated
+    collision of the four corners against the voxels of the chunk
+    (a WorldChunk or ChunkManager).
+
+    Arrays are float32 like the glm vectors of Agent.
+    """
+
+    # same values as AgentRenderer
+    DOWN = 1
+    LEFT = 2
+    UP = 3
+    RIGHT = 4
+
+    def __init__(self, capacity: int = 16):
+        self.position = np.zeros((capacity, 3), dtype="float32")
+        self.sposition = np.zeros((capacity, 3), dtype="float32")
+        self.velocity = np.zeros((capacity, 3), dtype="float32")
+        self.anim_stage = np.zeros(capacity, dtype="float32")
+        self.direction = np.full(capacity, self.DOWN, dtype="int8")
+        self.alive = np.zeros(capacity, dtype="bool")
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive))
+
+    @property
+    def capacity(self) -> int:
+        return len(self.alive)
+
+    def add(self, position=(0, 0, 0)) -> int:
+        """Returns the index of a new agent at `position`"""
+        if not self._free:
+            self._grow(max(16, self.capacity * 2))
+        index = self._free.pop()
+        self.alive[index] = True
+        self.position[index] = position
+        self.sposition[index] = position
+        self.velocity[index] = 0
+        self.anim_stage[index] = 0
+        self.direction[index] = self.DOWN
+        return index
+
+    def remove(self, index: int):
+        if self.alive[index]:
+            self.alive[index] = False
+            self._free.append(index)
+
+    def indices(self) -> np.ndarray:
+        return np.flatnonzero(self.alive)
+
+    def move(self, indices, directions):
+        """Set the target positions to the smoothed positions plus `directions` and face the direction"""
+        indices = np.asarray(indices).reshape(-1)
+        directions = np.asarray(directions, dtype="float32").reshape(-1, 3)
+        self.position[indices] = self.sposition[indices] + directions
+
+        adir = np.abs(directions)
+        turn = ~((adir[:, 2] > adir[:, 0]) & (adir[:, 2] > adir[:, 1]))
+        horizontal = adir[:, 0] > adir[:, 1]
+        direction = np.where(
+            horizontal,
+            np.where(directions[:, 0] > 0, self.RIGHT, self.LEFT),
+            np.where(directions[:, 1] > 0, self.UP, self.DOWN),
+        )
+        self.direction[indices[turn]] = direction[turn]
+
+    def jump(self, chunk, indices, amount: float = 1.):
+        """Add upward velocity to the agents that stand on a voxel"""
+        indices = np.asarray(indices).reshape(-1)
+        spos = self.sposition[indices]
+        standing = self._occupied(chunk, spos[:, 0], spos[:, 1], spos[:, 2] - np.float32(.5))
+        self.velocity[indices[standing], 2] += np.float32(amount)
+
+    def update(self, dt: float, chunk, indices: Optional[np.ndarray] = None):
+        """
+        Advance the agents (all alive agents by default) by `dt` seconds
+        in the voxels of `chunk`
+        """
+        if indices is None:
+            indices = self.indices()
+        if not len(indices):
+            return
+        d = np.float32(min(1, dt*5))
+        position = self.position[indices]
+        sposition = self.sposition[indices]
+        velocity = self.velocity[indices]
+
+        # gravity
+        newpos = position.copy()
+        newpos[:, 2] += d * np.float32(-3)
+        falls = (np.trunc(newpos[:, 2]) >= 1) & ~self._occupied(chunk, newpos[:, 0], newpos[:, 1], newpos[:, 2])
+        position[falls] = newpos[falls]
+
+        # advance spos to pos, each axis separately against the four corners
+        move = (position - sposition) + velocity
+        nextpos = sposition.copy()
+        c = np.float32(.2)
+        for i in range(3):
+            newpos = sposition.copy()
+            newpos[:, i] += d * move[:, i]
+            x, y, z = newpos[:, 0], newpos[:, 1], newpos[:, 2]
+            free = ~(
+                self._occupied(chunk, x - c, y - c, z)
+                | self._occupied(chunk, x + c, y - c, z)
+                | self._occupied(chunk, x - c, y + c, z)
+                | self._occupied(chunk, x + c, y + c, z)
+            )
+            nextpos[free, i] = newpos[free, i]
+
+        velocity -= velocity * d * np.float32(.5)
+
+        amt = (move * move).sum(axis=1)
+        anim_stage = self.anim_stage[indices] + np.float32(dt * 7.)
+        anim_stage[anim_stage > 3.] = 1.
+        anim_stage[amt <= .1] = 0.
+
+        self.position[indices] = position
+        self.sposition[indices] = nextpos
+        self.velocity[indices] = velocity
+        self.anim_stage[indices] = anim_stage
+
+    @staticmethod
+    def _occupied(chunk, x: np.ndarray, y: np.ndarray, z: np.ndarray) -> np.ndarray:
+        """Vectorized chunk.is_occupied(int(x), int(y), int(z))"""
+        x, y, z = (np.trunc(a).astype("int64") for a in (x, y, z))
+        return chunk.is_occupied_array(x, y, z)
+
+    def _grow(self, capacity: int):
+        old_capacity = self.capacity
+        for name in ("position", "sposition", "velocity", "anim_stage", "direction", "alive"):
+            array = getattr(self, name)
+            new_array = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            new_array[:old_capacity] = array
+            setattr(self, name, new_array)
+        self._free = list(range(capacity - 1, old_capacity - 1, -1)) + self._free
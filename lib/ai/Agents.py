@@ -1,32 +1,75 @@
+from collections import Counter
+
 import glm
 
 from .Agent import Agent
+from .AgentArrays import AgentArrays
 from lib.world.render.AgentRenderer import AgentRenderer
 from lib.opengl import Drawable
 from lib.geom import LineMesh
 from lib.ai.AStar import AStar
+from lib.ai.PathCache import PathCache
+from lib.ai.PathScheduler import PathScheduler
+from lib.ai.BatchPathSolver import BatchPathSolver
+from lib.ai.DStarLite import DStarLite
+from lib.ai.FlowField import FlowField
+from lib.ai.HierarchicalAStar import HierarchicalAStar
+from lib.ai.NavMesh import NavMesh
 
 
 class Agents:
 
-    def __init__(self, chunk):
+    # number of agents with the same goal or leader from which on they share a FlowField
+    FLOW_FIELD_MIN_AGENTS = 2
+
+    def __init__(self, chunk, hierarchical=False, max_expansions=2000, headless=False, navmesh=False):
+        """
+        :param hierarchical: use HierarchicalAStar instead of time-sliced AStar searches
+        :param max_expansions: number of waypoints evaluated per update for path requests
+        :param headless: create agents without renderers, no OpenGL context required
+        :param navmesh: walk straight lines found on a NavMesh instead of from waypoint to waypoint
+        """
         self.chunk = chunk
+        self.headless = headless
+        # number of set_goal/set_goals requests and of paths found for them
+        self.num_path_requests = 0
+        self.num_paths = 0
         self._agents = dict()
+        # state of all agents, advanced in one vectorized update
+        self._arrays = AgentArrays()
         self._pathfinder = AStar(self.chunk.waypoints)
+        self._path_cache = PathCache(self._pathfinder)
+        self._scheduler = PathScheduler(self._pathfinder, cache=self._path_cache, max_expansions=max_expansions)
+        self._batch_solver = None
+        # refines the paths segment by segment while the agents walk them
+        self._hierarchical = HierarchicalAStar(self.chunk.waypoints) if hierarchical else None
+        self._navmesh = NavMesh(self.chunk.waypoints) if navmesh else None
         self._paths = dict()
         self._follower = dict()
+        # goal node or ("follow", leader name) -> FlowField
+        self._flow_fields = dict()
+        # name -> DStarLite that repairs the path when the waypoints change
+        self._replanners = dict()
+        self._waypoints_version = self.chunk.waypoints.version
         self._path_debug_renderer = None
 
     def __getitem__(self, name):
         return self._agents[name]
 
+    def __len__(self):
+        return len(self._agents)
+
     def add_agent(self, name, agent):
         agent.chunk = self.chunk
         agent.name = name
+        agent.attach(self._arrays)
         self._agents[name] = agent
 
     def create_agent(self, name, tileset_filename=None):
-        agent = Agent(self.chunk, renderer=AgentRenderer(filename=tileset_filename))
+        if self.headless:
+            agent = Agent(self.chunk, arrays=self._arrays, headless=True)
+        else:
+            agent = Agent(self.chunk, renderer=AgentRenderer(filename=tileset_filename), arrays=self._arrays)
         self.add_agent(name, agent)
 
     def release(self):
@@ -34,6 +77,8 @@ class Agents:
             a.release()
         if self._path_debug_renderer:
             self._path_debug_renderer.release()
+        if self._batch_solver:
+            self._batch_solver.release()
 
     def render(self, projection):
         for agent in self._agents.values():
@@ -42,17 +87,29 @@ class Agents:
     def update(self, dt):
         import random
         # follow each other
+        num_followers = Counter(goal[0] for goal in self._follower.values())
         for fname in self._follower:
             goal = self._follower[fname]
             if goal[1] <= 0.:
-                pos = glm.vec3(self[goal[0]].sposition)
-                pos.x += random.uniform(1, 3) * (random.randrange(2)*2-1)
-                pos.y += random.uniform(1, 3) * (random.randrange(2)*2-1)
-                self.set_goal(fname, pos)
+                if num_followers[goal[0]] >= self.FLOW_FIELD_MIN_AGENTS:
+                    self._follow_flow_field(fname, goal[0])
+                else:
+                    pos = glm.vec3(self[goal[0]].sposition)
+                    pos.x += random.uniform(1, 3) * (random.randrange(2)*2-1)
+                    pos.y += random.uniform(1, 3) * (random.randrange(2)*2-1)
+                    self.set_goal(fname, pos)
                 goal[1] = random.uniform(1, 4)
             else:
                 goal[1] -= dt
 
+        # agents keep their previous path until the new one is found
+        for request in self._scheduler.update():
+            self._set_path(request.name, request.path, request.end_node)
+
+        if self.chunk.waypoints.version != self._waypoints_version:
+            self._waypoints_version = self.chunk.waypoints.version
+            self._replan_paths()
+
         # advance and finish paths
         del_path = []
         for name in self._paths:
@@ -63,10 +120,23 @@ class Agents:
                 del_path.append(name)
         for n in del_path:
             del self._paths[n]
+        for name in list(self._replanners):
+            if name not in self._paths:
+                del self._replanners[name]
+
+        # drop flow fields nobody uses
+        used = {path.flow_key for path in self._paths.values()}
+        for key in list(self._flow_fields):
+            if key not in used and not (
+                    isinstance(key, tuple) and num_followers[key[1]] >= self.FLOW_FIELD_MIN_AGENTS):
+                del self._flow_fields[key]
 
         # advance agents
-        for agent in self._agents.values():
-            agent.update(dt)
+        self._arrays.update(dt, self.chunk)
+
+    def is_idle(self, name) -> bool:
+        """True if the agent neither follows a path nor waits for one"""
+        return name not in self._paths and not self._scheduler.is_pending(name)
 
     def get_closest_waypoint(self, name):
         pos = tuple(int(p) for p in self._agents[name].sposition)
@@ -79,17 +149,137 @@ class Agents:
             return
         self._follower[follower_name] = [goal_name, 0.]
 
-    def set_goal(self, name, pos):
+    def set_goal(self, name, pos, priority=0):
+        """
+        Request a path to `pos`, it will be followed once it is found in one of the next updates.
+        Requests with higher `priority` are searched first.
+        """
         pos = tuple(int(p) for p in pos)
+        self.num_path_requests += 1
 
         from_node = self.get_closest_waypoint(name)
         to_node = self.chunk.waypoints.closest_node(pos)
-        path = self._pathfinder.search(from_node, to_node)
+        num_same_goal = sum(
+            1 for n, path in self._paths.items()
+            if n != name and path.goal_node == to_node and not isinstance(path.flow_key, tuple)
+        ) + sum(
+            1 for request in self._scheduler.requests() if request.name != name and request.end_node == to_node
+        )
+        if to_node is not None and num_same_goal + 1 >= self.FLOW_FIELD_MIN_AGENTS:
+            self._scheduler.cancel(name)
+            if to_node not in self._flow_fields:
+                self._flow_fields[to_node] = FlowField(self.chunk.waypoints, to_node)
+            self._set_flow_path(name, to_node)
+        elif self._hierarchical:
+            self._scheduler.cancel(name)
+            path, segments = self._search_hierarchical(from_node, to_node)
+            self._set_path(name, path, to_node, segments)
+        elif self._navmesh:
+            self._scheduler.cancel(name)
+            self._set_path(name, self._navmesh.search(from_node, to_node), to_node)
+        else:
+            self._scheduler.request(name, from_node, to_node, priority)
+
+    def set_goals(self, goals: dict):
+        """
+        Find the paths for many agents at once, {name: pos},
+        large batches are solved in parallel by the BatchPathSolver
+        """
+        if self._batch_solver is None:
+            self._batch_solver = BatchPathSolver(self.chunk.waypoints)
+        names = list(goals)
+        self.num_path_requests += len(names)
+        pairs = [
+            (self.get_closest_waypoint(name),
+             self.chunk.waypoints.closest_node(tuple(int(p) for p in goals[name])))
+            for name in names
+        ]
+        for name, (from_node, to_node), path in zip(names, pairs, self._batch_solver.solve(pairs)):
+            self._scheduler.cancel(name)
+            self._set_path(name, path, to_node)
+
+    def _search_hierarchical(self, from_node, to_node):
+        """
+        Returns the first waypoint segment of the HierarchicalAStar path
+        and the iterator of the remaining ones, or None and None if unreachable
+        """
+        path = self._hierarchical.search_abstract(from_node, to_node)
         if path is None:
-            print("'%s' unable to go to goal %s" % (name, pos))
+            return None, None
+        segments = self._hierarchical.refine(path)
+        # a single node path has no segments
+        segment = next(segments, path)
+        if segment is None:
+            return None, None
+        return segment, segments
+
+    def _replan_paths(self):
+        """
+        Repair the paths after edges of the waypoints changed.
+
+        Each agent keeps a DStarLite from its first repair on,
+        so later changes only re-evaluate the affected waypoints.
+        Paths on FlowFields are renewed by those, paths with hierarchical
+        segments and paths on the NavMesh are searched again.
+        """
+        for name, path in list(self._paths.items()):
+            if path.flow_field is not None:
+                continue
+            node = path.path[min(path.cur_index, len(path.path) - 1)]
+            segments = None
+            if path.segments is not None:
+                new_path, segments = self._search_hierarchical(node, path.goal_node)
+            elif self._navmesh:
+                new_path = self._navmesh.search(node, path.goal_node)
+            else:
+                replanner = self._replanners.get(name)
+                if replanner is None or replanner.goal_node != path.goal_node:
+                    replanner = self._replanners[name] = DStarLite(self.chunk.waypoints, node, path.goal_node)
+                new_path = replanner.replan(node)
+            if new_path is None:
+                print("'%s' unable to go to goal %s" % (name, self.chunk.waypoints.id_to_pos[path.goal_node]))
+                del self._paths[name]
+            elif len(new_path) > 1:
+                if segments is not None or new_path != path.path[path.cur_index:]:
+                    self._paths[name] = AgentPath(
+                        self, name, new_path, segments=segments, goal_node=path.goal_node
+                    )
+            else:
+                del self._paths[name]
+        if self._path_debug_renderer:
+            self._path_debug_renderer.path_changed = True
+
+    def _follow_flow_field(self, name, leader):
+        """Walk towards the leader on the FlowField shared by all its followers"""
+        key = ("follow", leader)
+        goal_node = self.get_closest_waypoint(leader)
+        if key not in self._flow_fields:
+            self._flow_fields[key] = FlowField(self.chunk.waypoints, goal_node)
+        else:
+            self._flow_fields[key].set_goal(goal_node)
+        self._scheduler.cancel(name)
+        self._set_flow_path(name, key, stop_distance=2.)
+
+    def _set_flow_path(self, name, key, stop_distance=0.):
+        flow_field = self._flow_fields[key]
+        segments = flow_field.walk(self.get_closest_waypoint(name), stop_distance)
+        path = next(segments, None)
+        if path is not None:
+            self._paths[name] = AgentPath(
+                self, name, path, segments=segments, goal_node=flow_field.goal_node, flow_field=flow_field
+            )
+            self._paths[name].flow_key = key
+            self.num_paths += 1
+            if self._path_debug_renderer:
+                self._path_debug_renderer.path_changed = True
+
+    def _set_path(self, name, path, goal_node, segments=None):
+        if path is None:
+            print("'%s' unable to go to goal %s" % (name, self.chunk.waypoints.id_to_pos[goal_node]))
             return
+        self.num_paths += 1
         if len(path) > 1:
-            self._paths[name] = AgentPath(self, name, path)
+            self._paths[name] = AgentPath(self, name, path, segments=segments, goal_node=goal_node)
             if self._path_debug_renderer:
                 self._path_debug_renderer.path_changed = True
 
@@ -100,23 +290,43 @@ class Agents:
         return self._path_debug_renderer
 
 
+# returned by next() when all segments of an AgentPath were yielded
+_END_OF_SEGMENTS = object()
+
+
 class AgentPath:
-    """Temp structure to store and advance a path for an agent"""
+    """
+    Temp structure to store and advance a path for an agent
+
+    If `segments` is given, it yields the remaining parts of the path,
+    which are appended when the agent reaches the end of the current one.
+    """
 
-    def __init__(self, agents, name, path):
+    def __init__(self, agents, name, path, segments=None, goal_node=None, flow_field=None):
         assert len(path) > 1
         self.agents = agents
         self.waypoints = self.agents.chunk.waypoints
         self.name = name
         self.path = path
+        self.segments = segments
+        # the FlowField of the segments and its key in Agents
+        self.flow_field = flow_field
+        self.flow_key = None
         self.agent = self.agents[self.name]
-        self.goal_pos = self.waypoints.id_to_pos[self.path[-1]]
+        self.goal_node = self.path[-1] if goal_node is None else goal_node
+        self.goal_pos = self.waypoints.id_to_pos[self.goal_node]
         self.cur_index = 0
         self.min_dist = 0.2
 
     def finished(self):
         if self.cur_index >= len(self.path):
             return True
+        # reached the last node
+        if self.segments is None and self.cur_index+1 >= len(self.path):
+            return True
+        if self.flow_field is not None:
+            # the goal may move
+            self.goal_pos = self.waypoints.id_to_pos[self.flow_field.goal_node]
         return glm.distance(self.agent.sposition, glm.vec3(*self.goal_pos)) <= self.min_dist
 
     def pos_at(self, index):
@@ -131,6 +341,21 @@ class AgentPath:
         return glm.normalize(self.pos_at(i1) - self.pos_at(i))
 
     def update(self, dt):
+        if self.segments is not None and self.cur_index+2 >= len(self.path):
+            segment = next(self.segments, _END_OF_SEGMENTS)
+            if segment is _END_OF_SEGMENTS:
+                self.segments = None
+            else:
+                if segment is None:
+                    # the waypoints changed since the path was searched
+                    segment, self.segments = self.agents._search_hierarchical(self.path[-1], self.goal_node)
+                    if segment is None:
+                        print("'%s' unable to go to goal %s" % (self.name, self.goal_pos))
+                if segment is not None:
+                    self.path = self.path + segment[1:]
+                    if self.agents._path_debug_renderer:
+                        self.agents._path_debug_renderer.path_changed = True
+
         if self.cur_index+1 >= len(self.path):
             return False
 
@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+from typing import Optional, List, Sequence, Tuple
+
+import numpy as np
+
+from .AStar import AStar
+from .WayPointsCSR import WayPointsCSR
+
+
+class _SnapshotAStar(AStar):
+    """AStar on a fixed WayPointsCSR instead of the current graph of a WayPoints"""
+
+    def __init__(self, graph: WayPointsCSR):
+        super().__init__(None)
+        self._graph = graph
+
+    def graph(self):
+        return self._graph
+
+
+# the AStar of the graph snapshot and its shared memory in each worker process
+_worker_astar: Optional[_SnapshotAStar] = None
+_worker_blocks = []
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13, the registration goes to the resource tracker
+        # of the main process which already knows the block
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(arrays: dict):
+    global _worker_astar
+    views = dict()
+    for key, (name, shape, dtype) in arrays.items():
+        shm = _attach_shared_memory(name)
+        _worker_blocks.append(shm)
+        views[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _worker_astar = _SnapshotAStar(
+        WayPointsCSR(views["positions"], views["indptr"], views["indices"], views["costs"])
+    )
+
+
+def _solve(pairs: List[Tuple[int, int]]) -> List[Optional[List[int]]]:
+    return [_worker_astar.search(start, end) for start, end in pairs]
+
+
+class BatchPathSolver:
+    """
+    Solves many (start node, goal node) path requests in parallel worker processes.
+
+    The CSR arrays of the WayPoints are copied into shared memory once
+    and every worker process builds its read-only snapshot from there.
+    When the `version` of the WayPoints changes, the snapshot and the
+    worker processes are renewed with the next `solve`.
+
+    Batches smaller than `min_batch_size` are solved in this process.
+    Call `release` to stop the processes and free the shared memory.
+    """
+
+    def __init__(self, waypoints, num_processes: Optional[int] = None, min_batch_size: int = 32):
+        self.waypoints = waypoints
+        self.num_processes = num_processes or os.cpu_count() or 1
+        self.min_batch_size = min_batch_size
+        self._astar = AStar(waypoints)
+        self._pool = None
+        self._blocks = []
+        self._version = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def __del__(self):
+        self.release()
+
+    @property
+    def is_running(self) -> bool:
+        return self._pool is not None
+
+    def release(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+        self._version = None
+
+    def solve(self, pairs: Sequence[Tuple[int, int]]) -> List[Optional[List[int]]]:
+        """Returns the list of node ids or None for each (start, goal) pair"""
+        pairs = [(int(start), int(end)) for start, end in pairs]
+        if len(pairs) < self.min_batch_size or self.num_processes < 2:
+            return [self._astar.search(start, end) for start, end in pairs]
+
+        if self._version != self.waypoints.version:
+            self.release()
+        if self._pool is None:
+            self._start()
+
+        num_chunks = self.num_processes * 4
+        chunk_size = (len(pairs) + num_chunks - 1) // num_chunks
+        chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+        paths = []
+        for result in self._pool.map(_solve, chunks):
+            paths += result
+        return paths
+
+    def _start(self):
+        graph = self.waypoints.csr(z_penalty=self._astar.Z_PENALTY)
+        arrays = dict()
+        for key in ("positions", "indptr", "indices", "costs"):
+            array = getattr(graph, key)
+            shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            self._blocks.append(shm)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            arrays[key] = (shm.name, array.shape, array.dtype.str)
+
+        self._version = self.waypoints.version
+        self._pool = multiprocessing.get_context().Pool(
+            self.num_processes, initializer=_init_worker, initargs=(arrays,),
+        )
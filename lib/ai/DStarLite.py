@@ -0,0 +1,198 @@
+import heapq
+import math
+from typing import Optional, List
+
+from .AStar import AStar
+
+
+class DStarLite:
+    """
+    Incremental path search (D* Lite) from a moving start node to a fixed goal node.
+
+    The search runs backwards from the goal and keeps its state, so after
+    edges of the WayPoints were added or removed, `replan` only
+    re-evaluates the nodes whose distance to the goal changed,
+    instead of searching the whole map again.
+
+    Step costs are those of AStar: length plus `z_penalty` per unit of height difference.
+    """
+
+    def __init__(self, waypoints, start_node: int, goal_node: int, z_penalty: float = AStar.Z_PENALTY):
+        self.waypoints = waypoints
+        self.start_node = start_node
+        self.goal_node = goal_node
+        self.z_penalty = z_penalty
+        # number of nodes evaluated by all searches
+        self.num_expanded = 0
+        self._reset()
+
+    def _reset(self):
+        """Search from scratch on the current WayPoints"""
+        self._g = dict()
+        self._rhs = {self.goal_node: 0.}
+        self._open = dict()
+        self._heap = []
+        self._km = 0.
+        # node -> [(adjacent node, step cost), ...]
+        self._edges = dict()
+        self._last_node = self.start_node
+        self._version = self.waypoints.version
+        self._push(self.goal_node, (self._heuristic(self.start_node, self.goal_node), 0.))
+        self._compute_shortest_path()
+
+    def __repr__(self):
+        return "DStarLite(start=%s, goal=%s)" % (self.start_node, self.goal_node)
+
+    def distance(self, node: Optional[int] = None) -> float:
+        """Path cost from `node` (default start node) to the goal"""
+        return self._g.get(self.start_node if node is None else node, math.inf)
+
+    def path(self) -> Optional[List[int]]:
+        """Returns the list of nodes from the start node to the goal or None"""
+        if self.distance() == math.inf:
+            return None
+        node = self.start_node
+        path = [node]
+        g, rhs = self._g, self._rhs
+        while node != self.goal_node:
+            candidates = [
+                (cost + g.get(n, math.inf), cost + rhs.get(n, math.inf), n)
+                for n, cost in self._adjacent(node)
+            ]
+            best_cost = min(candidates, default=(math.inf,))[0]
+            if best_cost == math.inf or len(path) > self.waypoints.num_nodes:
+                return None
+            # nodes that were not re-evaluated may have an outdated g on par with the best,
+            #   the rhs tells them apart
+            node = min((c[1], c[2]) for c in candidates if c[0] <= best_cost + 1e-9)[1]
+            path.append(node)
+        return path
+
+    def move_start(self, node: int):
+        """Set the new start node, e.g. the current node of the agent"""
+        self._set_start(node)
+        self._compute_shortest_path()
+
+    def replan(self, start_node: Optional[int] = None) -> Optional[List[int]]:
+        """
+        Update to the changed edges of the WayPoints, optionally from a new start node,
+        and return the new path
+        """
+        if start_node is not None:
+            self._set_start(start_node)
+        changes = self.waypoints.changed_edges(self._version)
+        if changes is None:
+            self._reset()
+            return self.path()
+        self._version = self.waypoints.version
+
+        nodes = {n for edge in changes for n in edge}
+        for node in nodes:
+            self._edges.pop(node, None)
+        for node in nodes:
+            self._update_rhs(node)
+        self._compute_shortest_path()
+        return self.path()
+
+    def _set_start(self, node: int):
+        if node != self.start_node:
+            self._km += self._heuristic(self._last_node, node)
+            self._last_node = node
+            self.start_node = node
+
+    def _adjacent(self, node: int) -> list:
+        edges = self._edges.get(node)
+        if edges is None:
+            id_to_pos, z_penalty = self.waypoints.id_to_pos, self.z_penalty
+            px, py, pz = id_to_pos[node]
+            edges = []
+            for n in self.waypoints.adjacent_nodes(node):
+                x, y, z = id_to_pos[n]
+                x, y, z = x - px, y - py, z - pz
+                edges.append((n, math.sqrt(x*x + y*y + z*z) + abs(z) * z_penalty))
+            self._edges[node] = edges
+        return edges
+
+    def _heuristic(self, n1: int, n2: int) -> float:
+        p1 = self.waypoints.id_to_pos[n1]
+        p2 = self.waypoints.id_to_pos[n2]
+        x, y, z = p1[0] - p2[0], p1[1] - p2[1], p1[2] - p2[2]
+        return math.sqrt(x*x + y*y + z*z)
+
+    def _key(self, node: int) -> tuple:
+        value = min(self._g.get(node, math.inf), self._rhs.get(node, math.inf))
+        return value + self._heuristic(self.start_node, node) + self._km, value
+
+    def _push(self, node: int, key: tuple):
+        self._open[node] = key
+        heapq.heappush(self._heap, (key, node))
+
+    def _update_vertex(self, node: int):
+        if self._g.get(node, math.inf) != self._rhs.get(node, math.inf):
+            self._push(node, self._key(node))
+        else:
+            self._open.pop(node, None)
+
+    def _update_rhs(self, node: int):
+        if node != self.goal_node:
+            g = self._g
+            self._rhs[node] = min(
+                (cost + g.get(n, math.inf) for n, cost in self._adjacent(node)),
+                default=math.inf,
+            )
+        self._update_vertex(node)
+
+    def _compute_shortest_path(self):
+        g, rhs, start, goal = self._g, self._rhs, self.start_node, self.goal_node
+        open, heap = self._open, self._heap
+        inf, sqrt, heappush, heappop = math.inf, math.sqrt, heapq.heappush, heapq.heappop
+        sx, sy, sz = self.waypoints.id_to_pos[start]
+        id_to_pos, km = self.waypoints.id_to_pos, self._km
+
+        def key(node):
+            value = min(g.get(node, inf), rhs.get(node, inf))
+            x, y, z = id_to_pos[node]
+            x, y, z = x - sx, y - sy, z - sz
+            return value + sqrt(x*x + y*y + z*z) + km, value
+
+        def update_vertex(node):
+            if g.get(node, inf) != rhs.get(node, inf):
+                k = key(node)
+                open[node] = k
+                heappush(heap, (k, node))
+            else:
+                open.pop(node, None)
+
+        while True:
+            # top of the queue, dropping outdated heap entries
+            while heap and open.get(heap[0][1]) != heap[0][0]:
+                heappop(heap)
+            if not heap:
+                return
+            k, node = heap[0]
+            if k >= key(start) and rhs.get(start, inf) == g.get(start, inf):
+                return
+
+            new_key = key(node)
+            if k < new_key:
+                open[node] = new_key
+                heappush(heap, (new_key, node))
+                continue
+
+            self.num_expanded += 1
+            del open[node]
+            g_node = g.get(node, inf)
+            if g_node > rhs.get(node, inf):
+                # distance got shorter, propagate to the neighbours
+                g_node = g[node] = rhs[node]
+                for n, cost in self._adjacent(node):
+                    if n != goal and cost + g_node < rhs.get(n, inf):
+                        rhs[n] = cost + g_node
+                    update_vertex(n)
+            else:
+                # distance got longer, re-evaluate the node and the neighbours that relied on it
+                g[node] = inf
+                self._update_rhs(node)
+                for n, cost in self._adjacent(node):
+                    if rhs.get(n, inf) == cost + g_node:
+                        self._update_rhs(n)
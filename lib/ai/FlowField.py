@@ -0,0 +1,122 @@
+from typing import Optional, List, Iterator
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from .AStar import AStar
+
+
+class FlowField:
+    """
+    Distance-to-goal field (Dijkstra map) over WayPoints.
+
+    After computing it once for a goal, the next waypoint towards the goal
+    is a single array lookup for every node, so any number of agents
+    can share it.
+
+    When the goal moves less than `refresh_radius` (in path cost),
+    `set_goal` only recalculates the nodes within `refresh_radius` of
+    the new goal. All other nodes keep pointing towards the previous
+    goal, which lies inside that area, where the exact field takes over.
+    """
+
+    def __init__(self, waypoints, goal_node: int, refresh_radius: float = 16.):
+        self.waypoints = waypoints
+        self.refresh_radius = refresh_radius
+        self.z_penalty = AStar.Z_PENALTY
+        self.goal_node = goal_node
+        self.num_full_updates = 0
+        self.num_partial_updates = 0
+        self._graph = None
+        self._matrix = None
+        # field of the last full update
+        self._base_goal = None
+        self._base_distances = None
+        self._base_next = None
+        self.distances = None
+        self.next_nodes = None
+        self._update_full()
+
+    def __repr__(self):
+        return "FlowField(goal=%s, %s nodes)" % (self.goal_node, len(self.next_nodes))
+
+    def next_node(self, node: int) -> int:
+        """Returns the next node towards the goal, the goal itself for the goal, or -1 if unreachable"""
+        if self.waypoints.csr(z_penalty=self.z_penalty) is not self._graph:
+            self._update_full()
+        return int(self.next_nodes[node])
+
+    def distance(self, node: int) -> float:
+        """
+        Path cost to the goal, exact for the nodes within `refresh_radius`
+        and an upper bound for the others
+        """
+        return float(self.distances[node])
+
+    def set_goal(self, goal_node: int):
+        if goal_node == self.goal_node and self.waypoints.csr(z_penalty=self.z_penalty) is self._graph:
+            return
+        self.goal_node = goal_node
+        if self.waypoints.csr(z_penalty=self.z_penalty) is not self._graph:
+            self._update_full()
+            return
+
+        distances, predecessors = scipy.sparse.csgraph.dijkstra(
+            self._matrix, indices=goal_node, return_predecessors=True, limit=self.refresh_radius,
+        )
+        # the base goal must be within the exact area, or the old field leads nowhere
+        if not np.isfinite(distances[self._base_goal]):
+            self._update_full()
+            return
+
+        self.num_partial_updates += 1
+        inner = np.isfinite(distances)
+        self.distances = self._base_distances + distances[self._base_goal]
+        self.distances[inner] = distances[inner]
+        self.next_nodes = self._base_next.copy()
+        self.next_nodes[inner] = predecessors[inner]
+        self.next_nodes[goal_node] = goal_node
+
+    def path(self, start_node: int) -> Optional[List[int]]:
+        """Returns the list of nodes from start_node to the goal or None"""
+        if self.next_node(start_node) < 0:
+            return None
+        path = [start_node]
+        while path[-1] != self.goal_node:
+            path.append(int(self.next_nodes[path[-1]]))
+        return path
+
+    def walk(self, start_node: int, stop_distance: float = 0.) -> Iterator[List[int]]:
+        """
+        Yields [node, next node] segments towards the goal, reading the field
+        at each step so that changes of the goal are followed.
+        Stops at the goal or when the distance gets below `stop_distance`.
+        """
+        node = start_node
+        while node != self.goal_node and self.distance(node) > stop_distance:
+            next_node = self.next_node(node)
+            if next_node < 0:
+                return
+            yield [node, next_node]
+            node = next_node
+
+    def _update_full(self):
+        graph = self.waypoints.csr(z_penalty=self.z_penalty)
+        if graph is not self._graph:
+            self._graph = graph
+            self._matrix = scipy.sparse.csr_matrix(
+                (graph.costs, graph.indices, graph.indptr), shape=(graph.num_nodes, graph.num_nodes)
+            )
+        self.num_full_updates += 1
+        distances, predecessors = scipy.sparse.csgraph.dijkstra(
+            self._matrix, indices=self.goal_node, return_predecessors=True,
+        )
+        # predecessors on the paths from the goal are the next nodes towards it
+        predecessors[predecessors < 0] = -1
+        predecessors[self.goal_node] = self.goal_node
+        self._base_goal = self.goal_node
+        self._base_distances = distances
+        self._base_next = predecessors
+        self.distances = distances
+        self.next_nodes = predecessors
@@ -0,0 +1,312 @@
+from typing import Optional, List, Dict, Iterator
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from .AStar import AStar
+from .AStarSearch import AStarSearch
+
+
+class _Cluster:
+    """The nodes of one cluster, their local graph and the costs between the entrances"""
+
+    def __init__(self, key, nodes: np.ndarray):
+        self.key = key
+        self.nodes = nodes
+        self.local_index = {n: i for i, n in enumerate(nodes.tolist())}
+        # node -> [(neighbor, cost), ...] restricted to this cluster
+        self.adjacency = dict()
+        self.matrix = None
+        self.entrances = []
+        # entrance -> [(entrance, cost), ...]
+        self.entrance_costs = dict()
+
+    def costs_from(self, node: int) -> Dict[int, float]:
+        """path costs from `node` to all reachable entrances, staying inside the cluster"""
+        distances = scipy.sparse.csgraph.dijkstra(self.matrix, indices=self.local_index[node])
+        return {
+            e: float(distances[self.local_index[e]])
+            for e in self.entrances
+            if e != node and np.isfinite(distances[self.local_index[e]])
+        }
+
+
+class HierarchicalAStar:
+    """
+    Hierarchical path-finding (HPA*) on top of WayPoints.
+
+    Nodes are partitioned into square clusters of `cluster_size` in x and y.
+    Each connected run of edges between two neighbouring clusters gets
+    one entrance edge. The costs between the entrances of a cluster are
+    precomputed, which gives a small abstract graph that is searched first.
+
+    The abstract path is refined to waypoints segment by segment with
+    A* inside a single cluster, so only the part that is about to be
+    walked needs to be computed (see `refine`).
+
+    Edge costs are those of AStar (length plus z-penalty). The paths
+    are near-optimal, they always pass through the entrance edges.
+
+    When edges of the WayPoints are added or removed, only the clusters
+    around them are rebuilt with the next search (see `WayPoints.changed_edges`).
+    If the changes are no longer logged, all clusters are rebuilt.
+    """
+
+    def __init__(self, waypoints, cluster_size: int = 16):
+        self.nodes = waypoints
+        self.cluster_size = cluster_size
+        self.z_penalty = AStar.Z_PENALTY
+        self.num_expanded = 0
+        self._csr = None
+        self._node_cluster = []
+        self._clusters: Dict[tuple, _Cluster] = dict()
+        # (cluster1, cluster2) -> [(node1, node2, cost), ...] with node1 in cluster1
+        self._pair_entrances = dict()
+        # entrance -> [(entrance, cost), ...]
+        self._abstract = dict()
+        self._dirty = set()
+        self._rebuild_all = True
+        # version of the WayPoints at the last build
+        self._version = None
+
+    @property
+    def num_clusters(self) -> int:
+        self._update()
+        return len(self._clusters)
+
+    @property
+    def num_entrances(self) -> int:
+        self._update()
+        return len(self._abstract)
+
+    def cluster_key(self, node: int) -> tuple:
+        self._update()
+        return self._node_cluster[node]
+
+    def invalidate(self, box_min: Optional[tuple] = None, box_max: Optional[tuple] = None):
+        """
+        Rebuild the clusters touching the inclusive xyz box with the next search,
+        or all clusters if no box is given. Changed edges are tracked automatically,
+        this is only needed for other changes of the WayPoints.
+
+        Node ids of the WayPoints must stay the same, new nodes may be added.
+        """
+        if box_min is None or box_max is None:
+            self._rebuild_all = True
+            return
+        cs = self.cluster_size
+        for cy in range(int(box_min[1]) // cs, int(box_max[1]) // cs + 1):
+            for cx in range(int(box_min[0]) // cs, int(box_max[0]) // cs + 1):
+                self._dirty.add((cx, cy))
+
+    def search(self, start_node: int, end_node: int) -> Optional[List[int]]:
+        """Returns the complete list of node ids from start_node to end_node or None"""
+        abstract_path = self.search_abstract(start_node, end_node)
+        if abstract_path is None:
+            return None
+        path = [start_node]
+        for segment in self.refine(abstract_path):
+            path += segment[1:]
+        return path
+
+    def search_abstract(self, start_node: int, end_node: int) -> Optional[List[int]]:
+        """
+        Returns start_node, the entrance nodes in between and end_node, or None.
+        Consecutive nodes are either in the same cluster or connected by an edge.
+        """
+        self._update()
+        self.num_expanded = 0
+        if start_node == end_node:
+            return [start_node]
+
+        start_cluster = self._clusters[self._node_cluster[start_node]]
+        end_cluster = self._clusters[self._node_cluster[end_node]]
+        if start_cluster is end_cluster:
+            if self._search(start_cluster.adjacency, start_node, end_node) is not None:
+                return [start_node, end_node]
+
+        # temporarily connect start and end to the entrances of their clusters
+        extra = dict()
+        extra[start_node] = list(start_cluster.costs_from(start_node).items())
+        for entrance, cost in end_cluster.costs_from(end_node).items():
+            extra.setdefault(entrance, []).append((end_node, cost))
+
+        return self._search(self._abstract, start_node, end_node, extra)
+
+    def refine(self, abstract_path: List[int]) -> Iterator[List[int]]:
+        """
+        Yields the waypoint segments between consecutive nodes of the abstract path.
+
+        Each segment is searched on the current WayPoints, a segment that
+        became unreachable since the abstract search is yielded as None.
+        """
+        for n1, n2 in zip(abstract_path, abstract_path[1:]):
+            self._update()
+            cluster_key = self._node_cluster[n1]
+            if cluster_key != self._node_cluster[n2]:
+                yield [n1, n2] if n2 in self.nodes.adjacent_nodes(n1) else None
+            else:
+                yield self._search(self._clusters[cluster_key].adjacency, n1, n2)
+
+    def _search(self, adjacency: dict, start_node: int, end_node: int, extra: Optional[dict] = None):
+        search = AStarSearch(self._csr, start_node, end_node, adjacency, extra)
+        path = search.run()
+        self.num_expanded += search.num_expanded
+        return path
+
+    # --- building ---
+
+    def _update(self):
+        csr = self.nodes.csr(z_penalty=self.z_penalty)
+        if csr is self._csr and not self._dirty and not self._rebuild_all:
+            return
+        if csr is not self._csr and not self._rebuild_all:
+            self._invalidate_changed_edges()
+        self._csr = csr
+        self._version = self.nodes.version
+
+        cs = self.cluster_size
+        cluster_xy = np.floor_divide(csr.positions[:, :2], cs).astype("int64")
+        self._node_cluster = [tuple(c) for c in cluster_xy.tolist()]
+
+        if self._rebuild_all:
+            rebuild = None
+            self._clusters.clear()
+            self._pair_entrances.clear()
+        else:
+            # entrances of the neighbours depend on the dirty clusters
+            rebuild = {
+                (cx + x, cy + y)
+                for cx, cy in self._dirty
+                for y in (-1, 0, 1) for x in (-1, 0, 1)
+            }
+            for key in rebuild:
+                self._clusters.pop(key, None)
+            for pair in list(self._pair_entrances):
+                if pair[0] in rebuild or pair[1] in rebuild:
+                    del self._pair_entrances[pair]
+
+        self._dirty.clear()
+        self._rebuild_all = False
+
+        if len(cluster_xy):
+            keys, inverse = np.unique(cluster_xy, axis=0, return_inverse=True)
+            order = np.argsort(inverse.reshape(-1), kind="stable")
+            splits = np.cumsum(np.bincount(inverse.reshape(-1), minlength=len(keys)))[:-1]
+            for key, nodes in zip(keys.tolist(), np.split(order, splits)):
+                key = tuple(key)
+                if rebuild is None or key in rebuild:
+                    self._clusters[key] = self._create_cluster(key, nodes)
+
+        self._create_pair_entrances(rebuild)
+
+        for cluster in self._clusters.values():
+            if rebuild is None or cluster.key in rebuild:
+                self._create_entrance_costs(cluster)
+
+        self._abstract = dict()
+        for cluster in self._clusters.values():
+            for entrance, costs in cluster.entrance_costs.items():
+                self._abstract.setdefault(entrance, []).extend(costs)
+        for edges in self._pair_entrances.values():
+            for n1, n2, cost in edges:
+                self._abstract.setdefault(n1, []).append((n2, cost))
+                self._abstract.setdefault(n2, []).append((n1, cost))
+
+    def _invalidate_changed_edges(self):
+        changes = None if self._version is None else self.nodes.changed_edges(self._version, positions=True)
+        if not changes:
+            # not logged or changed without edges
+            self._rebuild_all = True
+            return
+        for p1, p2 in changes:
+            self.invalidate(
+                tuple(min(a, b) for a, b in zip(p1, p2)),
+                tuple(max(a, b) for a, b in zip(p1, p2)),
+            )
+
+    def _create_cluster(self, key, nodes: np.ndarray) -> _Cluster:
+        cluster = _Cluster(key, nodes)
+        _, indptr, indices, costs = self._csr.to_lists()
+        node_cluster = self._node_cluster
+        rows, cols, values = [], [], []
+        for node in cluster.local_index:
+            adj = []
+            for k in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[k]
+                if node_cluster[neighbor] == key:
+                    adj.append((neighbor, costs[k]))
+                    rows.append(cluster.local_index[node])
+                    cols.append(cluster.local_index[neighbor])
+                    values.append(costs[k])
+            cluster.adjacency[node] = adj
+        cluster.matrix = scipy.sparse.csr_matrix(
+            (values, (rows, cols)), shape=(len(nodes), len(nodes))
+        )
+        return cluster
+
+    def _create_pair_entrances(self, rebuild: Optional[set]):
+        """Pick one edge of every connected run of edges between two clusters"""
+        _, indptr, indices, costs = self._csr.to_lists()
+        node_cluster = self._node_cluster
+
+        crossing = dict()
+        for key, cluster in self._clusters.items():
+            for node in cluster.local_index:
+                for k in range(indptr[node], indptr[node + 1]):
+                    neighbor = indices[k]
+                    other = node_cluster[neighbor]
+                    if other == key or key > other:
+                        continue
+                    if rebuild is not None and key not in rebuild and other not in rebuild:
+                        continue
+                    crossing.setdefault((key, other), []).append((node, neighbor, costs[k]))
+
+        for pair, edges in crossing.items():
+            if pair[1] not in self._clusters:
+                continue
+            # group the edges whose end-points are connected along the border,
+            # on both sides without leaving the cluster
+            border = {n for e in edges for n in e[:2]}
+            group = {n: n for n in border}
+
+            def find(n):
+                while group[n] != n:
+                    group[n] = group[group[n]]
+                    n = group[n]
+                return n
+
+            for node in border:
+                for k in range(indptr[node], indptr[node + 1]):
+                    neighbor = indices[k]
+                    if neighbor in border and node_cluster[neighbor] == node_cluster[node]:
+                        group[find(node)] = find(neighbor)
+
+            runs = dict()
+            for edge in edges:
+                runs.setdefault((find(edge[0]), find(edge[1])), []).append(edge)
+            self._pair_entrances[pair] = [
+                run[len(run) // 2]
+                for run in (sorted(r) for r in runs.values())
+            ]
+
+    def _create_entrance_costs(self, cluster: _Cluster):
+        entrances = set()
+        for (c1, c2), edges in self._pair_entrances.items():
+            if c1 == cluster.key:
+                entrances |= {e[0] for e in edges}
+            elif c2 == cluster.key:
+                entrances |= {e[1] for e in edges}
+        cluster.entrances = sorted(entrances)
+        cluster.entrance_costs = dict()
+        if not cluster.entrances:
+            return
+        local = [cluster.local_index[e] for e in cluster.entrances]
+        distances = scipy.sparse.csgraph.dijkstra(cluster.matrix, indices=local)[:, local]
+        for i, e1 in enumerate(cluster.entrances):
+            cluster.entrance_costs[e1] = [
+                (e2, float(distances[i, j]))
+                for j, e2 in enumerate(cluster.entrances)
+                if i != j and np.isfinite(distances[i, j])
+            ]
@@ -0,0 +1,416 @@
+import heapq
+import math
+from typing import Optional, List, Tuple
+
+from .AStar import AStar
+
+
+class _Portal:
+    """
+    A contiguous run of waypoint edges between two regions.
+
+    `edges` are the (node in region1, node in region2) pairs sorted along
+    the shared border, `p0` and `p1` the xyz midpoints of the first and last edge.
+    """
+
+    def __init__(self, index: int, region1: int, region2: int, edges: list, midpoints: list):
+        self.index = index
+        self.region1 = region1
+        self.region2 = region2
+        self.edges = edges
+        self.p0 = midpoints[0]
+        self.p1 = midpoints[-1]
+        self.center = tuple((a + b) / 2. for a, b in zip(self.p0, self.p1))
+        # the points where the search may cross the portal, the ends only for longer portals
+        self.points = [self.center] if len(edges) < 4 else [self.p0, self.center, self.p1]
+        self.is_step = midpoints[0][2] != math.floor(midpoints[0][2])
+
+    def other(self, region: int) -> int:
+        return self.region2 if region == self.region1 else self.region1
+
+    def edge_from(self, region: int, index: int) -> Tuple[int, int]:
+        """The `index`th edge as (node on `region` side, node on the other side)"""
+        n1, n2 = self.edges[index]
+        return (n1, n2) if region == self.region1 else (n2, n1)
+
+
+class NavMesh:
+    """
+    Navigation mesh over the nodes of WayPoints.
+
+    Walkable nodes at the same height are merged into rectangular regions
+    in which every node is connected to its four neighbours, so any two
+    positions inside a region can be walked in a straight line.
+    Neighbouring regions are connected by portals, the runs of waypoint
+    edges that cross their borders.
+
+    `search` runs A* over the portals and then pulls the path straight
+    through them (funnel algorithm). The result is a list of waypoint node
+    ids like from AStar, with far fewer nodes, where consecutive nodes are
+    either connected in a straight line over walkable nodes of the same height
+    or are the two nodes of a step up or down.
+
+    The mesh is rebuilt when the `version` of the WayPoints changes.
+    """
+
+    def __init__(self, waypoints, z_penalty: float = AStar.Z_PENALTY):
+        self.waypoints = waypoints
+        self.z_penalty = z_penalty
+        # number of portals evaluated by the last search
+        self.num_expanded = 0
+        self._astar = AStar(waypoints)
+        self._version = None
+        # [(x0, y0, x1, y1, z)] inclusive node coordinates of each region
+        self.regions = []
+        self.portals: List[_Portal] = []
+        self._node_region = []
+        self._region_portals = []
+        self._states = []
+        self._state_index = dict()
+        self._state_pos = []
+        self._region_states = []
+        self._state_edges = []
+        self._build()
+
+    def __repr__(self):
+        return "NavMesh(%s nodes, %s regions, %s portals)" % (
+            self.waypoints.num_nodes, self.num_regions, self.num_portals,
+        )
+
+    @property
+    def num_regions(self) -> int:
+        return len(self.regions)
+
+    @property
+    def num_portals(self) -> int:
+        return len(self.portals)
+
+    def region_of(self, node: int) -> int:
+        self._check_version()
+        return self._node_region[node]
+
+    def search_regions(self, start_node: int, end_node: int) -> Optional[List[int]]:
+        """Returns the list of region ids from start_node to end_node or None"""
+        corridor = self._search_portals(start_node, end_node)
+        if corridor is None:
+            return None
+        return [region for region, portal in corridor]
+
+    def search(self, start_node: int, end_node: int) -> Optional[List[int]]:
+        """Returns the smoothed list of node ids from start_node to end_node or None"""
+        corridor = self._search_portals(start_node, end_node)
+        if corridor is None:
+            return None
+
+        # the funnel runs on each part between steps up or down
+        path = [start_node]
+        part = []
+        for region, portal in corridor[1:]:
+            portal = self.portals[portal]
+            if not portal.is_step:
+                part.append((region, portal))
+                continue
+            n1, n2 = self._choose_step_edge(path[-1], region, portal, corridor)
+            self._pull_straight(path, part, n1)
+            path.append(n2)
+            part = []
+        self._pull_straight(path, part, end_node)
+        path = self._repair(path)
+        return None if path is None else self._shortcut(path)
+
+    def _check_version(self):
+        if self._version != self.waypoints.version:
+            self._build()
+
+    def _build(self):
+        waypoints = self.waypoints
+        self._version = waypoints.version
+        id_to_pos, pos_to_id = waypoints.id_to_pos, waypoints.pos_to_id
+        node_region = [-1] * waypoints.num_nodes
+        regions = []
+
+        def _free(x, y, z, from_node):
+            """node at x, y, z that is not yet in a region and connected to from_node"""
+            node = pos_to_id.get((x, y, z))
+            if node is None or node_region[node] >= 0 or node not in waypoints.adjacent_nodes(from_node):
+                return None
+            return node
+
+        # greedy rectangles, first along x, then add rows along y
+        for node in sorted(range(waypoints.num_nodes), key=lambda n: (id_to_pos[n][2], id_to_pos[n][1], id_to_pos[n][0])):
+            if node_region[node] >= 0:
+                continue
+            region = len(regions)
+            x0, y0, z = id_to_pos[node]
+            row = [node]
+            while True:
+                n = _free(x0 + len(row), y0, z, row[-1])
+                if n is None:
+                    break
+                row.append(n)
+            for n in row:
+                node_region[n] = region
+            y1 = y0
+            while True:
+                next_row = []
+                for n in row:
+                    x = id_to_pos[n][0]
+                    n2 = _free(x, y1 + 1, z, n)
+                    if n2 is None or (next_row and next_row[-1] not in waypoints.adjacent_nodes(n2)):
+                        break
+                    next_row.append(n2)
+                if len(next_row) < len(row):
+                    break
+                for n in next_row:
+                    node_region[n] = region
+                row = next_row
+                y1 += 1
+            regions.append((x0, y0, x0 + len(row) - 1, y1, z))
+
+        # runs of border-crossing edges per pair of regions
+        crossings = dict()
+        for n1 in range(waypoints.num_nodes):
+            for n2 in waypoints.adjacent_nodes(n1):
+                r1, r2 = node_region[n1], node_region[n2]
+                if r1 < r2:
+                    p1, p2 = id_to_pos[n1], id_to_pos[n2]
+                    midpoint = tuple((a + b) / 2. for a, b in zip(p1, p2))
+                    crossings.setdefault((r1, r2), []).append((midpoint, (n1, n2)))
+
+        portals = []
+        region_portals = [[] for r in regions]
+        for (r1, r2), edges in crossings.items():
+            edges.sort()
+            run = [edges[0]]
+            for edge in edges[1:] + [None]:
+                if edge is not None and max(abs(a - b) for a, b in zip(edge[0], run[-1][0])) <= 1.:
+                    run.append(edge)
+                    continue
+                portal = _Portal(len(portals), r1, r2, [e[1] for e in run], [e[0] for e in run])
+                portals.append(portal)
+                region_portals[r1].append(portal.index)
+                region_portals[r2].append(portal.index)
+                run = [edge]
+
+        self.regions = regions
+        self.portals = portals
+        self._node_region = node_region
+        self._region_portals = region_portals
+
+        # search states (portal, point on portal, region that the portal leads into)
+        self._states = [
+            (p.index, k, region)
+            for p in portals for k in range(len(p.points)) for region in (p.region1, p.region2)
+        ]
+        self._state_index = {state: i for i, state in enumerate(self._states)}
+        self._state_pos = [portals[p].points[k] for p, k, region in self._states]
+        # region -> states that leave the region
+        self._region_states = [
+            [self._state_index[(p, k, portals[p].other(region))]
+             for p in region_portals[region] for k in range(len(portals[p].points))]
+            for region in range(len(regions))
+        ]
+        # state -> [(next state, cost), ...], not back through the same portal
+        self._state_edges = [
+            [(next_state, self._cost(self._state_pos[state], self._state_pos[next_state]))
+             for next_state in self._region_states[region] if self._states[next_state][0] != p]
+            for state, (p, k, region) in enumerate(self._states)
+        ]
+
+    def _cost(self, p1, p2) -> float:
+        x, y, z = p1[0] - p2[0], p1[1] - p2[1], p1[2] - p2[2]
+        return math.sqrt(x*x + y*y + z*z) + abs(z) * self.z_penalty
+
+    def _search_portals(self, start_node: int, end_node: int) -> Optional[List[Tuple[int, int]]]:
+        """
+        Returns the corridor as list of (region, portal that leads into the region),
+        the first entry is (start region, -1)
+        """
+        self._check_version()
+        id_to_pos, states, state_pos = self.waypoints.id_to_pos, self._states, self._state_pos
+        start_region, end_region = self._node_region[start_node], self._node_region[end_node]
+        self.num_expanded = 0
+        if start_region == end_region:
+            return [(start_region, -1)]
+
+        start_pos, end_pos = id_to_pos[start_node], id_to_pos[end_node]
+        ex, ey, ez = end_pos
+        sqrt, heappush, heappop, inf = math.sqrt, heapq.heappush, heapq.heappop, math.inf
+        # search states are indices into self._states, the goal is -1
+        g_score = dict()
+        came_from = dict()
+        heap = []
+
+        def _push(state, g, from_state):
+            if g < g_score.get(state, inf):
+                g_score[state] = g
+                came_from[state] = from_state
+                if state < 0:
+                    heappush(heap, (g, state))
+                    return
+                x, y, z = state_pos[state]
+                x, y, z = x - ex, y - ey, z - ez
+                heappush(heap, (g + sqrt(x*x + y*y + z*z), state))
+
+        for state in self._region_states[start_region]:
+            _push(state, self._cost(start_pos, state_pos[state]), None)
+        # the states that lead into the end region
+        end_states = set(
+            self._state_index[(p, k, end_region)]
+            for p in self._region_portals[end_region]
+            for k in range(len(self.portals[p].points))
+        )
+
+        closed = set()
+        state_edges = self._state_edges
+        while heap:
+            f, state = heappop(heap)
+            if state in closed:
+                continue
+            if state < 0:
+                corridor = []
+                state = came_from[state]
+                while state is not None:
+                    portal, k, region = states[state]
+                    corridor.append((region, portal))
+                    state = came_from[state]
+                corridor.append((start_region, -1))
+                return list(reversed(corridor))
+            closed.add(state)
+
+            self.num_expanded += 1
+            g = g_score[state]
+            if state in end_states:
+                _push(-1, g + self._cost(state_pos[state], end_pos), state)
+            for next_state, cost in state_edges[state]:
+                if next_state not in closed:
+                    _push(next_state, g + cost, state)
+
+        return None
+
+    def _choose_step_edge(self, from_node: int, region: int, portal: _Portal, corridor) -> Tuple[int, int]:
+        """The edge of a step portal that is closest to the straight line"""
+        id_to_pos = self.waypoints.id_to_pos
+        from_region = portal.other(region)
+        p = id_to_pos[from_node]
+        best, best_dist = None, math.inf
+        for i in range(len(portal.edges)):
+            n1, n2 = portal.edge_from(from_region, i)
+            dist = self._cost(p, id_to_pos[n1])
+            if dist < best_dist:
+                best, best_dist = (n1, n2), dist
+        return best
+
+    def _pull_straight(self, path: list, part: list, end_node: int):
+        """
+        Funnel algorithm from path[-1] through the (region, portal) list `part` to end_node,
+        appends the nodes at the corners and end_node to `path`
+        """
+        id_to_pos = self.waypoints.id_to_pos
+        start = id_to_pos[path[-1]][:2]
+        end = id_to_pos[end_node][:2]
+
+        # (left point, right point, left edge, right edge) in walking direction
+        funnel = [(start, start, None, None)]
+        for region, portal in part:
+            from_region = portal.other(region)
+            e0, e1 = portal.edge_from(from_region, 0), portal.edge_from(from_region, -1)
+            p0, p1 = portal.p0[:2], portal.p1[:2]
+            # left is counter-clockwise of the direction through the portal
+            x0, y0, x1, y1, z = self.regions[from_region]
+            dx, dy = portal.center[0] - (x0 + x1) / 2., portal.center[1] - (y0 + y1) / 2.
+            if dx * (p0[1] - p1[1]) - dy * (p0[0] - p1[0]) >= 0:
+                funnel.append((p0, p1, e0, e1))
+            else:
+                funnel.append((p1, p0, e1, e0))
+        funnel.append((end, end, None, None))
+
+        def triarea2(a, b, c):
+            return (c[0] - a[0]) * (b[1] - a[1]) - (b[0] - a[0]) * (c[1] - a[1])
+
+        apex, left, right = start, start, start
+        apex_i = left_i = right_i = 0
+        i = 1
+        while i < len(funnel):
+            l, r = funnel[i][0], funnel[i][1]
+            if triarea2(apex, right, r) <= 0:
+                if apex == right or triarea2(apex, left, r) > 0:
+                    right, right_i = r, i
+                else:
+                    self._add_corner(path, funnel[left_i][2])
+                    apex, apex_i = left, left_i
+                    left, right, left_i, right_i = apex, apex, apex_i, apex_i
+                    i = apex_i + 1
+                    continue
+            if triarea2(apex, left, l) >= 0:
+                if apex == left or triarea2(apex, right, l) < 0:
+                    left, left_i = l, i
+                else:
+                    self._add_corner(path, funnel[right_i][3])
+                    apex, apex_i = right, right_i
+                    left, right, left_i, right_i = apex, apex, apex_i, apex_i
+                    i = apex_i + 1
+                    continue
+            i += 1
+
+        if path[-1] != end_node:
+            path.append(end_node)
+
+    @staticmethod
+    def _add_corner(path: list, edge):
+        """Add the nodes of the portal edge at a corner of the funnel"""
+        if edge is not None:
+            for node in edge:
+                if node != path[-1]:
+                    path.append(node)
+
+    def _repair(self, path: List[int]) -> Optional[List[int]]:
+        """
+        Replace straight segments that touch non-walkable positions with the waypoint path,
+        returns None if a segment can not be walked
+        """
+        repaired = [path[0]]
+        for n1, n2 in zip(path, path[1:]):
+            if n1 == n2:
+                continue
+            if n2 in self.waypoints.adjacent_nodes(n1) or self._is_straight_walkable(n1, n2):
+                repaired.append(n2)
+            else:
+                segment = self._astar.search(n1, n2)
+                if segment is None:
+                    return None
+                repaired += segment[1:]
+        return repaired
+
+    def _shortcut(self, path: List[int]) -> List[int]:
+        """Skip the nodes that can be passed in a straight line"""
+        shortened = [path[0]]
+        i = 0
+        while i < len(path) - 1:
+            j = i + 1
+            while j + 1 < len(path) and self._is_straight_walkable(path[i], path[j + 1]):
+                j += 1
+            shortened.append(path[j])
+            i = j
+        return shortened
+
+    def _is_straight_walkable(self, n1: int, n2: int, radius: float = .2) -> bool:
+        waypoints = self.waypoints
+        id_to_pos, pos_to_id = waypoints.id_to_pos, waypoints.pos_to_id
+        (x1, y1, z1), (x2, y2, z2) = id_to_pos[n1], id_to_pos[n2]
+        if z1 != z2:
+            return False
+        # same region
+        if self._node_region[n1] == self._node_region[n2]:
+            return True
+        length = math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+        num = max(1, int(length * 4))
+        for i in range(num + 1):
+            t = i / num
+            x, y = x1 + t * (x2 - x1) + .5, y1 + t * (y2 - y1) + .5
+            for ox, oy in ((-radius, -radius), (radius, -radius), (-radius, radius), (radius, radius)):
+                # nodes without edges are blocked
+                node = pos_to_id.get((math.floor(x + ox), math.floor(y + oy), z1))
+                if node is None or not waypoints.adjacent_nodes(node):
+                    return False
+        return True
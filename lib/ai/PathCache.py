@@ -0,0 +1,99 @@
+from collections import OrderedDict, namedtuple
+from typing import Optional, List, Tuple
+
+
+PathCacheInfo = namedtuple("PathCacheInfo", "hits suffix_hits misses invalidations capacity size")
+
+
+class PathCache:
+    """
+    LRU cache of path-finder results keyed by (start node, goal node).
+
+    If a request is not cached but starts on a cached path to the same goal,
+    the rest of that path is returned (a suffix of a shortest path
+    is a shortest path itself).
+
+    All entries are dropped when the `version` of the WayPoints changes.
+    """
+
+    def __init__(self, pathfinder, capacity: int = 256):
+        """
+        :param pathfinder: AStar or anything with `nodes` (WayPoints)
+            and `search(start_node, end_node)`
+        :param capacity: maximum number of cached paths
+        """
+        self.pathfinder = pathfinder
+        self.capacity = capacity
+        # (start, goal) -> (path, {node: index in path}) or None
+        self._paths = OrderedDict()
+        # goal -> set of starts
+        self._starts = dict()
+        self._version = self.pathfinder.nodes.version
+        self.hits = 0
+        self.suffix_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._paths)
+
+    def cache_info(self) -> PathCacheInfo:
+        return PathCacheInfo(
+            self.hits, self.suffix_hits, self.misses, self.invalidations, self.capacity, len(self._paths)
+        )
+
+    def clear(self):
+        self._paths.clear()
+        self._starts.clear()
+
+    def search(self, start_node: int, end_node: int) -> Optional[List[int]]:
+        found, path = self.lookup(start_node, end_node)
+        if not found:
+            path = self.pathfinder.search(start_node, end_node)
+            self.add(start_node, end_node, path)
+        return path if path is None else list(path)
+
+    def lookup(self, start_node: int, end_node: int) -> Tuple[bool, Optional[List[int]]]:
+        """
+        Returns (True, path) if the path or a path containing it is cached,
+        (False, None) otherwise
+        """
+        version = self.pathfinder.nodes.version
+        if version != self._version:
+            self._version = version
+            if self._paths:
+                self.invalidations += 1
+                self.clear()
+
+        key = (start_node, end_node)
+        if key in self._paths:
+            self.hits += 1
+            self._paths.move_to_end(key)
+            entry = self._paths[key]
+            return True, None if entry is None else list(entry[0])
+
+        for start in list(self._starts.get(end_node, ())):
+            entry = self._paths[(start, end_node)]
+            if entry is not None and start_node in entry[1]:
+                self.suffix_hits += 1
+                self._paths.move_to_end((start, end_node))
+                path = entry[0][entry[1][start_node]:]
+                self._add(key, path)
+                return True, list(path)
+
+        self.misses += 1
+        return False, None
+
+    def add(self, start_node: int, end_node: int, path: Optional[List[int]]):
+        """Store a path found for the current version of the WayPoints"""
+        if self.pathfinder.nodes.version == self._version:
+            self._add((start_node, end_node), path)
+
+    def _add(self, key, path):
+        self._paths[key] = None if path is None else (tuple(path), {n: i for i, n in enumerate(path)})
+        self._starts.setdefault(key[1], set()).add(key[0])
+        while len(self._paths) > self.capacity:
+            (start, goal), _ = self._paths.popitem(last=False)
+            self._starts[goal].discard(start)
+            if not self._starts[goal]:
+                del self._starts[goal]
@@ -0,0 +1,137 @@
+import heapq
+import itertools
+import time
+from typing import Optional, List
+
+
+class PathRequest:
+    """A queued path search for one agent"""
+
+    def __init__(self, name, start_node: int, end_node: int, priority: int = 0):
+        self.name = name
+        self.start_node = start_node
+        self.end_node = end_node
+        self.priority = priority
+        self.search = None
+        self.path: Optional[List[int]] = None
+        self.finished = False
+
+
+class PathScheduler:
+    """
+    Queue of path requests that are solved incrementally within a per-frame budget.
+
+    There is at most one request per agent name, a new request replaces
+    the previous one, finished or not. Requests with higher `priority`
+    are solved first, equal priorities in the order of the requests.
+
+    `update` spends up to `max_expansions` evaluated nodes and/or
+    `max_seconds` per call and returns the requests that finished.
+    """
+
+    def __init__(self, pathfinder, cache=None, max_expansions: Optional[int] = 2000,
+                 max_seconds: Optional[float] = None, step_size: int = 100):
+        """
+        :param pathfinder: AStar
+        :param cache: optional PathCache of the same pathfinder
+        :param max_expansions: per-update budget of evaluated nodes
+        :param max_seconds: per-update time budget
+        :param step_size: nodes evaluated between checks of the time budget
+        """
+        self.pathfinder = pathfinder
+        self.cache = cache
+        self.max_expansions = max_expansions
+        self.max_seconds = max_seconds
+        self.step_size = step_size
+        self.num_superseded = 0
+        self._requests = dict()
+        self._queue = []
+        self._counter = itertools.count()
+        self._version = self.pathfinder.nodes.version
+
+    def __len__(self):
+        return len(self._requests)
+
+    def is_pending(self, name) -> bool:
+        return name in self._requests
+
+    def requests(self) -> List[PathRequest]:
+        """All pending requests"""
+        return list(self._requests.values())
+
+    def request(self, name, start_node: int, end_node: int, priority: int = 0) -> PathRequest:
+        previous = self._requests.get(name)
+        if previous is not None:
+            if (previous.start_node, previous.end_node) == (start_node, end_node):
+                if priority > previous.priority:
+                    previous.priority = priority
+                    heapq.heappush(self._queue, (-priority, next(self._counter), previous))
+                return previous
+            self.num_superseded += 1
+
+        request = PathRequest(name, start_node, end_node, priority)
+        self._requests[name] = request
+        heapq.heappush(self._queue, (-priority, next(self._counter), request))
+        return request
+
+    def cancel(self, name):
+        self._requests.pop(name, None)
+
+    def update(self, max_expansions: Optional[int] = None, max_seconds: Optional[float] = None) -> List[PathRequest]:
+        """Advance the queued searches and return the finished requests"""
+        max_expansions = self.max_expansions if max_expansions is None else max_expansions
+        max_seconds = self.max_seconds if max_seconds is None else max_seconds
+        start_time = time.time()
+
+        version = self.pathfinder.nodes.version
+        if version != self._version:
+            # searches on the old graph need to start over
+            self._version = version
+            for request in self._requests.values():
+                request.search = None
+
+        finished = []
+        expanded = 0
+        while self._queue:
+            if max_expansions is not None and expanded >= max_expansions:
+                break
+            if max_seconds is not None and time.time() - start_time >= max_seconds:
+                break
+
+            request = self._queue[0][2]
+            if self._requests.get(request.name) is not request or request.finished:
+                # superseded, cancelled or queued again with a higher priority
+                heapq.heappop(self._queue)
+                continue
+
+            if request.search is None and self.cache is not None:
+                found, path = self.cache.lookup(request.start_node, request.end_node)
+                if found:
+                    self._finish(request, path, finished)
+                    continue
+
+            if request.search is None:
+                request.search = self.pathfinder.search_incremental(request.start_node, request.end_node)
+
+            search = request.search
+            steps = self.step_size
+            if max_expansions is not None:
+                steps = min(steps, max_expansions - expanded)
+            num_expanded = search.num_expanded
+            done = search.step(steps)
+            # count at least one per step so the loop always ends
+            expanded += max(1, search.num_expanded - num_expanded)
+            if done:
+                if self.cache is not None:
+                    self.cache.add(request.start_node, request.end_node, search.path)
+                self._finish(request, search.path, finished)
+
+        return finished
+
+    def _finish(self, request: PathRequest, path, finished: list):
+        heapq.heappop(self._queue)
+        del self._requests[request.name]
+        request.path = path
+        request.finished = True
+        request.search = None
+        finished.append(request)
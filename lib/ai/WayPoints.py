@@ -1,15 +1,57 @@
+import bisect
 import math
 
+import numpy as np
+
+from .WayPointsCSR import WayPointsCSR
+from .WayPointsIndex import WayPointsIndex
+
 
 class WayPoints:
     """An undirected graph"""
 
+    # number of logged edge changes, older ones are dropped,
+    #   enough for loading a few chunks of a ChunkManager
+    MAX_EDGE_CHANGES = 32768
+
     def __init__(self):
         self.id_to_pos = dict()
         self.pos_to_id = dict()
         self._edge_fwd = dict()
         self._edge_back = dict()
         self.distances = dict()
+        self._csr = dict()
+        self._index = None
+        # ids of removed nodes, they keep their last position until reused
+        self._free_ids = []
+        # increased whenever edges change
+        self.version = 0
+        # (version, i1, i2, pos1, pos2) of the latest added or removed edges
+        self._edge_changes = []
+
+    def to_arrays(self) -> dict:
+        """
+        Returns the node positions [node, xyz] in id order and
+        the [edge, 2] node ids of all edges
+        """
+        positions = [self.id_to_pos[i] for i in range(self.num_nodes)]
+        edges = [(i1, i2) for i1 in self._edge_fwd for i2 in self._edge_fwd[i1]]
+        return {
+            "positions": np.array(positions, dtype="int32").reshape(-1, 3),
+            "edges": np.array(edges, dtype="int32").reshape(-1, 2),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "WayPoints":
+        wp = cls()
+        for idx, pos in enumerate(arrays["positions"].tolist()):
+            pos = tuple(pos)
+            wp.id_to_pos[idx] = pos
+            wp.pos_to_id[pos] = idx
+        for i1, i2 in arrays["edges"].tolist():
+            wp._edge_fwd.setdefault(i1, set()).add(i2)
+            wp._edge_back.setdefault(i2, set()).add(i1)
+        return wp
 
     @property
     def num_nodes(self):
@@ -19,13 +61,28 @@ class WayPoints:
     def num_edges(self):
         return len(self._edge_fwd) // 2
 
+    def csr(self, z_penalty: float = 5.):
+        """
+        Returns the WayPointsCSR of the current graph.
+        It is kept until the graph changes.
+        """
+        if z_penalty not in self._csr:
+            arrays = self.to_arrays()
+            self._csr[z_penalty] = WayPointsCSR.from_arrays(
+                arrays["positions"], arrays["edges"], z_penalty=z_penalty
+            )
+        return self._csr[z_penalty]
+
     def _add_node_pos(self, pos):
         """adding a node without connection leads to undefined behaviour"""
         if pos in self.pos_to_id:
             return self.pos_to_id[pos]
-        idx = len(self.id_to_pos)
+        self._csr.clear()
+        idx = self._free_ids.pop() if self._free_ids else len(self.id_to_pos)
         self.pos_to_id[pos] = idx
         self.id_to_pos[idx] = pos
+        if self._index is not None:
+            self._index.add(idx, pos)
         return idx
 
     def has_edge(self, i1, i2):
@@ -40,6 +97,7 @@ class WayPoints:
             raise ValueError("WayPoints.add_edge(%s, %s)" % (i1, i2))
         if self.has_edge(i1, i2):
             return
+        self._edge_changed(i1, i2)
         if i1 not in self._edge_fwd:
             self._edge_fwd[i1] = {i2}
         else:
@@ -49,6 +107,110 @@ class WayPoints:
         else:
             self._edge_back[i2].add(i1)
 
+    def remove_edge(self, i1, i2):
+        for fwd, back in ((self._edge_fwd, self._edge_back), (self._edge_back, self._edge_fwd)):
+            if i1 in fwd and i2 in fwd[i1]:
+                fwd[i1].discard(i2)
+                back[i2].discard(i1)
+                if not fwd[i1]:
+                    del fwd[i1]
+                if not back[i2]:
+                    del back[i2]
+                self._edge_changed(i1, i2)
+
+    def remove_node(self, node):
+        """
+        Remove the node and its edges. The id is reused by the next added node,
+        until then it keeps its position but can not be found by position.
+        """
+        for n in list(self.adjacent_nodes(node)):
+            self.remove_edge(node, n)
+        pos = self.id_to_pos[node]
+        del self.pos_to_id[pos]
+        if self._index is not None:
+            self._index.remove(node, pos)
+        self._free_ids.append(node)
+        self._csr.clear()
+
+    def changed_edges(self, since_version: int, positions: bool = False):
+        """
+        Returns the list of (i1, i2) edges that were added or removed after `since_version`,
+        or None if the changes are no longer logged.
+
+        With `positions`, the node positions at the time of the change are returned,
+        as the ids of removed nodes may be reused.
+        """
+        if since_version >= self.version:
+            return []
+        changes = self._edge_changes
+        if not changes or changes[0][0] > since_version + 1:
+            return None
+        index = bisect.bisect_right(changes, (since_version, math.inf))
+        if positions:
+            return [(p1, p2) for v, i1, i2, p1, p2 in changes[index:]]
+        return [(i1, i2) for v, i1, i2, p1, p2 in changes[index:]]
+
+    def _edge_changed(self, i1, i2):
+        self._csr.clear()
+        self.version += 1
+        self._edge_changes.append((self.version, i1, i2, self.id_to_pos[i1], self.id_to_pos[i2]))
+        if len(self._edge_changes) > self.MAX_EDGE_CHANGES:
+            del self._edge_changes[:len(self._edge_changes) - self.MAX_EDGE_CHANGES // 2]
+
+    def update_edges(self, positions, edges, box_min=None, box_max=None):
+        """
+        Add and remove edges, so that the edges whose bounding box intersects the inclusive
+        xyz box (default everywhere) are those of the graph given by the [node, xyz] `positions`
+        and the [edge, 2] node indices `edges`, e.g. from WorldChunk.waypoint_arrays.
+        With a box, the edges may only connect positions that are at most one apart per axis.
+
+        Node ids stay the same, nodes are added for new edges and
+        nodes that lose their last edge are removed, see `remove_node`.
+        Each changed edge increases the `version`, see `changed_edges`.
+        """
+        positions = np.asarray(positions).reshape(-1, 3)
+        edges = np.asarray(edges, dtype="int64").reshape(-1, 2)
+        if box_min is None or box_max is None:
+            def _in_box(p1, p2):
+                return True
+            nodes = list(self.pos_to_id.values())
+        else:
+            (x0, y0, z0), (x1, y1, z1) = box_min, box_max
+
+            def _in_box(p1, p2):
+                return (
+                    min(p1[0], p2[0]) <= x1 and max(p1[0], p2[0]) >= x0
+                    and min(p1[1], p2[1]) <= y1 and max(p1[1], p2[1]) >= y0
+                    and min(p1[2], p2[2]) <= z1 and max(p1[2], p2[2]) >= z0
+                )
+            nodes = self.index.in_box((x0 - 1, y0 - 1, z0 - 1), (x1 + 1, y1 + 1, z1 + 1))
+            lo = np.minimum(positions[edges[:, 0]], positions[edges[:, 1]])
+            hi = np.maximum(positions[edges[:, 0]], positions[edges[:, 1]])
+            edges = edges[np.all((lo <= box_max) & (hi >= box_min), axis=-1)]
+
+        positions = [tuple(p) for p in positions.tolist()]
+        new_edges = set()
+        for i1, i2 in edges.tolist():
+            p1, p2 = positions[i1], positions[i2]
+            new_edges.add((p1, p2) if p1 < p2 else (p2, p1))
+        old_edges = set()
+        for i1 in nodes:
+            p1 = self.id_to_pos[i1]
+            for i2 in self.adjacent_nodes(i1):
+                p2 = self.id_to_pos[i2]
+                if _in_box(p1, p2):
+                    old_edges.add((p1, p2) if p1 < p2 else (p2, p1))
+
+        removed = sorted(old_edges - new_edges)
+        for p1, p2 in removed:
+            self.remove_edge(self.pos_to_id[p1], self.pos_to_id[p2])
+        for p1, p2 in sorted(new_edges - old_edges):
+            self.add_edge_pos(p1, p2)
+        for pos in sorted({p for edge in removed for p in edge}):
+            node = self.pos_to_id[pos]
+            if not self.adjacent_nodes(node):
+                self.remove_node(node)
+
     def add_edge_pos(self, p1, p2):
         if p1 == p2:
             raise ValueError("WayPoint.add_edge_pos(%s, %s)" % (p1, p2))
@@ -71,7 +233,30 @@ class WayPoints:
             px, py, pz = px/d, py/d, pz/d
         return px, py, pz
 
+    @property
+    def index(self) -> WayPointsIndex:
+        """The spatial index of the node positions, built on first use"""
+        if self._index is None:
+            self._index = WayPointsIndex()
+            for idx, pos in self.id_to_pos.items():
+                self._index.add(idx, pos)
+        return self._index
+
+    def has_edges(self, node) -> bool:
+        return node in self._edge_fwd or node in self._edge_back
+
     def closest_node(self, pos):
+        """
+        Returns the node with the smallest manhattan distance or None.
+        Like `nearest_nodes` and `nodes_in_radius`, nodes without edges are skipped.
+        """
+        node = self.pos_to_id.get(pos)
+        if node is not None and self.has_edges(node):
+            return node
+        nearest = self.index.nearest(pos, 1, manhattan=True, accept=self.has_edges)
+        return nearest[0][1] if nearest else None
+
+    def closest_node_old(self, pos):
         if pos in self.pos_to_id:
             return self.pos_to_id[pos]
         n, md = None, 10000000
@@ -81,6 +266,14 @@ class WayPoints:
                 n, md = self.pos_to_id[p], d
         return n
 
+    def nearest_nodes(self, pos, k: int = 1):
+        """Returns the ids of up to `k` nodes, closest first"""
+        return [n for d, n in self.index.nearest(pos, k, accept=self.has_edges)]
+
+    def nodes_in_radius(self, pos, radius: float):
+        """Returns the ids of all nodes within `radius`, closest first"""
+        return [n for d, n in self.index.in_radius(pos, radius, accept=self.has_edges)]
+
     def adjacent_nodes(self, node):
         adj = set()
         if node in self._edge_fwd:
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class WayPointsCSR:
+    """
+    Frozen compressed-sparse-row form of WayPoints.
+
+    The neighbours of node `n` are `indices[indptr[n]:indptr[n+1]]`
+    and the cost of walking to each of them is in `costs` at the same index.
+    Every undirected edge is stored in both directions.
+
+    The cost of an edge is its length plus `z_penalty` times
+    its height difference, like AStar.heuristic_step_cost.
+    """
+
+    def __init__(self, positions: np.ndarray, indptr: np.ndarray, indices: np.ndarray, costs: np.ndarray):
+        self.positions = positions
+        self.indptr = indptr
+        self.indices = indices
+        self.costs = costs
+        self._lists = None
+
+    def __repr__(self):
+        return "WayPointsCSR(%s nodes, %s edges)" % (self.num_nodes, self.num_edges)
+
+    @classmethod
+    def from_arrays(cls, positions: np.ndarray, edges: np.ndarray, z_penalty: float = 5.) -> "WayPointsCSR":
+        """
+        :param positions: [node, xyz] positions
+        :param edges: [edge, 2] node ids, in any direction and possibly duplicated
+        :param z_penalty: extra cost per unit of height difference
+        """
+        positions = np.asarray(positions, dtype="float64").reshape(-1, 3)
+        num_nodes = len(positions)
+        edges = np.asarray(edges, dtype="int64").reshape(-1, 2)
+        edges = edges[edges[:, 0] != edges[:, 1]]
+
+        both = np.concatenate([edges, edges[:, ::-1]])
+        both = np.unique(both[:, 0] * max(1, num_nodes) + both[:, 1])
+        src, dst = both // max(1, num_nodes), both % max(1, num_nodes)
+
+        delta = positions[dst] - positions[src]
+        costs = np.sqrt((delta * delta).sum(axis=1)) + np.abs(delta[:, 2]) * z_penalty
+
+        indptr = np.zeros(num_nodes + 1, dtype="int32")
+        np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+
+        return cls(positions, indptr, dst.astype("int32"), costs)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.positions)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices) // 2
+
+    def adjacent_nodes(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def adjacent_costs(self, node: int) -> np.ndarray:
+        return self.costs[self.indptr[node]:self.indptr[node + 1]]
+
+    def path_cost(self, path) -> float:
+        cost = 0.
+        for n1, n2 in zip(path, path[1:]):
+            nodes = self.adjacent_nodes(n1)
+            cost += float(self.adjacent_costs(n1)[np.flatnonzero(nodes == n2)[0]])
+        return cost
+
+    def to_lists(self) -> tuple:
+        """
+        Returns (positions, indptr, indices, costs) as python lists,
+        which are much faster to index one element at a time than numpy arrays.
+        """
+        if self._lists is None:
+            self._lists = (
+                [tuple(p) for p in self.positions.tolist()],
+                self.indptr.tolist(),
+                self.indices.tolist(),
+                self.costs.tolist(),
+            )
+        return self._lists
@@ -0,0 +1,127 @@
+import heapq
+import math
+from typing import Callable, List, Optional, Tuple
+
+
+class WayPointsIndex:
+    """
+    Grid-bucket spatial index of node positions.
+
+    Nodes are sorted into square buckets of `cell_size` in x and y,
+    z is not bucketed as levels are flat compared to their extent.
+    Queries visit rings of buckets around the query position
+    until no closer node can be found.
+    """
+
+    def __init__(self, cell_size: int = 2):
+        self.cell_size = cell_size
+        # (cx, cy) -> [(node, x, y, z), ...]
+        self._buckets = dict()
+        self._min_cell = None
+        self._max_cell = None
+
+    def __len__(self):
+        return sum(len(b) for b in self._buckets.values())
+
+    def add(self, node: int, pos: tuple):
+        cell = (int(pos[0]) // self.cell_size, int(pos[1]) // self.cell_size)
+        self._buckets.setdefault(cell, []).append((node, pos[0], pos[1], pos[2]))
+        if self._min_cell is None:
+            self._min_cell, self._max_cell = cell, cell
+        else:
+            self._min_cell = (min(self._min_cell[0], cell[0]), min(self._min_cell[1], cell[1]))
+            self._max_cell = (max(self._max_cell[0], cell[0]), max(self._max_cell[1], cell[1]))
+
+    def remove(self, node: int, pos: tuple):
+        cell = (int(pos[0]) // self.cell_size, int(pos[1]) // self.cell_size)
+        bucket = self._buckets[cell]
+        bucket.remove((node, pos[0], pos[1], pos[2]))
+        if not bucket:
+            del self._buckets[cell]
+
+    def in_box(self, box_min: tuple, box_max: tuple) -> List[int]:
+        """Returns all nodes in the inclusive xyz box"""
+        cs = self.cell_size
+        (x0, y0, z0), (x1, y1, z1) = box_min, box_max
+        result = []
+        for cy in range(int(math.floor(y0)) // cs, int(math.floor(y1)) // cs + 1):
+            for cx in range(int(math.floor(x0)) // cs, int(math.floor(x1)) // cs + 1):
+                for node, x, y, z in self._buckets.get((cx, cy), ()):
+                    if x0 <= x <= x1 and y0 <= y <= y1 and z0 <= z <= z1:
+                        result.append(node)
+        return result
+
+    def nearest(
+            self, pos: tuple, k: int = 1, manhattan: bool = False,
+            accept: Optional[Callable[[int], bool]] = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        Returns up to `k` (distance, node) tuples, closest first.
+        Distance is euclidean or, with `manhattan`, the sum of the absolute differences.
+        Only the nodes for which `accept(node)` is True are considered, if given.
+        """
+        if not self._buckets or k < 1:
+            return []
+        cs = self.cell_size
+        px, py, pz = pos
+        cx, cy = int(math.floor(px)) // cs, int(math.floor(py)) // cs
+        max_ring = max(
+            abs(cx - self._min_cell[0]), abs(cx - self._max_cell[0]),
+            abs(cy - self._min_cell[1]), abs(cy - self._max_cell[1]),
+        )
+        # max-heap of the k best as (-distance, -node)
+        best = []
+        for ring in range(max_ring + 1):
+            for bucket in self._ring(cx, cy, ring):
+                for node, x, y, z in bucket:
+                    if accept is not None and not accept(node):
+                        continue
+                    if manhattan:
+                        d = abs(x - px) + abs(y - py) + abs(z - pz)
+                    else:
+                        d = math.sqrt((x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2)
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, -node))
+                    elif (-d, -node) > best[0]:
+                        heapq.heapreplace(best, (-d, -node))
+            # all nodes in further rings are at least this far away
+            if len(best) == k and -best[0][0] <= ring * cs:
+                break
+        return sorted((-d, -n) for d, n in best)
+
+    def in_radius(
+            self, pos: tuple, radius: float, accept: Optional[Callable[[int], bool]] = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        Returns all (distance, node) tuples within the euclidean `radius`, closest first,
+        of the nodes for which `accept(node)` is True, if given
+        """
+        if not self._buckets:
+            return []
+        cs = self.cell_size
+        px, py, pz = pos
+        r2 = radius * radius
+        result = []
+        for cy in range(int(math.floor(py - radius)) // cs, int(math.floor(py + radius)) // cs + 1):
+            for cx in range(int(math.floor(px - radius)) // cs, int(math.floor(px + radius)) // cs + 1):
+                for node, x, y, z in self._buckets.get((cx, cy), ()):
+                    d2 = (x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2
+                    if d2 <= r2 and (accept is None or accept(node)):
+                        result.append((math.sqrt(d2), node))
+        result.sort()
+        return result
+
+    def _ring(self, cx: int, cy: int, ring: int):
+        buckets = self._buckets
+        if ring == 0:
+            if (cx, cy) in buckets:
+                yield buckets[(cx, cy)]
+            return
+        for x in range(cx - ring, cx + ring + 1):
+            for y in (cy - ring, cy + ring):
+                if (x, y) in buckets:
+                    yield buckets[(x, y)]
+        for y in range(cy - ring + 1, cy + ring):
+            for x in (cx - ring, cx + ring):
+                if (x, y) in buckets:
+                    yield buckets[(x, y)]
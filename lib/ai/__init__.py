@@ -1,4 +1,15 @@
 from .Agent import Agent
+from .AgentArrays import AgentArrays
 from .Agents import Agents
 from .AStar import AStar
-from .WayPoints import WayPoints
\ No newline at end of file
+from .AStarSearch import AStarSearch
+from .BatchPathSolver import BatchPathSolver
+from .DStarLite import DStarLite
+from .FlowField import FlowField
+from .HierarchicalAStar import HierarchicalAStar
+from .NavMesh import NavMesh
+from .PathCache import PathCache
+from .PathScheduler import PathScheduler, PathRequest
+from .WayPoints import WayPoints
+from .WayPointsCSR import WayPointsCSR
+from .WayPointsIndex import WayPointsIndex
\ No newline at end of file
@@ -37,10 +37,9 @@ class ChunkRenderWidget(QGLWidget):
 
     def mouseMoveEvent(self, e):
         ro, rd = self.get_ray(e.x(), e.y())
-        t, hit = self.chunk.cast_voxel_ray(ro, rd, 300)
-        if hit:
-            hit_voxel = tuple(int(x) for x in (ro+t*rd)) if hit else (-1,-1,-1)
-            #print(hit, t, hit_voxel)
+        distances, voxels, normals = self.chunk.cast_voxel_rays([tuple(ro)], [tuple(rd)], 300)
+        if distances[0] < float("inf"):
+            hit_voxel = tuple(int(x) for x in voxels[0])
         else:
             hit_voxel = None
         if self.mesh_node.focus_voxel != hit_voxel:
@@ -13,12 +13,14 @@ in vec3 a_normal;
 in vec4 a_color;
 in vec2 a_texcoord;
 in vec3 a_ambient;
+in vec4 a_tile;
 
 out vec4 v_pos;
 out vec3 v_normal;
 out vec4 v_color;
 out vec2 v_texcoord;
 out vec3 v_ambient;
+out vec4 v_tile;
 out mat3 v_normal_space;
 
 /** Returns the matrix to multiply the light-direction normal */
@@ -39,6 +41,7 @@ void main()
     v_color = a_color;
     v_texcoord = a_texcoord;
     v_ambient = a_ambient;
+    v_tile = a_tile;
     v_normal_space = calc_light_matrix(mat4(1));
     gl_Position = u_projection * a_position;
 }
@@ -46,7 +49,8 @@ void main()
 """
 
 frag_src = DEFAULT_SHADER_VERSION + """
-#line 50
+#include <chunk-tile.glsl>
+#line 54
 uniform sampler2D u_tex1;
 uniform float u_time;
 
@@ -54,16 +58,18 @@ in vec4 v_pos;
 in vec3 v_normal;
 in vec2 v_texcoord;
 in vec3 v_ambient;
+in vec4 v_tile;
 in mat3 v_normal_space;
 
 out vec4 fragColor;
 
 void main() {
-    vec4 tex = texture2D(u_tex1, v_texcoord);
+    vec2 texcoord = chunk_tile_texcoord(v_texcoord, v_tile);
+    vec4 tex = texture2D(u_tex1, texcoord);
     
     // bump-mapping        
     vec3 normal = vec3(0, 0, 1);        
-    vec2 v_normcoord = v_texcoord + vec2(.5, 0.);
+    vec2 v_normcoord = texcoord + vec2(.5, 0.);
     vec4 normal_texel = texture2D(u_tex1, v_normcoord);
     normal = normalize(mix(normal, normal_texel.xyz, normal_texel.w));
     normal = v_normal_space * normal;
@@ -91,6 +97,7 @@ class ChunkMeshNode(RenderNode):
         self.mesh = None
         self.mesh_drawable = None
         self._mesh_changed = True
+        self.greedy_mesh = False
         self.edit_mesh = LineMesh()
         self.edit_mesh_drawable = None
         self.tileset_tex = None
@@ -149,7 +156,7 @@ class ChunkMeshNode(RenderNode):
 
         if self._mesh_changed:
             self._mesh_changed = False
-            self.mesh = self.chunk.create_mesh(do_ambient=False)
+            self.mesh = self.chunk.create_mesh(do_ambient=False, greedy=self.greedy_mesh)
             if self.mesh.is_empty():
                 if self.mesh_drawable:
                     self.mesh_drawable.release()
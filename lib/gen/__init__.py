@@ -1,3 +1,5 @@
+from .block_cache import BlockCache, BlockCacheInfo
+from .block_prefetcher import BlockPrefetcher, PrefetchInfo
 from .rand2d import RandomSampler2D, AutomatonSampler2D, NoiseSampler2D
 from .sampler2d import BlockSampler2DBase
 from .wang_tiling import WangTiling
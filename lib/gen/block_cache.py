@@ -0,0 +1,154 @@
+import itertools
+import os
+import threading
+import weakref
+from collections import OrderedDict, namedtuple
+from typing import Optional
+
+import numpy as np
+
+
+BlockCacheInfo = namedtuple("BlockCacheInfo", "hits misses evictions blocks bytes max_bytes")
+
+
+class BlockCache:
+    """
+    LRU cache of numpy blocks with a budget in bytes.
+
+    One cache is shared by many samplers, each sampler stores its blocks
+    under its own `owner` id (see `new_owner`). Blocks are weighted by
+    their `nbytes`, when the total exceeds `max_bytes` the least recently
+    used blocks of all owners are evicted, in O(1) per block.
+
+    Samplers request blocks around the previous ones, so the least recently
+    used blocks are usually the ones furthest away.
+
+    The methods are thread-safe, samplers run in Worker threads as well.
+    """
+
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # (owner, key) -> block
+        self._blocks = OrderedDict()
+        # owner -> [hits, misses, evictions, blocks, bytes]
+        self._stats = dict()
+        self._owner_ids = itertools.count()
+        # owners released by finalizers, which may run inside any call,
+        #   their blocks are dropped by the next put or clear
+        self._released = []
+        self._lock = threading.Lock()
+        _caches.add(self)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def default(cls) -> "BlockCache":
+        """The cache shared by all samplers of the process that were not given one"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def new_owner(self) -> int:
+        with self._lock:
+            owner = next(self._owner_ids)
+            self._stats[owner] = [0, 0, 0, 0, 0]
+            return owner
+
+    def release_owner(self, owner: int):
+        """Drop all blocks and statistics of `owner`, e.g. when the sampler is deleted"""
+        self._released.append(owner)
+
+    def cache_info(self, owner: Optional[int] = None) -> BlockCacheInfo:
+        """Statistics of all owners or of one"""
+        with self._lock:
+            if owner is None:
+                return BlockCacheInfo(
+                    self.hits, self.misses, self.evictions, len(self._blocks), self.bytes, self.max_bytes
+                )
+            return BlockCacheInfo(*self._stats[owner], self.max_bytes)
+
+    def contains(self, owner: int, key) -> bool:
+        """True if the block is cached, without counting a hit or miss"""
+        return (owner, key) in self._blocks
+
+    def get(self, owner: int, key) -> Optional[np.ndarray]:
+        with self._lock:
+            block = self._blocks.get((owner, key))
+            stats = self._stats[owner]
+            if block is None:
+                self.misses += 1
+                stats[1] += 1
+                return None
+            self.hits += 1
+            stats[0] += 1
+            self._blocks.move_to_end((owner, key))
+            return block
+
+    def put(self, owner: int, key, block: np.ndarray):
+        with self._lock:
+            self._drop_released()
+            old_block = self._blocks.pop((owner, key), None)
+            if old_block is not None:
+                self._removed(owner, old_block)
+            self._blocks[(owner, key)] = block
+            stats = self._stats[owner]
+            stats[3] += 1
+            stats[4] += block.nbytes
+            self.bytes += block.nbytes
+            # the newest block stays, even if larger than the budget
+            while self.bytes > self.max_bytes and len(self._blocks) > 1:
+                (evicted_owner, _), evicted_block = self._blocks.popitem(last=False)
+                self._removed(evicted_owner, evicted_block)
+                self.evictions += 1
+                self._stats[evicted_owner][2] += 1
+
+    def clear(self, owner: Optional[int] = None):
+        """Drop all blocks or those of one owner"""
+        with self._lock:
+            self._drop_released()
+            if owner is None:
+                self._blocks.clear()
+                self.bytes = 0
+                for stats in self._stats.values():
+                    stats[3] = stats[4] = 0
+                return
+            for owner_key in [k for k in self._blocks if k[0] == owner]:
+                self._removed(owner, self._blocks.pop(owner_key))
+
+    def _drop_released(self):
+        while self._released:
+            owner = self._released.pop()
+            for owner_key in [k for k in self._blocks if k[0] == owner]:
+                self._removed(owner, self._blocks.pop(owner_key))
+            del self._stats[owner]
+
+    def _removed(self, owner: int, block: np.ndarray):
+        self.bytes -= block.nbytes
+        stats = self._stats[owner]
+        stats[3] -= 1
+        stats[4] -= block.nbytes
+
+
+_caches = weakref.WeakSet()
+
+
+def _reset_locks_after_fork():
+    # a forked worker process may inherit locks held by threads that don't exist there
+    BlockCache._default_lock = threading.Lock()
+    for cache in _caches:
+        cache._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
@@ -0,0 +1,205 @@
+import math
+import threading
+from collections import namedtuple
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Optional, Tuple, List, Union
+
+from .worker import Worker
+
+
+PrefetchInfo = namedtuple("PrefetchInfo", "scheduled completed cancelled waited queued in_flight")
+
+
+class BlockPrefetcher:
+    """
+    Computes the blocks of a BlockSampler2DBase in the background
+    before they are requested, see `BlockSampler2DBase.prefetch`.
+
+    Wanted blocks are queued in the order in which they will be needed and
+    at most `max_in_flight` of them are handed to the executor at once,
+    so on-demand requests don't wait behind a long list of prefetches.
+    Each `prefetch` call replaces the wanted blocks, queued or not yet
+    started blocks of regions that were left are dropped.
+
+    The executor may be a thread pool or a process pool. With a process
+    pool the sampler is pickled to the worker process and the finished
+    blocks are stored in the cache of this process.
+    It may also be a Worker, then the blocks are requested with `priority`,
+    below the default priority of the requests that need the blocks now.
+
+    Results of blocks that were started before `sampler.clear_cache`
+    are not stored.
+    """
+
+    _default_executor = None
+    _default_lock = threading.Lock()
+
+    DEFAULT_WORKERS = 2
+
+    @classmethod
+    def default_executor(cls) -> Executor:
+        """Thread pool shared by all prefetchers that were not given an executor"""
+        with cls._default_lock:
+            if cls._default_executor is None:
+                cls._default_executor = ThreadPoolExecutor(
+                    max_workers=cls.DEFAULT_WORKERS, thread_name_prefix="prefetch",
+                )
+            return cls._default_executor
+
+    def __init__(
+            self,
+            sampler,
+            executor: Optional[Union[Executor, Worker]] = None,
+            max_in_flight: int = 2,
+            priority: float = -1,
+    ):
+        """
+        :param sampler: the BlockSampler2DBase
+        :param executor: a concurrent.futures Executor or a Worker, defaults to `default_executor()`
+        :param max_in_flight: maximum number of blocks submitted to the executor at once
+        :param priority: the priority of the requests when the executor is a Worker
+        """
+        self.sampler = sampler
+        self.executor = executor if executor is not None else self.default_executor()
+        self.max_in_flight = max_in_flight
+        self.priority = priority
+        # block keys in order of need
+        self._queue: List[Tuple[int, int]] = []
+        # block key -> Future
+        self._in_flight = dict()
+        # callbacks may run in the calling thread when the future is already done
+        self._lock = threading.RLock()
+        self.scheduled = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.waited = 0
+
+    def prefetch_info(self) -> PrefetchInfo:
+        with self._lock:
+            return PrefetchInfo(
+                self.scheduled, self.completed, self.cancelled, self.waited,
+                len(self._queue), len(self._in_flight),
+            )
+
+    def wanted_blocks(
+            self,
+            x: float, y: float,
+            velocity: Tuple[float, float],
+            radius: float,
+            lookahead: float,
+    ) -> List[Tuple[int, int]]:
+        """
+        The keys of the blocks within `radius` of the way from (x, y)
+        to (x, y) + velocity * lookahead, sorted by when they are reached
+        """
+        block_size = self.sampler.block_size
+        dx, dy = velocity[0] * lookahead, velocity[1] * lookahead
+        # one view position per block along the way
+        num_steps = max(1, int(math.ceil(math.sqrt(dx * dx + dy * dy) / block_size)))
+        keys = dict()
+        for step in range(num_steps + 1):
+            t = step / num_steps
+            cx, cy = x + t * dx, y + t * dy
+            for by in range(int((cy - radius) // block_size), int((cy + radius) // block_size) + 1):
+                for bx in range(int((cx - radius) // block_size), int((cx + radius) // block_size) + 1):
+                    key = (bx, by)
+                    # distance of the block center to the view position
+                    ox = (bx + .5) * block_size - cx
+                    oy = (by + .5) * block_size - cy
+                    order = (step, ox * ox + oy * oy)
+                    if order < keys.get(key, (math.inf, )):
+                        keys[key] = order
+        return sorted(keys, key=lambda key: keys[key])
+
+    def prefetch(
+            self,
+            x: float, y: float,
+            velocity: Tuple[float, float] = (0., 0.),
+            radius: float = 32.,
+            lookahead: float = 1.,
+    ) -> int:
+        """
+        Replace the wanted blocks, returns the number of blocks
+        that are queued or computing
+        """
+        wanted = [
+            key for key in self.wanted_blocks(x, y, velocity, radius, lookahead)
+            if not self.sampler.cache.contains(self.sampler._cache_owner, key)
+        ]
+        wanted_set = set(wanted)
+        with self._lock:
+            for key, future in list(self._in_flight.items()):
+                if key not in wanted_set and future.cancel():
+                    self.cancelled += 1
+                    self._in_flight.pop(key, None)
+            self.cancelled += len(set(self._queue) - wanted_set)
+            self._queue = [key for key in wanted if key not in self._in_flight]
+            self._submit()
+            return len(self._queue) + len(self._in_flight)
+
+    def cancel(self, outdated: bool = False):
+        """
+        Drop all queued blocks and those not yet started.
+        With `outdated`, the computing blocks are forgotten as well,
+        so `take` does not wait for them.
+        """
+        with self._lock:
+            self.cancelled += len(self._queue)
+            self._queue.clear()
+            for key, future in list(self._in_flight.items()):
+                if future.cancel() or outdated:
+                    self.cancelled += 1
+                    self._in_flight.pop(key, None)
+
+    def take(self, key: Tuple[int, int]) -> Optional[Future]:
+        """
+        Called on a cache miss: returns the future of the block if it is computing,
+        otherwise the block is dropped from the prefetch and None is returned
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                # waiting on a future that did not start could block a pool thread
+                if not future.cancel():
+                    self.waited += 1
+                    return future
+                self._in_flight.pop(key, None)
+                self._submit()
+            elif key in self._queue:
+                self._queue.remove(key)
+            return None
+
+    def _submit(self):
+        while self._queue and len(self._in_flight) < self.max_in_flight:
+            key = self._queue.pop(0)
+            try:
+                if isinstance(self.executor, Worker):
+                    future = self.executor.submit(self.sampler.get_block, *key, priority=self.priority)
+                else:
+                    future = self.executor.submit(self.sampler.get_block, *key)
+            except RuntimeError:
+                # executor was shut down
+                self.cancelled += len(self._queue) + 1
+                self._queue.clear()
+                return
+            self._in_flight[key] = future
+            self.scheduled += 1
+            generation = self.sampler._generation
+            future.add_done_callback(
+                lambda future, key=key, generation=generation: self._done(key, generation, future)
+            )
+
+    def _done(self, key: Tuple[int, int], generation: int, future: Future):
+        with self._lock:
+            if future.cancelled():
+                # the canceller updates the queue
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+                return
+            # the block of a cleared sampler is outdated
+            if future.exception() is None and generation == self.sampler._generation:
+                self.sampler.cache.put(self.sampler._cache_owner, key, future.result())
+                self.completed += 1
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+            self._submit()
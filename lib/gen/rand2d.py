@@ -1,17 +1,18 @@
-from typing import Iterable, Tuple
+from typing import Iterable, Tuple, Optional
 
 import numpy as np
 from numpy.random import Generator, PCG64, SeedSequence
 
 from .sampler2d import BlockSampler2DBase
+from .block_cache import BlockCache
 from .automaton import ClassicAutomaton
 from .perlin_noise import generate_perlin_noise_2d
 
 
 class RandomSampler2D(BlockSampler2DBase):
 
-    def __init__(self, seed: int = 1, block_size: int = 32):
-        super().__init__(block_size=block_size)
+    def __init__(self, seed: int = 1, block_size: int = 32, cache: Optional[BlockCache] = None):
+        super().__init__(block_size=block_size, cache=cache)
         self.seed = seed
 
     def get_block(self, block_x: int, block_y: int) -> np.ndarray:
@@ -26,9 +27,10 @@ class NoiseSampler2D(BlockSampler2DBase):
             resolution: int = 1,
             seed: int = 1,
             block_size: int = 32,
+            cache: Optional[BlockCache] = None,
     ):
-        super().__init__(block_size=block_size)
-        self.random_sampler = RandomSampler2D(seed, block_size=resolution)
+        super().__init__(block_size=block_size, cache=cache)
+        self.random_sampler = RandomSampler2D(seed, block_size=resolution, cache=cache)
 
     def get_block(self, block_x: int, block_y: int) -> np.ndarray:
         # need to get one block of initial data
@@ -56,9 +58,10 @@ class AutomatonSampler2D(BlockSampler2DBase):
             self,
             seed: int = 1,
             block_size: int = 32,
+            cache: Optional[BlockCache] = None,
     ):
-        super().__init__(block_size=block_size)
-        self.random_sampler = RandomSampler2D(seed=seed, block_size=self.block_size)
+        super().__init__(block_size=block_size, cache=cache)
+        self.random_sampler = RandomSampler2D(seed=seed, block_size=self.block_size, cache=cache)
         self._born = {3}
         self._survive = {2, 3}
 
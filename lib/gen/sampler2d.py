@@ -1,6 +1,50 @@
+import os
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Optional, Tuple, Union
+
 import numpy as np
 from numpy.random import Generator, PCG64, SeedSequence
 
+from .block_cache import BlockCache, BlockCacheInfo
+from .block_prefetcher import BlockPrefetcher, PrefetchInfo
+from .worker import Worker
+
+
+# sampler uid -> (generation, cache owner) of the samplers unpickled in this process,
+#   so repeated requests to a worker process reuse the blocks of the previous ones,
+#   the least recently unpickled first
+_unpickled_owners = OrderedDict()
+# cache owner -> number of unpickled samplers alive that use it
+_unpickled_users = dict()
+# finalizers may run inside the locked code
+_unpickled_lock = threading.RLock()
+
+
+def _release_if_unused(owner: int):
+    """Release the cache owner of unpickled samplers when it is neither used nor reused"""
+    if not _unpickled_users.get(owner) and all(o != owner for _, o in _unpickled_owners.values()):
+        _unpickled_users.pop(owner, None)
+        BlockCache.default().release_owner(owner)
+
+
+def _unpickled_deleted(owner: int):
+    with _unpickled_lock:
+        _unpickled_users[owner] -= 1
+        _release_if_unused(owner)
+
+
+def _reset_lock_after_fork():
+    global _unpickled_lock
+    _unpickled_lock = threading.RLock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
+
 
 class BlockSampler2DBase:
     """
@@ -9,15 +53,53 @@ class BlockSampler2DBase:
     Overload `get_block` to create fixed-size 2d numpy arrays.
 
     The __call__ method allows getting a block of any size and position.
+
+    Blocks are kept in a BlockCache, by default the one shared
+    by all samplers of the process (`BlockCache.default()`).
+    `prefetch` computes the blocks ahead of a moving view in the background.
     """
 
-    MAX_CACHE = 100
     VERBOSE = False
 
-    def __init__(self, block_size: int):
+    # number of samplers whose cache owners are reused when unpickled again
+    MAX_UNPICKLED_OWNERS = 64
+
+    def __init__(self, block_size: int, cache: Optional[BlockCache] = None):
         self.block_size = block_size
-        self._cache = dict()
-        self._last_key = None
+        self.cache = cache if cache is not None else BlockCache.default()
+        self._cache_owner = self.cache.new_owner()
+        weakref.finalize(self, self.cache.release_owner, self._cache_owner)
+        self._prefetcher: Optional[BlockPrefetcher] = None
+        # identifies the blocks of this sampler in other processes,
+        #   the generation is increased by clear_cache
+        self._uid = uuid.uuid4().hex
+        self._generation = 0
+
+    def __getstate__(self):
+        # pickled to run in worker processes, where blocks go to that process' cache
+        state = self.__dict__.copy()
+        for name in ("cache", "_cache_owner", "_prefetcher"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cache = BlockCache.default()
+        with _unpickled_lock:
+            generation, owner = _unpickled_owners.pop(self._uid, (None, None))
+            outdated = None
+            if generation != self._generation:
+                # the blocks of a cleared sampler are outdated
+                outdated, owner = owner, self.cache.new_owner()
+            _unpickled_owners[self._uid] = (self._generation, owner)
+            _unpickled_users[owner] = _unpickled_users.get(owner, 0) + 1
+            if outdated is not None:
+                _release_if_unused(outdated)
+            while len(_unpickled_owners) > self.MAX_UNPICKLED_OWNERS:
+                _release_if_unused(_unpickled_owners.popitem(last=False)[1][1])
+        weakref.finalize(self, _unpickled_deleted, owner)
+        self._cache_owner = owner
+        self._prefetcher = None
 
     def get_block(self, block_x: int, block_y: int) -> np.ndarray:
         raise NotImplementedError
@@ -77,50 +159,80 @@ class BlockSampler2DBase:
         return block
 
     def clear_cache(self):
-        self._cache.clear()
+        self._generation += 1
+        # blocks that finish from now on are dropped by the prefetcher,
+        #   those stored before are removed below
+        self.cancel_prefetch(outdated=True)
+        self.cache.clear(self._cache_owner)
+
+    def cache_info(self) -> BlockCacheInfo:
+        """Hits, misses, evictions, number of blocks and bytes of this sampler in the cache"""
+        return self.cache.cache_info(self._cache_owner)
+
+    def set_prefetch_executor(
+            self,
+            executor: Optional[Union[Executor, Worker]] = None,
+            max_in_flight: int = 2,
+            priority: float = -1,
+    ):
+        """
+        Prefetch on `executor`, a thread or process pool or a Worker,
+        with at most `max_in_flight` blocks submitted at once.
+        Worker requests have `priority`.
+        """
+        if self._prefetcher is not None:
+            self._prefetcher.cancel()
+        self._prefetcher = BlockPrefetcher(
+            self, executor=executor, max_in_flight=max_in_flight, priority=priority,
+        )
+
+    def prefetch(
+            self,
+            x: float, y: float,
+            velocity: Tuple[float, float] = (0., 0.),
+            radius: float = 32.,
+            lookahead: float = 1.,
+    ) -> int:
+        """
+        Compute the blocks in the background that a view at (x, y) with `radius`,
+        moving by `velocity` per unit of `lookahead`, is about to need.
+
+        Replaces the previous prefetch, blocks that are no longer
+        wanted and not yet computing are dropped.
+        Returns the number of blocks that are queued or computing.
+        """
+        if self._prefetcher is None:
+            self.set_prefetch_executor()
+        return self._prefetcher.prefetch(x, y, velocity=velocity, radius=radius, lookahead=lookahead)
+
+    def cancel_prefetch(self, outdated: bool = False):
+        """Drop the queued blocks, see `BlockPrefetcher.cancel`"""
+        if self._prefetcher is not None:
+            self._prefetcher.cancel(outdated=outdated)
+
+    def prefetch_info(self) -> Optional[PrefetchInfo]:
+        return self._prefetcher.prefetch_info() if self._prefetcher is not None else None
 
     def get_block_cached(self, block_x: int, block_y: int) -> np.ndarray:
         key = (block_x, block_y)
-        if key in self._cache:
+        block = self.cache.get(self._cache_owner, key)
+        if block is not None:
             if self.VERBOSE:
                 print(f"{self.__class__.__name__}: cache hit {key}")
-            return self._cache[key]
+            return block
 
         if self.VERBOSE:
             print(f"{self.__class__.__name__}: cache miss {key}")
 
-        block = self.get_block(block_x, block_y)
-        self._cache[key] = block
-        self._last_key = key
+        if self._prefetcher is not None:
+            # wait for the block if it's computing already
+            future = self._prefetcher.take(key)
+            if future is not None:
+                try:
+                    return future.result()
+                except Exception:
+                    pass
 
-        if len(self._cache) > self.MAX_CACHE:
-            self._shrink_cache()
+        block = self.get_block(block_x, block_y)
+        self.cache.put(self._cache_owner, key, block)
         return block
-
-    def _shrink_cache(self):
-        if not self._last_key:
-            return
-
-        num_drop = len(self._cache) // 3
-
-        distances = [
-            abs(self._last_key[0] - key[0]) + abs(self._last_key[1] - key[1])
-            for key in self._cache
-        ]
-        distance_map = {
-            key: dist
-            for key, dist in zip(self._cache, distances)
-        }
-        threshold = sorted(distances)[num_drop]
-
-        if self.VERBOSE:
-            print(
-                f"{self.__class__.__name__}: dropping cache",
-                [key for key in self._cache if distance_map[key] <= threshold]
-            )
-
-        self._cache = {
-            key: value
-            for key, value in self._cache.items()
-            if distance_map[key] > threshold
-        }
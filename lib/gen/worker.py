@@ -1,19 +1,113 @@
+import heapq
+import itertools
+import os
 import threading
-import queue
-import time
-from typing import Callable, Optional, Any, Tuple, Dict
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory, resource_tracker
+from typing import Callable, Optional, Any, Tuple, Dict, List
+
+import numpy as np
+
+
+class _SharedArray:
+    """A numpy array that a worker process placed in shared memory"""
+
+    def __init__(self, array: np.ndarray):
+        try:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes), track=False)
+        except TypeError:
+            # python < 3.13, the main process unlinks the block
+            shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            resource_tracker.unregister(shm._name, "shared_memory")
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        self.name = shm.name
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        shm.close()
+
+    def to_array(self) -> np.ndarray:
+        """Copy of the array, releases the shared memory"""
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            return np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+
+def _to_shared(value, min_bytes: int):
+    if isinstance(value, np.ndarray) and value.nbytes >= min_bytes:
+        return _SharedArray(value)
+    if isinstance(value, (tuple, list)):
+        return type(value)(_to_shared(v, min_bytes) for v in value)
+    if isinstance(value, dict):
+        return {k: _to_shared(v, min_bytes) for k, v in value.items()}
+    return value
+
+
+def _from_shared(value):
+    if isinstance(value, _SharedArray):
+        return value.to_array()
+    if isinstance(value, (tuple, list)):
+        return type(value)(_from_shared(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _from_shared(v) for k, v in value.items()}
+    return value
+
+
+def _run_in_process(func: Callable, min_bytes: int):
+    return _to_shared(func(), min_bytes)
+
+
+class _Request:
+
+    def __init__(self, id: str, func: Callable, extra: Any, priority: float, seq: int, future: Future):
+        self.id = id
+        self.func = func
+        self.extra = extra
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        # cancelled while running, the result is not stored
+        self.discard = False
+
+    def __lt__(self, other: "_Request") -> bool:
+        # higher priority first, then first come first served
+        return (-self.priority, self.seq) < (-other.priority, other.seq)
 
 
 class Worker:
+    """
+    Runs functions in the background on a pool of `num_threads` threads.
+
+    The "thread" backend runs them in the threads. The "process" backend
+    runs them in a ProcessPoolExecutor, outside of the GIL of the main
+    process; the functions must be picklable (e.g. a functools.partial
+    of a sampler, not a lambda) and numpy arrays of at least
+    `SHARED_MEMORY_MIN_BYTES` in the result come back through shared memory.
+
+    Requests with higher `priority` run first. A request replaces a queued
+    request with the same id (only the newest runs) and `cancel` drops
+    requests by id. `request` returns a Future and takes an optional callback,
+    results can still be polled with `pop_result`, at most `max_results`
+    unpopped results are kept. `submit` runs anonymous requests like an Executor.
+    """
 
     _instances = dict()
 
     VERBOSE = False
 
+    BACKENDS = ("thread", "process")
+
+    SHARED_MEMORY_MIN_BYTES = 64 * 1024
+
     @classmethod
-    def instance(cls, id: str) -> "Worker":
+    def instance(cls, id: str, backend: str = "thread") -> "Worker":
         if id not in cls._instances:
-            worker = Worker(id)
+            worker = Worker(id, backend=backend)
             worker.start()
             cls._instances[id] = worker
         return cls._instances[id]
@@ -23,12 +117,45 @@ class Worker:
         for worker in cls._instances.values():
             worker.stop()
 
-    def __init__(self, id: str):
+    def __init__(
+            self,
+            id: str,
+            backend: str = "thread",
+            max_workers: Optional[int] = None,
+            num_threads: Optional[int] = None,
+            max_results: int = 256,
+    ):
+        """
+        :param backend: "thread" or "process"
+        :param max_workers: number of processes of the "process" backend, default is the number of CPUs
+        :param num_threads: number of requests that run at the same time,
+            default is 1 for the "thread" and `max_workers` for the "process" backend
+        :param max_results: number of results kept for `pop_result`, the oldest are dropped
+        """
         self.id = id
-        self._queue = queue.Queue()
-        self._results = dict()
-        self._thread: Optional[threading.Thread] = None
+        self.backend = backend
+        self.max_workers = max_workers
+        if num_threads is None:
+            num_threads = 1 if backend == "thread" else (max_workers or os.cpu_count() or 1)
+        self.num_threads = num_threads
+        self.max_results = max_results
+        # heap of _Request, including replaced ones, see _queued
+        self._queue = []
+        # id -> the _Request in the queue
+        self._queued = dict()
+        # id -> [_Request, ...] that are running
+        self._running = dict()
+        self._results = OrderedDict()
+        self._condition = threading.Condition()
+        self._seq = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._executor: Optional[ProcessPoolExecutor] = None
         self._stop = False
+        self.num_coalesced = 0
+        self.num_cancelled = 0
+        self.num_dropped_results = 0
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Worker backend must be one of {self.BACKENDS}, got '{backend}'")
 
     def __del__(self):
         if self.is_running:
@@ -40,50 +167,177 @@ class Worker:
 
     @property
     def is_running(self):
-        return self._thread and self._thread.is_alive()
+        return any(t.is_alive() for t in self._threads)
+
+    @property
+    def num_queued(self) -> int:
+        with self._condition:
+            return len(self._queued)
 
     def start(self):
         self.log("start")
-        if self._thread is not None:
+        if self._threads:
             raise RuntimeError(f"Worker already started")
-        self._thread = threading.Thread(target=self._thread_loop)
         self._stop = False
-        self._thread.start()
+        if self.backend == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        for i in range(self.num_threads):
+            thread = threading.Thread(target=self._thread_loop, name=f"{self.id}-thread-{i}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
 
     def stop(self):
+        """Wait for the running requests, the queued ones are cancelled"""
         self.log("stop")
-        if self.is_running:
-            self._queue.put_nowait("STOP")
+        with self._condition:
             self._stop = True
-            self._thread.join()
+            for request in self._queued.values():
+                request.future.cancel()
+            self._queue.clear()
+            self._queued.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
 
-        self._thread = None
+    def request(
+            self,
+            id: str,
+            func: Callable,
+            extra: Optional[Any] = None,
+            callback: Optional[Callable[[Any, Any], None]] = None,
+            priority: float = 0,
+    ) -> Future:
+        """
+        Run `func()` in the background.
 
-    def request(self, id: str, func: Callable, extra: Optional[Any] = None):
+        A queued request with the same `id` is replaced and its Future cancelled.
+        The result is stored for `pop_result(id)` together with `extra`
+        and `callback(result, extra)` is called from the worker's thread.
+        The returned Future resolves to the result.
+        """
         self.log("request", id, func)
-        self._queue.put_nowait((id, func, extra))
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(
+                lambda future: callback(future.result(), extra)
+                if not future.cancelled() and future.exception() is None else None
+            )
+        with self._condition:
+            replaced = self._queued.pop(id, None)
+            if replaced is not None:
+                self.log("coalesce", id)
+                replaced.future.cancel()
+                self.num_coalesced += 1
+            request = _Request(id, func, extra, priority, next(self._seq), future)
+            self._queued[id] = request
+            heapq.heappush(self._queue, request)
+            self._condition.notify()
+        return future
+
+    def submit(self, func: Callable, *args, priority: float = 0) -> Future:
+        """
+        Run `func(*args)` in the background, like `Executor.submit`.
+
+        The request is queued with `priority` but has no id, it is not
+        replaced by other requests and the result is only passed to the returned Future,
+        which can be cancelled until the request starts.
+        """
+        future = Future()
+        with self._condition:
+            seq = next(self._seq)
+            request = _Request(("submit", seq), partial(func, *args), None, priority, seq, future)
+            request.discard = True
+            self._queued[request.id] = request
+            heapq.heappush(self._queue, request)
+            self._condition.notify()
+        return future
+
+    def cancel(self, id: str) -> bool:
+        """
+        Drop the queued request `id` and the result of a running or finished one,
+        returns True if anything was dropped
+        """
+        with self._condition:
+            dropped = False
+            request = self._queued.pop(id, None)
+            if request is not None:
+                request.future.cancel()
+                dropped = True
+            for request in self._running.get(id, ()):
+                request.discard = True
+                dropped = True
+            if self._results.pop(id, None) is not None:
+                dropped = True
+            if dropped:
+                self.log("cancel", id)
+                self.num_cancelled += 1
+            return dropped
 
     def pop_result(self, id: str) -> Optional[Dict[str, Any]]:
-        if id in self._results:
-            self.log("pop result", id)
-            result = self._results.pop(id)
-            return {
-                "result": result[0],
-                "extra": result[1],
-            }
+        with self._condition:
+            if id in self._results:
+                self.log("pop result", id)
+                result = self._results.pop(id)
+                return {
+                    "result": result[0],
+                    "extra": result[1],
+                }
         return None
 
+    def _next_request(self) -> Optional[_Request]:
+        with self._condition:
+            while True:
+                if self._stop:
+                    return None
+                while self._queue:
+                    request = heapq.heappop(self._queue)
+                    # replaced or cancelled requests stay in the heap
+                    if self._queued.get(request.id) is request:
+                        del self._queued[request.id]
+                        if request.future.set_running_or_notify_cancel():
+                            self._running.setdefault(request.id, []).append(request)
+                            return request
+                self._condition.wait()
+
+    def _run(self, func: Callable):
+        if self.backend == "process":
+            process_future = self._executor.submit(_run_in_process, func, self.SHARED_MEMORY_MIN_BYTES)
+            return _from_shared(process_future.result())
+        return func()
+
     def _thread_loop(self):
-        threading.current_thread().name = f"{self.id}-thread"
-        while not self._stop:
+        while True:
+            request = self._next_request()
+            if request is None:
+                break
+
+            self.log("working", request.id)
             try:
-                self.log("wait for work")
-                work = self._queue.get(True, timeout=10)
-                if work == "STOP":
-                    break
-            except queue.Empty:
+                result = self._run(request.func)
+            except Exception as e:
+                traceback.print_exc()
+                with self._condition:
+                    self._finished(request)
+                request.future.set_exception(e)
                 continue
 
-            self.log("working", work[0])
-            self._results[work[0]] = (work[1](), work[2])
-            self.log("finished", work[0])
+            with self._condition:
+                self._finished(request)
+                if not request.discard:
+                    self._results.pop(request.id, None)
+                    self._results[request.id] = (result, request.extra)
+                    while len(self._results) > self.max_results:
+                        self._results.popitem(last=False)
+                        self.num_dropped_results += 1
+            self.log("finished", request.id)
+            request.future.set_result(result)
+
+    def _finished(self, request: _Request):
+        running = self._running[request.id]
+        running.remove(request)
+        if not running:
+            del self._running[request.id]
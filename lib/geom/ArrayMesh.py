@@ -0,0 +1,108 @@
+from typing import Optional
+
+import numpy as np
+from pyglet import gl
+
+from lib.opengl.Drawable import Drawable, GL_TRIANGLES
+
+
+class ArrayMesh:
+    """
+    A triangle mesh stored in numpy arrays.
+
+    All vertex arrays have one row per vertex, `triangles` has one row
+    of three vertex indices per triangle.
+    The arrays are handed to the Drawable without conversion.
+    """
+
+    def __init__(
+            self,
+            vertices: Optional[np.ndarray] = None,
+            texcoords: Optional[np.ndarray] = None,
+            normals: Optional[np.ndarray] = None,
+            triangles: Optional[np.ndarray] = None,
+    ):
+        self.vertices = self._to_array(vertices, 3, "float32")
+        self.texcoords = self._to_array(texcoords, 2, "float32")
+        self.normals = self._to_array(normals, 3, "float32")
+        if triangles is None:
+            triangles = np.arange(len(self.vertices), dtype="uint32")
+        self.triangles = self._to_array(triangles, 3, "uint32")
+        self._attributes = dict()
+
+    @staticmethod
+    def _to_array(values, size: int, dtype: str) -> np.ndarray:
+        if values is None:
+            return np.zeros((0, size), dtype=dtype)
+        return np.ascontiguousarray(values, dtype=dtype).reshape(-1, size)
+
+    def is_empty(self):
+        return not len(self.vertices)
+
+    @property
+    def num_vertices(self) -> int:
+        return len(self.vertices)
+
+    @property
+    def num_triangles(self) -> int:
+        return len(self.triangles)
+
+    def set_attribute(self, name: str, size: int, values, type=gl.GLfloat):
+        self._attributes[name] = (size, self._to_array(values, size, "float32"), type)
+
+    def attribute_names(self):
+        return self._attributes.keys()
+
+    def attribute_size(self, name: str) -> int:
+        return self._attributes[name][0]
+
+    def attribute_type(self, name: str):
+        return self._attributes[name][2]
+
+    def attributes_array(self, name: str) -> np.ndarray:
+        return self._attributes[name][1]
+
+    def to_arrays(self) -> dict:
+        """All arrays by name, attributes are prefixed with 'attr-'"""
+        arrays = {
+            "vertices": self.vertices,
+            "texcoords": self.texcoords,
+            "normals": self.normals,
+            "triangles": self.triangles,
+        }
+        for name in self.attribute_names():
+            arrays["attr-%s" % name] = self.attributes_array(name)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "ArrayMesh":
+        mesh = cls(arrays["vertices"], arrays["texcoords"], arrays["normals"], arrays["triangles"])
+        for key, values in arrays.items():
+            if key.startswith("attr-"):
+                mesh.set_attribute(key[5:], values.shape[-1], values)
+        return mesh
+
+    def create_drawable(self, name=None):
+        draw = Drawable(name=name)
+        return self.update_drawable(draw)
+
+    def update_drawable(self, draw):
+        draw.clear()
+        if self.is_empty():
+            raise ValueError("No vertices to make drawable")
+        draw.set_attribute(draw.A_POSITION, 3, self.vertices.ravel())
+
+        if len(self.normals):
+            draw.set_attribute(draw.A_NORMAL, 3, self.normals.ravel())
+
+        if len(self.texcoords):
+            draw.set_attribute(draw.A_TEXCOORD, 2, self.texcoords.ravel())
+
+        if len(self.triangles):
+            draw.set_index(GL_TRIANGLES, self.triangles.ravel())
+
+        for name, (size, values, type) in self._attributes.items():
+            if len(values):
+                draw.set_attribute(name, size, values.ravel(), type)
+
+        return draw
@@ -1,3 +1,4 @@
+from .ArrayMesh import ArrayMesh
 from .LineMesh import LineMesh
 from .MeshFactory import MeshFactory
 from .Polygons import Polygons
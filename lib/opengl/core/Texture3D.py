@@ -1,3 +1,5 @@
+import numpy as np
+
 from .TextureBase import *
 
 
@@ -23,7 +25,10 @@ class Texture3D(TextureBase):
         self.gpu_format = gpu_format
 
         if values is not None:
-            ptr = (get_opengl_type(input_type) * len(values))(*values)
+            if isinstance(values, np.ndarray):
+                ptr = np.ctypeslib.as_ctypes(np.ascontiguousarray(values).reshape(-1))
+            else:
+                ptr = (get_opengl_type(input_type) * len(values))(*values)
         else:
             ptr = None
 
@@ -37,4 +42,14 @@ class Texture3D(TextureBase):
         self.set_parameter(GL_TEXTURE_WRAP_S, self.wrap_mode)
         self.set_parameter(GL_TEXTURE_WRAP_T, self.wrap_mode)
 
+    def upload_region(self, values, x, y, z, width, height, depth,
+                      input_format=GL_RGB, input_type=GL_FLOAT, mipmap_level=0):
+        """Replace the box at `x`, `y`, `z` of size `width`, `height`, `depth`
+        with the linear data in `values`. The texture must have been uploaded before"""
+        if isinstance(values, np.ndarray):
+            ptr = np.ctypeslib.as_ctypes(np.ascontiguousarray(values).reshape(-1))
+        else:
+            ptr = (get_opengl_type(input_type) * len(values))(*values)
 
+        glTexSubImage3D(self.target, mipmap_level, x, y, z, width, height, depth,
+                        input_format, input_type, ptr)
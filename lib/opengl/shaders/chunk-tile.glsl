@@ -0,0 +1,14 @@
+#line 2
+/*  Texture coordinates for chunk meshes.
+
+    Meshes from WorldChunk.create_greedy_mesh store the voxel position
+    inside each merged quad in the texcoord and the tileset rectangle
+    (offset, size) in the tile attribute. The tile is repeated once per voxel.
+
+    All other meshes leave the tile attribute at zero size
+    and have tileset coordinates in texcoord. */
+vec2 chunk_tile_texcoord(in vec2 texcoord, in vec4 tile) {
+    if (tile.z <= 0.)
+        return texcoord;
+    return tile.xy + fract(texcoord) * tile.zw;
+}
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional, Dict
+
+import numpy as np
+
+
+class ChunkCache:
+    """
+    Binary file cache for data derived from a WorldChunk.
+
+    Each entry is a directory of .npy files, named after the data and a
+    hash of the chunk contents, the generator parameters and VERSION.
+    Changing the chunk or the parameters therefore never returns stale data.
+
+    Arrays are loaded memory-mapped (copy-on-write), so only the parts
+    that are actually used get read from disk.
+    """
+
+    # increase when the layout or the generators of cached data change
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def __repr__(self):
+        return "ChunkCache(%s)" % self.path
+
+    def key(self, chunk, name: str, **params) -> str:
+        h = hashlib.sha1()
+        h.update(("%s|%s|%s|" % (self.VERSION, name, sorted(params.items()))).encode())
+        h.update(chunk.content_hash().encode())
+        return "%s-%s" % (name, h.hexdigest())
+
+    def load(self, chunk, name: str, **params) -> Optional[Dict[str, np.ndarray]]:
+        """Returns the arrays stored for `name` or None"""
+        path = self.path / self.key(chunk, name, **params)
+        if not path.is_dir():
+            return None
+        return {
+            filename[:-4]: np.load(path / filename, mmap_mode="c")
+            for filename in sorted(os.listdir(path))
+            if filename.endswith(".npy")
+        }
+
+    def save(self, chunk, name: str, arrays: Dict[str, np.ndarray], **params):
+        path = self.path / self.key(chunk, name, **params)
+        self.path.mkdir(parents=True, exist_ok=True)
+        # write to a temp directory first so a half-written entry is never loaded
+        temp_path = Path(tempfile.mkdtemp(dir=self.path, prefix=".tmp-"))
+        try:
+            for array_name, array in arrays.items():
+                np.save(temp_path / ("%s.npy" % array_name), np.asarray(array))
+            if path.exists():
+                shutil.rmtree(path)
+            temp_path.rename(path)
+        finally:
+            if temp_path.exists():
+                shutil.rmtree(temp_path)
+
+    def clear(self):
+        if self.path.exists():
+            shutil.rmtree(self.path)
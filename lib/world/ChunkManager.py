@@ -0,0 +1,443 @@
+from typing import Optional, Callable, Tuple, Dict, Iterable
+
+import numpy as np
+
+from lib.gen import Worker
+from .WorldChunk import WorldChunk
+
+
+class ChunkManager:
+    """
+    A world made of equally sized WorldChunks on a 2d grid.
+
+    Chunks are created by `source` around a position (usually the player),
+    their mesh and voxel distance field are built by the `worker` and chunks
+    that are far away are dropped when `max_bytes` is exceeded.
+
+    Neighbouring chunks copy each other's voxels into their border, so face culling
+    and ambient occlusion are seamless across chunks.
+
+    The voxel queries of WorldChunk and `waypoints` work in world coordinates
+    across all loaded chunks, so it can be used in place of a WorldChunk for the Agents.
+    """
+
+    LEFT = WorldChunk.LEFT
+    RIGHT = WorldChunk.RIGHT
+    FRONT = WorldChunk.FRONT
+    BACK = WorldChunk.BACK
+    BOTTOM = WorldChunk.BOTTOM
+    TOP = WorldChunk.TOP
+
+    def __init__(
+            self,
+            tileset,
+            source: Callable,
+            chunk_size: Tuple[int, int, int] = (32, 32, 16),
+            load_radius: int = 1,
+            max_bytes: int = 256 * 2**20,
+            vdf_scale: int = 1,
+            greedy_mesh: bool = False,
+            worker: Optional[Worker] = None,
+            build: bool = True,
+    ):
+        """
+        :param source: callable(chunk, x, y, width, height, depth) that fills the chunk
+            with the voxels of the world area starting at x, y, see `tiled_source` and `heightmap_source`
+        :param load_radius: number of chunks around the center chunk that are loaded in `update`
+        :param worker: Worker for loading and building, if None everything is done in `update`
+        :param build: create the meshes and distance fields, False for a simulation without rendering
+        """
+        self.tileset = tileset
+        self.source = source
+        self.chunk_size = tuple(chunk_size)
+        self.load_radius = load_radius
+        self.max_bytes = max_bytes
+        self.vdf_scale = vdf_scale
+        self.greedy_mesh = greedy_mesh
+        self.worker = worker
+        self.build = build
+        self._chunks: Dict[Tuple[int, int], WorldChunk] = dict()
+        self._meshes = dict()
+        self._vdfs = dict()
+        # increases with every change of a chunk's voxels or border
+        self._versions = dict()
+        self._loading = set()
+        self._building = dict()
+        # ids of worker results that are not needed anymore
+        self._discard = set()
+        self._waypoints = None
+        # keys of the loaded or unloaded chunks whose waypoints need an update
+        self._waypoint_keys = set()
+        # key -> bytes of voxels, mesh and distance field, counted when they are stored
+        self._bytes = dict()
+        self._total_bytes = 0
+
+    def __repr__(self):
+        return "ChunkManager(%s chunks of %s)" % (len(self._chunks), self.chunk_size)
+
+    @staticmethod
+    def tiled_source(tiled) -> Callable:
+        """A source that cuts chunks from a TiledImport or filename"""
+        if isinstance(tiled, str):
+            from .TiledImport import TiledImport
+            filename, tiled = tiled, TiledImport()
+            tiled.load(filename)
+        # tiled rows go from top to bottom
+        tiles = np.asarray(tiled.layers, dtype="int64").reshape(
+            tiled.num_layers, tiled.height, tiled.width
+        )[:, ::-1, :]
+
+        def _source(chunk, x, y, width, height, depth):
+            block = np.zeros((depth, height, width), dtype="int64")
+            part = tiles[:depth, max(0, y):y+height, max(0, x):x+width]
+            if part.size:
+                block[:part.shape[0], max(0, -y):max(0, -y)+part.shape[1], max(0, -x):max(0, -x)+part.shape[2]] = part
+            chunk.from_voxels(block > 0, np.maximum(0, block - 1))
+
+        return _source
+
+    @staticmethod
+    def heightmap_source(sampler, max_height: int, texture: int = 1) -> Callable:
+        """A source that creates a landscape from a BlockSampler2DBase with values in [0, 1]"""
+        def _source(chunk, x, y, width, height, depth):
+            heightmap = (np.clip(sampler(x, y, width, height), 0, 1) * max_height).astype("int32")
+            occupied = heightmap[np.newaxis] >= np.arange(depth).reshape(-1, 1, 1)
+            chunk.from_voxels(occupied, occupied * texture)
+
+        return _source
+
+    # --- chunks ---
+
+    def chunk_key(self, x, y) -> Tuple[int, int]:
+        """Key of the chunk containing world position x, y"""
+        return int(x) // self.chunk_size[0], int(y) // self.chunk_size[1]
+
+    def chunk_offset(self, key) -> Tuple[int, int, int]:
+        """World position of the chunk's voxel 0, 0, 0"""
+        return key[0] * self.chunk_size[0], key[1] * self.chunk_size[1], 0
+
+    def keys(self) -> Iterable[Tuple[int, int]]:
+        return self._chunks.keys()
+
+    def chunk(self, key) -> Optional[WorldChunk]:
+        return self._chunks.get(key)
+
+    def mesh(self, key):
+        """The ArrayMesh in chunk coordinates or None if not built yet"""
+        return self._meshes.get(key)
+
+    def voxel_distance_field(self, key):
+        return self._vdfs.get(key)
+
+    def version(self, key) -> int:
+        return self._versions.get(key, 0)
+
+    def is_loaded(self, key) -> bool:
+        return key in self._chunks
+
+    def is_built(self, key) -> bool:
+        """True if the mesh and distance field are up-to-date"""
+        return key in self._meshes and key not in self._building
+
+    def keys_around(self, x, y, radius=None) -> Iterable[Tuple[int, int]]:
+        """All chunk keys within `radius` (default load_radius) of the chunk at world position x, y"""
+        if radius is None:
+            radius = self.load_radius
+        cx, cy = self.chunk_key(x, y)
+        return [
+            (cx + dx, cy + dy)
+            for dy in range(-radius, radius + 1)
+            for dx in range(-radius, radius + 1)
+        ]
+
+    def update(self, position=None):
+        """
+        Load chunks around `position` (x, y), collect the results of the worker
+        and drop distant chunks if over budget. Call once per frame.
+        """
+        if position is not None:
+            for key in self.keys_around(position[0], position[1]):
+                if key not in self._chunks and key not in self._loading:
+                    self._request_load(key)
+        self._poll()
+        if position is not None:
+            self.evict(self.chunk_key(position[0], position[1]))
+
+    def load(self, key) -> WorldChunk:
+        """Create the chunk immediately and build it, if not already loaded"""
+        if key not in self._chunks:
+            self._insert(key, self._create_chunk(key))
+        if self.worker is None:
+            # also rebuilds the neighbours
+            self._poll()
+        elif key in self._building:
+            self._discard.add(self._build_id(key, self._building[key]))
+            self._build(key, self._chunks[key])
+        return self._chunks[key]
+
+    def unload(self, key):
+        if self._chunks.pop(key, None) is not None:
+            self._waypoint_keys.add(key)
+            self._total_bytes -= self._bytes.pop(key)
+        if key in self._building and self.worker is not None:
+            self._discard.add(self._build_id(key, self._building[key]))
+        # versions are kept so worker results of an earlier load can not be mistaken as current
+        for d in (self._meshes, self._vdfs, self._building):
+            d.pop(key, None)
+
+    def memory_usage(self, key=None) -> int:
+        """Estimated bytes of voxels, meshes and distance fields of one or all chunks"""
+        if key is None:
+            return self._total_bytes
+        return self._bytes[key]
+
+    def evict(self, center_key):
+        """Unload the chunks farthest from `center_key` outside of load_radius until within max_bytes"""
+        if self._total_bytes <= self.max_bytes:
+            return
+
+        def _distance(key):
+            return max(abs(key[0] - center_key[0]), abs(key[1] - center_key[1]))
+
+        for key in sorted(self._chunks, key=_distance, reverse=True):
+            if self._total_bytes <= self.max_bytes or _distance(key) <= self.load_radius:
+                break
+            self.unload(key)
+
+    def _create_chunk(self, key) -> WorldChunk:
+        chunk = WorldChunk(self.tileset)
+        chunk.id = "chunk-%s-%s" % key
+        x, y, z = self.chunk_offset(key)
+        self.source(chunk, x, y, *self.chunk_size)
+        if chunk.size() != self.chunk_size:
+            raise ValueError(
+                "ChunkManager source created chunk of size %s, expected %s" % (chunk.size(), self.chunk_size)
+            )
+        return chunk
+
+    def _request_load(self, key):
+        if self.worker is None:
+            self._insert(key, self._create_chunk(key))
+        else:
+            self._loading.add(key)
+            self.worker.request("chunk-load-%s-%s" % key, lambda: self._create_chunk(key), key)
+
+    def _insert(self, key, chunk):
+        self._loading.discard(key)
+        self._chunks[key] = chunk
+        self._versions[key] = self._versions.get(key, 0) + 1
+        self._count_bytes(key)
+        self._waypoint_keys.add(key)
+        changed = {key}
+        for nkey in self._neighbour_keys(key):
+            if nkey in self._chunks:
+                self._copy_border(key, nkey)
+                self._copy_border(nkey, key)
+                changed.add(nkey)
+        for ckey in changed:
+            if ckey != key:
+                self._versions[ckey] += 1
+            self._chunks[ckey].clear_cache()
+            if self.build:
+                self._request_build(ckey)
+
+    def _neighbour_keys(self, key):
+        return [
+            (key[0] + dx, key[1] + dy)
+            for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+            if dx or dy
+        ]
+
+    def _copy_border(self, dst_key, src_key):
+        """Copy the voxels of chunk `src_key` into the border of chunk `dst_key`"""
+        dst, src = self._chunks[dst_key], self._chunks[src_key]
+        b = WorldChunk.BORDER
+        slices_dst, slices_src = [slice(b, b + dst.num_z)], [slice(None)]
+        for axis in range(2):
+            size = self.chunk_size[axis]
+            d0 = dst_key[axis] * size - b
+            s0 = src_key[axis] * size
+            lo, hi = max(d0, s0), min(d0 + size + 2 * b, s0 + size)
+            if hi <= lo:
+                return
+            slices_dst.insert(1, slice(lo - d0, hi - d0))
+            slices_src.insert(1, slice(lo - s0, hi - s0))
+        slices_dst, slices_src = tuple(slices_dst), tuple(slices_src)
+        dst.padded_space_type[slices_dst] = src.space_type[slices_src]
+        dst.padded_texture[slices_dst] = src.texture[slices_src]
+
+    def _build_id(self, key, version):
+        return "chunk-build-%s-%s-%s" % (key + (version, ))
+
+    def _request_build(self, key):
+        version = self._versions[key]
+        if self.worker is not None:
+            if key in self._building:
+                self._discard.add(self._build_id(key, self._building[key]))
+            # build from a copy, the border might change in the meantime
+            chunk = self._chunks[key].copy()
+            self.worker.request(self._build_id(key, version), lambda: self._build_data(chunk), key)
+        self._building[key] = version
+
+    def _build_data(self, chunk):
+        return (
+            chunk.create_mesh(greedy=self.greedy_mesh),
+            chunk.create_voxel_distance_field(self.vdf_scale),
+        )
+
+    def _build(self, key, chunk):
+        self._store_build(key, self._build_data(chunk))
+
+    def _store_build(self, key, data):
+        self._meshes[key], self._vdfs[key] = data
+        del self._building[key]
+        self._count_bytes(key)
+
+    def _count_bytes(self, key):
+        """Update the memory usage of the chunk after its voxels, mesh or distance field were stored"""
+        chunk = self._chunks[key]
+        num = chunk.padded_space_type.nbytes + chunk.padded_texture.nbytes
+        for obj in (self._meshes.get(key), self._vdfs.get(key)):
+            if obj is not None:
+                num += sum(a.nbytes for a in obj.to_arrays().values())
+        self._total_bytes += num - self._bytes.get(key, 0)
+        self._bytes[key] = num
+
+    def _poll(self):
+        if self.worker is None:
+            for key in list(self._building):
+                self._build(key, self._chunks[key])
+            return
+
+        for key in list(self._loading):
+            result = self.worker.pop_result("chunk-load-%s-%s" % key)
+            if result is not None:
+                self._insert(key, result["result"])
+
+        for key, version in list(self._building.items()):
+            result = self.worker.pop_result(self._build_id(key, version))
+            if result is not None:
+                self._store_build(key, result["result"])
+
+        for id in list(self._discard):
+            if self.worker.pop_result(id) is not None:
+                self._discard.remove(id)
+
+    # --- world queries ---
+
+    def contains(self, x, y, z):
+        return self.chunk_key(x, y) in self._chunks and 0 <= z < self.chunk_size[2]
+
+    def is_occupied(self, x, y, z):
+        key = self.chunk_key(x, y)
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            return False
+        ox, oy, oz = self.chunk_offset(key)
+        return chunk.is_occupied(x - ox, y - oy, z - oz)
+
+    def is_occupied_array(self, x: np.ndarray, y: np.ndarray, z: np.ndarray) -> np.ndarray:
+        """Vectorized is_occupied for int arrays of positions"""
+        x, y, z = (np.asarray(a, dtype="int64") for a in (x, y, z))
+        result = np.zeros(len(x), dtype="bool")
+        sx, sy = self.chunk_size[:2]
+        keys = np.stack([x // sx, y // sy], axis=-1)
+        for key in set(map(tuple, keys.tolist())):
+            chunk = self._chunks.get(key)
+            if chunk is not None:
+                inside = (keys[:, 0] == key[0]) & (keys[:, 1] == key[1])
+                ox, oy, oz = self.chunk_offset(key)
+                result[inside] = chunk.is_occupied_array(x[inside] - ox, y[inside] - oy, z[inside] - oz)
+        return result
+
+    def is_wall(self, x, y, z, side):
+        return self.is_occupied(x, y, z)
+
+    @property
+    def waypoints(self):
+        """
+        WayPoints of all loaded chunks in world coordinates, connected across chunk borders.
+
+        It stays the same object when chunks are loaded or unloaded, only the edges
+        crossing those chunks are updated (see `WayPoints.update_edges`), so path-finders
+        built on it keep working. The nodes of unloaded chunks are removed and their ids reused.
+        """
+        if self._waypoints is None:
+            self._waypoints = self.create_waypoints()
+            self._waypoint_keys.clear()
+        for key in sorted(self._waypoint_keys):
+            if key in self._chunks:
+                positions, edges = self._chunk_waypoint_arrays(key)
+            else:
+                positions, edges = np.zeros((0, 3), dtype="int64"), np.zeros((0, 2), dtype="int64")
+            ox, oy, oz = self.chunk_offset(key)
+            sx, sy, sz = self.chunk_size
+            self._waypoints.update_edges(
+                positions, edges, (ox, oy, oz - 1), (ox + sx - 1, oy + sy - 1, oz + sz + 1)
+            )
+        self._waypoint_keys.clear()
+        return self._waypoints
+
+    def create_waypoints(self, min_component_size=2):
+        """
+        Returns the WayPoints of all loaded chunks, the same graph as
+        `WorldChunk.create_waypoints` of one chunk covering them.
+        """
+        from ..ai import WayPoints
+        nodes, edges = self.waypoint_arrays(min_component_size)
+        return WayPoints.from_arrays({"positions": nodes, "edges": edges})
+
+    def waypoint_arrays(self, min_component_size=2):
+        """
+        Returns the [node, xyz] world positions and [edge, 2] node indices of the waypoints of all loaded chunks.
+
+        Every walkable position of each chunk is a node, also the ones that
+        only connect across a chunk border, the small components are dropped
+        after the border edges are added.
+        """
+        nodes, edges = [], []
+        num_nodes = 0
+        for key in self._chunks:
+            chunk_nodes, chunk_edges = self._chunk_waypoint_arrays(key)
+            nodes.append(chunk_nodes)
+            edges.append(chunk_edges + num_nodes)
+            num_nodes += len(chunk_nodes)
+        if not nodes:
+            return np.zeros((0, 3), dtype="int64"), np.zeros((0, 2), dtype="int64")
+        # the nodes along the borders are returned by both chunks
+        nodes, inverse = np.unique(np.concatenate(nodes), axis=0, return_inverse=True)
+        edges = np.sort(inverse.reshape(-1)[np.concatenate(edges)], axis=-1)
+        edges = np.unique(edges.reshape(-1, 2), axis=0)
+        return WorldChunk.connected_waypoints(nodes, edges, min_component_size)
+
+    def _chunk_waypoint_arrays(self, key):
+        """
+        Returns the [node, xyz] world positions and [edge, 2] node indices of the walkable
+        positions of the chunk and of the connections whose bounding box crosses the chunk.
+
+        The connections to the neighbours are found in the chunk's border.
+        A connection is only made if its bounding box is within loaded chunks,
+        it depends on all voxels in there.
+        """
+        sx, sy, sz = self.chunk_size
+        ox, oy, oz = self.chunk_offset(key)
+        nodes, edges = self._chunks[key].waypoint_arrays((-1, -1, 0), (sx + 1, sy + 1, 0))
+        nodes = nodes + (ox, oy, oz)
+        # which of the 3x3 chunks around are loaded
+        loaded = np.array([
+            [(key[0] + dx, key[1] + dy) in self._chunks for dx in (-1, 0, 1)]
+            for dy in (-1, 0, 1)
+        ])
+        p1, p2 = nodes[edges[:, 0]], nodes[edges[:, 1]]
+        lo, hi = np.minimum(p1, p2), np.maximum(p1, p2)
+        keep = (hi[:, 0] >= ox) & (lo[:, 0] < ox + sx) & (hi[:, 1] >= oy) & (lo[:, 1] < oy + sy)
+        for x in (lo[:, 0], hi[:, 0]):
+            for y in (lo[:, 1], hi[:, 1]):
+                keep &= loaded[(y - oy) // sy + 1, (x - ox) // sx + 1]
+        edges = edges[keep]
+
+        # the nodes of the chunk and the connected ones in the border
+        used = (nodes[:, 0] >= ox) & (nodes[:, 0] < ox + sx) & (nodes[:, 1] >= oy) & (nodes[:, 1] < oy + sy)
+        used[edges.reshape(-1)] = True
+        new_index = np.cumsum(used) - 1
+        return nodes[used], new_index[edges]
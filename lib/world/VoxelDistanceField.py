@@ -1,11 +1,16 @@
 import math, json
 import glm
+import numpy as np
+import scipy.ndimage
 from pyglet.gl import *
 from lib.opengl import Texture3D
 
 
 class VoxelDistanceField:
 
+    # names for calc_distances_by_name
+    METHODS = ("edt", "dead_reckoning", "exact_superslow")
+
     def __init__(self, width, height, depth):
         self.width = width
         self.height = height
@@ -13,14 +18,51 @@ class VoxelDistanceField:
         self.values = [0] * (width * height * depth)
         self.distances = [0.] * (width * height * depth)
 
+    @classmethod
+    def from_occupancy(cls, occupancy, scale=1):
+        """
+        Create from a [z, y, x] array of occupied voxels,
+        each voxel is repeated `scale` times along each axis
+        """
+        occupancy = np.asarray(occupancy) != 0
+        for axis in range(3):
+            occupancy = np.repeat(occupancy, scale, axis=axis)
+        vox = cls(0, 0, 0)
+        vox.depth, vox.height, vox.width = occupancy.shape
+        vox.values = occupancy.astype("int8").reshape(-1)
+        vox.distances = np.zeros(occupancy.size, dtype="float32")
+        return vox
+
+    def occupancy(self) -> np.ndarray:
+        """[z, y, x] boolean array of all voxels with a value"""
+        return np.asarray(self.values).reshape(self.depth, self.height, self.width) > 0
+
+    def distance_array(self) -> np.ndarray:
+        """[z, y, x] float32 array of the distances"""
+        return np.asarray(self.distances, dtype="float32").reshape(self.depth, self.height, self.width)
+
+    def to_arrays(self) -> dict:
+        return {
+            "values": np.asarray(self.values, dtype="int8").reshape(self.depth, self.height, self.width),
+            "distances": self.distance_array(),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "VoxelDistanceField":
+        vox = cls(0, 0, 0)
+        vox.depth, vox.height, vox.width = arrays["distances"].shape
+        vox.values = arrays["values"].reshape(-1)
+        vox.distances = arrays["distances"].reshape(-1)
+        return vox
+
     def save_json(self, filename):
         with open(filename, "w") as fp:
             json.dump({
                 "w": self.width,
                 "h": self.height,
                 "d": self.depth,
-                "values": self.values,
-                "distances": self.distances }, fp)
+                "values": np.asarray(self.values).tolist(),
+                "distances": np.asarray(self.distances).tolist() }, fp)
 
     def load_json(self, filename):
         with open(filename) as fp:
@@ -45,6 +87,133 @@ class VoxelDistanceField:
     def set_value(self, x, y, z, val):
         self.values[self.pos_to_index(x, y, z)] = val
 
+    def calc_distances_by_name(self, method="edt"):
+        """Calculate the distances with one of the METHODS"""
+        if method == "edt":
+            self.calc_distances_edt()
+        elif method == "dead_reckoning":
+            self.calc_distances()
+        elif method == "exact_superslow":
+            self.calc_distances_exact_superslow()
+        else:
+            raise ValueError("Unknown distance method '%s', expected one of %s" % (method, self.METHODS))
+
+    def calc_distances_edt(self):
+        """
+        Exact euclidean signed distance field.
+
+        Empty voxels get the distance to the closest voxel with a value,
+        voxels with a value get the negative distance to their closest surface voxel,
+        so the surface itself is at 0 like in `calc_distances`
+        """
+        occupied = self.occupancy()
+        if not occupied.any():
+            max_dist = math.sqrt(self.width*self.width+self.height*self.height+self.depth*self.depth)
+            self.distances = np.full(occupied.size, max_dist, dtype="float32")
+            return
+
+        outside = scipy.ndimage.distance_transform_edt(~occupied)
+        # everything beyond the field is empty
+        inside = scipy.ndimage.distance_transform_edt(np.pad(occupied, 1))[1:-1, 1:-1, 1:-1]
+        distances = np.where(occupied, 1. - inside, outside)
+        self.distances = distances.astype("float32").reshape(-1)
+
+    def update_occupancy(self, occupancy, box_min, box_max):
+        """
+        Copy the voxels inside the xyz box [box_min, box_max) of the unscaled [z, y, x]
+        `occupancy` array (the one passed to from_occupancy) and update the distances.
+
+        Returns the (min, max) xyz box of the field that has changed, see update_distances_edt
+        """
+        occupancy = np.asarray(occupancy) != 0
+        scale = self.depth // occupancy.shape[0]
+        lo = np.clip(box_min[::-1], 0, occupancy.shape)
+        hi = np.clip(box_max[::-1], lo, occupancy.shape)
+
+        block = occupancy[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+        for axis in range(3):
+            block = np.repeat(block, scale, axis=axis)
+
+        self.values = np.asarray(self.values, dtype="int8").reshape(-1)
+        values = self.values.reshape(self.depth, self.height, self.width)
+        lo, hi = lo * scale, hi * scale
+        values[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]] = block
+
+        return self.update_distances_edt(lo[::-1], hi[::-1])
+
+    def update_distances_edt(self, box_min, box_max):
+        """
+        Recalculate the distances after the values inside the xyz box [box_min, box_max)
+        have changed. `distances` must be those of calc_distances_edt for the previous values.
+
+        The result is the same as calling calc_distances_edt again but only voxels
+        that are closer to the box than to their previous closest surface are recalculated,
+        using as much of the surrounding field as needed.
+
+        Returns the (min, max) xyz box of voxels that have been rewritten
+        """
+        shape = np.array((self.depth, self.height, self.width))
+        lo = np.clip(box_min[::-1], 0, shape)
+        hi = np.clip(box_max[::-1], lo, shape)
+        if np.any(hi <= lo):
+            return tuple(lo[::-1].tolist()), tuple(lo[::-1].tolist())
+
+        occupied = self.occupancy()
+        if not occupied.any():
+            self.calc_distances_edt()
+            return (0, 0, 0), self.size()
+
+        self.distances = np.asarray(self.distances, dtype="float32").reshape(-1)
+        distances = self.distances.reshape(shape)
+
+        # voxels whose distance can change are at most their current distance (+1 inside) away from the box
+        axis_dist = [
+            np.maximum(0, np.maximum(lo[i] - np.arange(shape[i]), np.arange(shape[i]) - hi[i] + 1))
+            for i in range(3)
+        ]
+        box_dist = np.sqrt(
+            axis_dist[0][:, None, None] ** 2 + axis_dist[1][None, :, None] ** 2 + axis_dist[2][None, None, :] ** 2
+        )
+        affected = box_dist <= np.abs(distances) + 1.
+        for axis in range(3):
+            other_axes = tuple(a for a in range(3) if a != axis)
+            idx = np.nonzero(affected.any(axis=other_axes))[0]
+            lo[axis], hi[axis] = idx[0], idx[-1] + 1
+
+        # the field border counts as empty space, like in calc_distances_edt
+        padded = np.pad(occupied, 1)
+        region = tuple(slice(l, h) for l, h in zip(lo, hi))
+        region_occupied = occupied[region]
+        margin = int(np.ceil(np.abs(distances[region]).max())) + 2
+
+        while True:
+            # context window in padded coordinates
+            c_lo = np.maximum(0, lo + 1 - margin)
+            c_hi = np.minimum(shape + 2, hi + 1 + margin)
+            context = padded[tuple(slice(l, h) for l, h in zip(c_lo, c_hi))]
+            crop = tuple(slice(l + 1 - cl, h + 1 - cl) for l, h, cl in zip(lo, hi, c_lo))
+
+            outside = scipy.ndimage.distance_transform_edt(~context)[crop] if context.any() else np.inf
+            inside = scipy.ndimage.distance_transform_edt(context)[crop] if not context.all() else np.inf
+            closest = np.where(region_occupied, inside, outside)
+
+            # distance to the closest voxel that is not part of the context window
+            reach = np.full(region_occupied.shape, np.inf)
+            for axis in range(3):
+                pos = np.arange(lo[axis], hi[axis]) + 1
+                pos = pos.reshape(tuple(-1 if a == axis else 1 for a in range(3)))
+                if c_lo[axis] > 0:
+                    reach = np.minimum(reach, pos - c_lo[axis] + 1)
+                if c_hi[axis] < shape[axis] + 2:
+                    reach = np.minimum(reach, c_hi[axis] - pos)
+
+            if np.all(closest <= reach):
+                break
+            margin *= 2
+
+        distances[region] = np.where(region_occupied, 1. - inside, outside)
+        return tuple(lo[::-1].tolist()), tuple(hi[::-1].tolist())
+
     def calc_distances_exact_superslow(self, max_range=None):
         if max_range is None:
             max_range = max(self.size())
@@ -189,11 +358,22 @@ class VoxelDistanceField:
         tex.mag_filter = GL_LINEAR
         tex.create()
         tex.bind()
-        print("MAX", max(self.distances))
-        tex.upload(self.distances, self.width, self.height, self.depth,
+        tex.upload(np.asarray(self.distances, dtype="float32"), self.width, self.height, self.depth,
                    input_format=GL_RED)
         return tex
 
+    def update_texture3d(self, tex, box_min, box_max):
+        """Upload the distances inside the xyz box [box_min, box_max) to the texture"""
+        x, y, z = box_min
+        width, height, depth = (max(0, box_max[i] - box_min[i]) for i in range(3))
+        if not (width and height and depth):
+            return
+        tex.bind()
+        tex.upload_region(
+            self.distance_array()[z:z+depth, y:y+height, x:x+width], x, y, z, width, height, depth,
+            input_format=GL_RED,
+        )
+
 
 if __name__ == "__main__":
 
@@ -1,15 +1,28 @@
-import os
+import hashlib
+
 import glm
+import numpy as np
+import scipy.ndimage
+import scipy.sparse
+import scipy.sparse.csgraph
 from pyglet.gl import *
-from lib.geom import TriangleMesh
+from lib.geom import TriangleMesh, ArrayMesh
 from lib.opengl import Texture3D, OpenGlAssets
 from .VoxelDistanceField import VoxelDistanceField
+from .ChunkCache import ChunkCache
 
 
 class WorldBlock:
-    def __init__(self):
-        self.space_type = 0
-        self.texture = 0
+    """
+    A copy of a single voxel's values as returned by `WorldChunk.block`.
+
+    Changing it does not change the chunk, use `WorldChunk.set_block` for that.
+    """
+    __slots__ = ("space_type", "texture")
+
+    def __init__(self, space_type=0, texture=0):
+        self.space_type = space_type
+        self.texture = texture
 
     def __repr__(self):
         return "(%s)" % self.space_type
@@ -24,93 +37,236 @@ class WorldChunk:
     BOTTOM = 1<<4
     TOP = 1<<5
 
+    # number of voxels around the stored volume,
+    # so the neighbours of each voxel can be sliced without bounds checks.
+    # It's empty unless a ChunkManager copies the voxels of neighbouring chunks into it,
+    # two voxels wide because the ambient occlusion looks that far
+    BORDER = 2
+
+    # (neighbour offset in [z, y, x], quad corners in (x, y, z))
+    #   in the order that create_mesh_old emits the faces of a voxel
+    FACES = (
+        ((-1, 0, 0), ((0, 1, 0), (1, 1, 0), (1, 0, 0), (0, 0, 0))),  # bottom
+        ((+1, 0, 0), ((0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1))),  # top
+        ((0, -1, 0), ((0, 0, 0), (1, 0, 0), (1, 0, 1), (0, 0, 1))),  # front
+        ((0, +1, 0), ((0, 1, 0), (0, 1, 1), (1, 1, 1), (1, 1, 0))),  # back
+        ((0, 0, -1), ((0, 1, 0), (0, 0, 0), (0, 0, 1), (0, 1, 1))),  # left
+        ((0, 0, +1), ((1, 0, 0), (1, 1, 0), (1, 1, 1), (1, 0, 1))),  # right
+    )
+    # the two triangles of each quad
+    QUAD_TRIANGLES = (0, 1, 2, 0, 2, 3)
+
+    # voxels (x, y, z) relative to a vertex that darken it, see get_ambient_color
+    AMBIENT_OFFSETS = (
+        ((-1, 0, 0), (-1, -1, 0), (0, 0, 0), (0, -1, 0))
+        + tuple((x, y, z) for z in (1, 2) for y in (-1, 0) for x in (-1, 0))
+        + tuple((x, y, 3) for y in range(-2, 2) for x in range(-2, 2))
+    )
+
     def __init__(self, tileset):
         self.num_x = 0
         self.num_y = 0
         self.num_z = 0
-        self.blocks = []
         self.tileset = tileset
         self.filename = None
+        # optional ChunkCache for derived data
+        self.cache = None
         self._waypoints = None
+        # scale -> (VoxelDistanceField, Texture3D) of create_voxel_distance_texture3d
+        self._voxel_distance_textures = dict()
         self.id = "chunk01"
+        self._cache = dict()
+        self._allocate(0, 0, 0)
 
     def size(self):
         return self.num_x, self.num_y, self.num_z
 
+    def _allocate(self, num_x, num_y, num_z):
+        self.num_x, self.num_y, self.num_z = num_x, num_y, num_z
+        b2 = self.BORDER * 2
+        shape = (num_z + b2, num_y + b2, num_x + b2)
+        self.padded_space_type = np.zeros(shape, dtype="uint8")
+        self.padded_texture = np.zeros(shape, dtype="uint16")
+        self.clear_cache()
+
+    def clear_cache(self):
+        """Drop all data derived from the voxels, needs to be called after changing the arrays directly"""
+        self._cache.clear()
+
+    def content_hash(self) -> str:
+        """sha1 hex digest of the chunk size and voxel data, including the border"""
+        if "hash" not in self._cache:
+            h = hashlib.sha1()
+            h.update(("%s,%s,%s" % self.size()).encode())
+            h.update(self.padded_space_type.tobytes())
+            h.update(self.padded_texture.tobytes())
+            self._cache["hash"] = h.hexdigest()
+        return self._cache["hash"]
+
+    def _cached(self, name, cls, create, **params):
+        """
+        Returns `create()` or the result of a previous call stored in the ChunkCache.
+        `cls` must provide `to_arrays()` and `from_arrays()`
+        """
+        if self.cache is None:
+            return create()
+        arrays = self.cache.load(self, name, **params)
+        if arrays is not None:
+            return cls.from_arrays(arrays)
+        obj = create()
+        self.cache.save(self, name, obj.to_arrays(), **params)
+        return obj
+
+    @property
+    def space_type(self) -> np.ndarray:
+        """[z, y, x] view of the space types without the border"""
+        b = self.BORDER
+        return self.padded_space_type[b:-b, b:-b, b:-b]
+
+    @property
+    def texture(self) -> np.ndarray:
+        """[z, y, x] view of the texture indices without the border"""
+        b = self.BORDER
+        return self.padded_texture[b:-b, b:-b, b:-b]
+
+    def occupancy(self, padded=False) -> np.ndarray:
+        """[z, y, x] boolean array of all non-empty voxels"""
+        return (self.padded_space_type if padded else self.space_type) != 0
+
     def from_heightmap(self, heightmap, do_flip_y=False):
-        import random
-        self.num_x = len(heightmap[0])
-        self.num_y = len(heightmap)
-        self.num_z = max(max(row) for row in heightmap) + 1
-        self.blocks = []
-        for z in range(self.num_z):
-            plane = []
-            for y in range(self.num_y):
-                row = []
-                for x in range(self.num_x):
-                    block = WorldBlock()
-                    h = heightmap[self.num_y-1-y][x] if do_flip_y else heightmap[y][x]
-                    block.space_type = 1 if h >= z else 0
-                    if block.space_type:
-                        if h == 0:
-                            block.texture = 0
-                        else:
-                            block.texture = random.randrange(1, self.tileset.num_tiles)
-                    row.append(block)
-                plane.append(row)
-            self.blocks.append(plane)
-
-    def from_tiled(self, tiled):
-        """from TiledImport or filename"""
+        heightmap = np.asarray(heightmap, dtype="int32")
+        if do_flip_y:
+            heightmap = heightmap[::-1]
+        num_y, num_x = heightmap.shape
+        self._allocate(num_x, num_y, int(heightmap.max()) + 1)
+
+        z = np.arange(self.num_z).reshape(-1, 1, 1)
+        occupied = heightmap[np.newaxis] >= z
+        self.space_type[...] = occupied
+
+        textures = np.random.randint(1, max(2, self.tileset.num_tiles), size=occupied.shape)
+        textures[:, heightmap == 0] = 0
+        self.texture[...] = np.where(occupied, textures, 0)
+
+    def from_voxels(self, space_type, texture=None):
+        """Set size and content from [z, y, x] arrays"""
+        space_type = np.asarray(space_type)
+        num_z, num_y, num_x = space_type.shape
+        self._allocate(num_x, num_y, num_z)
+        self.space_type[...] = space_type
+        if texture is not None:
+            self.texture[...] = texture
+
+    def copy(self) -> "WorldChunk":
+        """A copy of the voxels (including the border), the caches are not copied"""
+        chunk = self.__class__(self.tileset)
+        chunk.num_x, chunk.num_y, chunk.num_z = self.size()
+        chunk.padded_space_type = self.padded_space_type.copy()
+        chunk.padded_texture = self.padded_texture.copy()
+        chunk.filename = self.filename
+        chunk.id = self.id
+        return chunk
+
+    def from_tiled(self, tiled, cache=True):
+        """
+        from TiledImport or filename
+
+        :param cache: for a filename, True stores derived data in a ChunkCache in '<filename>-cache/',
+            a ChunkCache is used as given and None does not cache
+        """
         if isinstance(tiled, str):
             from .TiledImport import TiledImport
             self.filename = tiled
+            if cache is True:
+                cache = ChunkCache("%s-cache" % tiled)
+            self.cache = cache or None
             tiled = TiledImport()
             tiled.load(self.filename)
 
-        self.num_x = tiled.width
-        self.num_y = tiled.height
-        self.num_z = tiled.num_layers
-        self.blocks = []
-        for z in range(self.num_z):
-            plane = []
-            for y in range(self.num_y):
-                row = []
-                for x in range(self.num_x):
-                    block = WorldBlock()
-                    tex = tiled.layers[z][(self.num_y-1-y)*self.num_x+x]
-                    block.texture = max(0, tex - 1)
-                    block.space_type = tex > 0
-                    row.append(block)
-                plane.append(row)
-            self.blocks.append(plane)
+        # tiled rows go from top to bottom
+        tiles = np.asarray(tiled.layers, dtype="int64").reshape(
+            tiled.num_layers, tiled.height, tiled.width
+        )[:, ::-1, :]
+        self.from_voxels(tiles > 0, np.maximum(0, tiles - 1))
+
+    def contains(self, x, y, z):
+        return 0 <= x < self.num_x and 0 <= y < self.num_y and 0 <= z < self.num_z
 
     def block(self, x, y, z):
-        if 0 <= z < len(self.blocks):
-            plane = self.blocks[z]
-            if 0 <= y < len(plane):
-                row = plane[y]
-                if 0 <= x < len(row):
-                    return row[x]
+        if self.contains(x, y, z):
+            b = self.BORDER
+            return WorldBlock(
+                int(self.padded_space_type[z+b, y+b, x+b]),
+                int(self.padded_texture[z+b, y+b, x+b]),
+            )
         return WorldBlock()
 
+    def set_block(self, x, y, z, space_type, texture=0):
+        if not self.contains(x, y, z):
+            raise IndexError("WorldChunk.set_block(%s, %s, %s) out of range %s" % (x, y, z, self.size()))
+        b = self.BORDER
+        self.padded_space_type[z+b, y+b, x+b] = space_type
+        self.padded_texture[z+b, y+b, x+b] = texture
+        self.clear_cache()
+        self.update_waypoints((x, y, z), (x + 1, y + 1, z + 1))
+
     def is_wall(self, x, y, z, side):
-        b = self.block(x, y, z)
-        if b.space_type:
-            return True
-        return False
+        return self.is_occupied(x, y, z)
 
     def is_occupied(self, x, y, z):
-        return self.block(x, y, z).space_type != 0
+        if self.contains(x, y, z):
+            b = self.BORDER
+            return self.padded_space_type[z+b, y+b, x+b] != 0
+        return False
+
+    def is_occupied_array(self, x: np.ndarray, y: np.ndarray, z: np.ndarray) -> np.ndarray:
+        """Vectorized is_occupied for int arrays of positions"""
+        x, y, z = (np.asarray(a, dtype="int64") for a in (x, y, z))
+        inside = (x >= 0) & (x < self.num_x) & (y >= 0) & (y < self.num_y) & (z >= 0) & (z < self.num_z)
+        b = self.BORDER
+        result = np.zeros(len(x), dtype="bool")
+        result[inside] = self.padded_space_type[z[inside] + b, y[inside] + b, x[inside] + b] != 0
+        return result
+
+    def ambient_table(self) -> np.ndarray:
+        """
+        Returns the [z, y, x] array of get_ambient_color values
+        for all vertex positions from (0, 0, 0) to (num_x, num_y, num_z)
+        """
+        if "ambient" not in self._cache:
+            kernel = np.zeros((4, 4, 4), dtype="int32")
+            for x, y, z in self.AMBIENT_OFFSETS:
+                kernel[z, y + 2, x + 2] = 1
+            # kernel index 0 is offset -2 in x and y and offset 0 in z
+            count = scipy.ndimage.correlate(
+                self.occupancy(padded=True).astype("int32"), kernel, mode="constant", origin=(-2, 0, 0)
+            )
+            # one more row at the end for the vertices on the far side
+            b = self.BORDER
+            count = count[b:b+self.num_z+1, b:b+self.num_y+1, b:b+self.num_x+1]
+            self._cache["ambient"] = 1. - count / len(self.AMBIENT_OFFSETS)
+        return self._cache["ambient"]
+
+    def density_volume(self, radius=1) -> np.ndarray:
+        """[z, y, x] array of density_at values for each voxel"""
+        key = ("density", radius)
+        if key not in self._cache:
+            size = 1 + 2 * radius
+            count = scipy.ndimage.correlate(
+                self.occupancy().astype("int32"), np.ones((size, size, size), dtype="int32"),
+                mode="constant",
+            )
+            self._cache[key] = count / pow(size, 3)
+        return self._cache[key]
 
     def density_at(self, x, y, z, radius=1):
-        dens = 0.
-        for z in range(z - radius, z + radius + 1):
-            for y in range(y - radius, y + radius + 1):
-                for x in range(x - radius, x + radius + 1):
-                    if self.block(x, y, z).space_type:
-                        dens += 1.
-        return dens / pow(1 + 2 * radius, 3)
+        space = self.space_type
+        window = space[
+            max(0, z - radius): max(0, z + radius + 1),
+            max(0, y - radius): max(0, y + radius + 1),
+            max(0, x - radius): max(0, x + radius + 1),
+        ]
+        return float(np.count_nonzero(window)) / pow(1 + 2 * radius, 3)
 
     @property
     def voxel_texture_name(self):
@@ -128,24 +284,218 @@ class WorldChunk:
         return tex
 
     def update_texture3d(self, tex):
-        values = []
-        max_dens = 0.
-        for z, plane in enumerate(self.blocks):
-            for y, row in enumerate(plane):
-                for x, b in enumerate(row):
-                    values.append(b.space_type)
-                    values.append(self.density_at(x, y, z))
-                    max_dens = max(max_dens, values[-1])
-                    values.append(0.)
+        values = np.zeros(self.space_type.shape + (3,), dtype="float32")
+        values[..., 0] = self.space_type
+        density = self.density_volume()
+        max_dens = density.max() if density.size else 0.
         if max_dens:
-            for i in range(1, len(values), 3):
-                values[i] /= max_dens
+            values[..., 1] = density / max_dens
 
         tex.bind()
         tex.upload(values, self.num_x, self.num_y, self.num_z, GL_RGB, GL_FLOAT)
         return tex
 
-    def create_mesh(self, do_ambient=True):
+    def exposed_faces(self) -> np.ndarray:
+        """
+        Returns a boolean [z, y, x, face] array where each face index
+        corresponds to an entry in FACES
+        """
+        occ = self.occupancy(padded=True)
+        b = self.BORDER
+        nz, ny, nx = self.num_z, self.num_y, self.num_x
+        inner = occ[b:b+nz, b:b+ny, b:b+nx]
+        return np.stack([
+            inner & ~occ[b+dz:b+dz+nz, b+dy:b+dy+ny, b+dx:b+dx+nx]
+            for (dz, dy, dx), corners in self.FACES
+        ], axis=-1)
+
+    def _uv_quads(self, textures) -> np.ndarray:
+        """Returns [texture, corner, uv] array for all indices up to max(textures)"""
+        num = int(textures.max()) + 1 if len(textures) else 0
+        return np.array(
+            [self.tileset.get_uv_quad(i) for i in range(num)], dtype="float64"
+        ).reshape(num, 4, 2)
+
+    def _face_corners(self) -> np.ndarray:
+        """[face, corner, xyz] offsets of the quad corners in FACES"""
+        return np.array([f[1] for f in self.FACES], dtype="int32")
+
+    def _face_normals(self) -> np.ndarray:
+        """[face, xyz] normal of each face, same as TriangleMesh.normals_array"""
+        corners = self._face_corners().astype("float64")
+        normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        return normals / np.linalg.norm(normals, axis=-1, keepdims=True)
+
+    def ambient_at(self, positions) -> np.ndarray:
+        """Ambient value for each integer (x, y, z) vertex position in [N, 3] array"""
+        positions = np.asarray(positions).reshape(-1, 3)
+        if not len(positions):
+            return np.zeros(0)
+        table = self.ambient_table()
+        return table[positions[:, 2], positions[:, 1], positions[:, 0]]
+
+    def create_mesh(self, do_ambient=True, greedy=False):
+        """
+        Returns an ArrayMesh with one quad for each voxel face that is not covered.
+
+        The output is the same as create_mesh_old, triangle for triangle.
+
+        With `greedy` enabled, neighbouring faces with the same texture and
+        ambient value are merged into larger quads, see create_greedy_mesh
+        """
+        return self._cached(
+            "mesh", ArrayMesh,
+            lambda: self._create_mesh(do_ambient=do_ambient, greedy=greedy),
+            do_ambient=do_ambient, greedy=greedy,
+            tileset=(self.tileset.width, self.tileset.height, self.tileset.padding),
+        )
+
+    def _create_mesh(self, do_ambient, greedy):
+        if greedy:
+            return self.create_greedy_mesh(do_ambient=do_ambient)
+
+        z, y, x, face = np.nonzero(self.exposed_faces())
+
+        corners = self._face_corners()[:, self.QUAD_TRIANGLES]
+        vertices = np.stack([x, y, z], axis=-1)[:, np.newaxis, :] + corners[face]
+        vertices = vertices.reshape(-1, 3)
+
+        textures = self.texture[z, y, x]
+        texcoords = self._uv_quads(textures)[:, self.QUAD_TRIANGLES][textures].reshape(-1, 2)
+
+        normals = np.repeat(self._face_normals()[face], len(self.QUAD_TRIANGLES), axis=0)
+
+        mesh = ArrayMesh(vertices, texcoords, normals)
+
+        if do_ambient:
+            ambient = np.repeat(self.ambient_at(vertices)[:, np.newaxis], 3, axis=1)
+        else:
+            ambient = np.ones((len(vertices), 3))
+        mesh.set_attribute("a_ambient", 3, ambient)
+
+        return mesh
+
+    def create_greedy_mesh(self, do_ambient=True):
+        """
+        Returns an ArrayMesh where adjacent, coplanar faces with the same texture
+        and ambient value are merged into larger quads.
+
+        Faces whose corners have different ambient values stay single quads.
+        Each quad has four vertices that are shared by its two triangles.
+
+        `a_texcoord` counts voxels across each quad and `a_tile` holds the
+        tileset rectangle (offset, size) that the shader repeats,
+        see `lib/opengl/shaders/chunk-tile.glsl`
+        """
+        z, y, x, face = np.nonzero(self.exposed_faces())
+        corners = self._face_corners()
+        textures = self.texture[z, y, x].astype("int64")
+
+        # merge key for each face, unique for faces that must not be merged
+        keys = -1 - np.arange(len(face), dtype="int64")
+        if do_ambient:
+            face_corners = np.stack([x, y, z], axis=-1)[:, np.newaxis, :] + corners[face]
+            ambient = self.ambient_at(face_corners).reshape(-1, 4)
+            uniform = np.all(ambient == ambient[:, :1], axis=1)
+            levels, level = np.unique(ambient[:, 0], return_inverse=True)
+            level = level.reshape(-1)
+        else:
+            uniform = np.ones(len(face), dtype="bool")
+            levels, level = np.ones(1), np.zeros(len(face), dtype="int64")
+        keys[uniform] = 1 + textures[uniform] * len(levels) + level[uniform]
+
+        vertices, texcoords, tiles, normals, ambients = [], [], [], [], []
+        uv_quads = self._uv_quads(textures)
+        unit_uv = np.array([(0, 0), (1, 0), (1, 1), (0, 1)], dtype="float64")
+
+        for face_idx, (offset, face_corners) in enumerate(self.FACES):
+            sel = face == face_idx
+            if not np.any(sel):
+                continue
+            key_volume = np.zeros(self.space_type.shape, dtype="int64")
+            key_volume[z[sel], y[sel], x[sel]] = keys[sel]
+
+            # [z, y, x] axes: normal of the face, runs along x (or y) and stacking of runs
+            normal_axis = int(np.flatnonzero(offset)[0])
+            run_axis = 2 if normal_axis != 2 else 1
+            stack_axis = 3 - normal_axis - run_axis
+            plane, b0, b1, a0, a1 = self._merge_rectangles(
+                key_volume.transpose(normal_axis, stack_axis, run_axis)
+            )
+
+            start = np.zeros((len(plane), 3), dtype="int32")
+            extent = np.ones((len(plane), 3), dtype="int32")
+            start[:, normal_axis], start[:, stack_axis], start[:, run_axis] = plane, b0, a0
+            extent[:, stack_axis], extent[:, run_axis] = b1 - b0, a1 - a0
+            # to (x, y, z)
+            start, extent = start[:, ::-1], extent[:, ::-1]
+
+            quad = start[:, np.newaxis, :] + corners[face_idx] * extent[:, np.newaxis, :]
+            vertices.append(quad.reshape(-1, 3))
+
+            # texture repeats along the quad edges p1->p2 and p1->p4
+            u_axis = int(np.flatnonzero(corners[face_idx][1] - corners[face_idx][0])[0])
+            v_axis = int(np.flatnonzero(corners[face_idx][3] - corners[face_idx][0])[0])
+            size_uv = np.stack([extent[:, u_axis], extent[:, v_axis]], axis=-1)
+            local_uv = unit_uv * size_uv[:, np.newaxis, :]
+            texcoords.append(local_uv.reshape(-1, 2))
+
+            quad_uv = uv_quads[self.texture[start[:, 2], start[:, 1], start[:, 0]]]
+            tile = np.concatenate([quad_uv[:, 0], quad_uv[:, 2] - quad_uv[:, 0]], axis=-1)
+            tiles.append(np.repeat(tile, 4, axis=0))
+
+            num_vertices = len(plane) * 4
+            normals.append(np.repeat(self._face_normals()[face_idx:face_idx+1], num_vertices, axis=0))
+            if do_ambient:
+                ambients.append(self.ambient_at(vertices[-1]))
+            else:
+                ambients.append(np.ones(num_vertices))
+
+        if not vertices:
+            return ArrayMesh()
+
+        vertices = np.concatenate(vertices)
+        triangles = np.arange(0, len(vertices), 4, dtype="uint32")[:, np.newaxis] + self.QUAD_TRIANGLES
+        mesh = ArrayMesh(vertices, np.concatenate(texcoords), np.concatenate(normals), triangles)
+        mesh.set_attribute("a_tile", 4, np.concatenate(tiles))
+        mesh.set_attribute("a_ambient", 3, np.repeat(np.concatenate(ambients)[:, np.newaxis], 3, axis=1))
+        return mesh
+
+    @staticmethod
+    def _merge_rectangles(keys: np.ndarray):
+        """
+        Merges equal non-zero values in the [plane, b, a] array into rectangles.
+
+        Equal values are first joined to runs along `a`, then runs of the same
+        start, length and value in consecutive rows `b` are stacked.
+
+        Returns arrays plane, b0, b1, a0, a1 with one entry per rectangle
+        """
+        filled = keys != 0
+        previous = np.zeros_like(keys)
+        previous[..., 1:] = keys[..., :-1]
+        starts = (filled & (keys != previous)).reshape(-1)
+
+        run_id = np.cumsum(starts) - 1
+        length = np.bincount(run_id[filled.reshape(-1)], minlength=int(np.count_nonzero(starts)))
+        start_idx = np.flatnonzero(starts)
+        plane, b, a = np.unravel_index(start_idx, keys.shape)
+        value = keys.reshape(-1)[start_idx]
+
+        order = np.lexsort((b, value, length, a, plane))
+        plane, b, a, length, value = plane[order], b[order], a[order], length[order], value[order]
+
+        new_rect = np.ones(len(order), dtype="bool")
+        new_rect[1:] = (
+            (plane[1:] != plane[:-1]) | (a[1:] != a[:-1]) | (length[1:] != length[:-1])
+            | (value[1:] != value[:-1]) | (b[1:] != b[:-1] + 1)
+        )
+        first = np.flatnonzero(new_rect)
+        height = np.diff(np.append(first, len(order)))
+
+        return plane[first], b[first], b[first] + height, a[first], a[first] + length[first]
+
+    def create_mesh_old(self, do_ambient=True):
         mesh = TriangleMesh()
         mesh.create_attribute("a_ambient", 3, (1, 1, 1))
 
@@ -163,9 +513,8 @@ class WorldChunk:
                 y1 = y + 1
                 for x in range(self.num_x):
                     x1 = x + 1
-                    b = self.block(x, y, z)
-                    if b.space_type:
-                        uvquad = self.tileset.get_uv_quad(b.texture)
+                    if self.is_occupied(x, y, z):
+                        uvquad = self.tileset.get_uv_quad(int(self.texture[z, y, x]))
                         # bottom
                         if not self.is_wall(x, y, z-1, self.TOP):
                             add_quad((x, y1, z), (x1, y1, z), (x1, y, z), (x, y, z), *uvquad)
@@ -189,71 +538,25 @@ class WorldChunk:
         return mesh
 
     def get_ambient_color(self, x, y, z):
-        tests = (
-            (x-1, y+0, z+0, self.RIGHT),
-            (x-1, y-1, z+0, self.RIGHT),
-            (x+0, y+0, z+0, self.LEFT),
-            (x+0, y-1, z+0, self.LEFT),
-
-            (x-1, y-1, z+1, self.BOTTOM),
-            (x+0, y-1, z+1, self.BOTTOM),
-            (x-1, y+0, z+1, self.BOTTOM),
-            (x+0, y+0, z+1, self.BOTTOM),
-
-            (x-1, y-1, z+2, self.BOTTOM),
-            (x+0, y-1, z+2, self.BOTTOM),
-            (x-1, y+0, z+2, self.BOTTOM),
-            (x+0, y+0, z+2, self.BOTTOM),
-
-            (x-2, y-2, z+3, self.BOTTOM),
-            (x-1, y-2, z+3, self.BOTTOM),
-            (x+0, y-2, z+3, self.BOTTOM),
-            (x+1, y-2, z+3, self.BOTTOM),
-
-            (x-2, y-1, z+3, self.BOTTOM),
-            (x-1, y-1, z+3, self.BOTTOM),
-            (x+0, y-1, z+3, self.BOTTOM),
-            (x+1, y-1, z+3, self.BOTTOM),
-
-            (x-2, y+0, z+3, self.BOTTOM),
-            (x-1, y+0, z+3, self.BOTTOM),
-            (x+0, y+0, z+3, self.BOTTOM),
-            (x+1, y+0, z+3, self.BOTTOM),
-
-            (x-2, y+1, z+3, self.BOTTOM),
-            (x-1, y+1, z+3, self.BOTTOM),
-            (x+0, y+1, z+3, self.BOTTOM),
-            (x+1, y+1, z+3, self.BOTTOM),
-        )
+        """Ambient value of a single vertex, ambient_table() calculates all at once"""
         count = 0
-        for t in tests:
-            if self.is_wall(*t):
+        for ox, oy, oz in self.AMBIENT_OFFSETS:
+            if self.is_occupied(x + ox, y + oy, z + oz):
                 count += 1
-        count = 1. - count / len(tests)
+        count = 1. - count / len(self.AMBIENT_OFFSETS)
         return (count, count, count)
 
-    def create_voxel_distance_field(self, scale):
-        if self.filename:
-            cache_filename = "%s-cached-sdf.json" % self.filename
-            if os.path.exists(cache_filename):
-                if os.path.getmtime(cache_filename) >= os.path.getmtime(self.filename):
-                    vox = VoxelDistanceField(0,0,0)
-                    vox.load_json(cache_filename)
-                    vox.chunk = self
-                    return vox
-
-        vox = VoxelDistanceField(self.num_x*scale, self.num_y*scale, self.num_z*scale)
-        for z in range(self.num_z):
-            for y in range(self.num_y):
-                for x in range(self.num_x):
-                    if self.block(x, y, z).space_type > 0:
-                        for sz in range(scale):
-                            for sy in range(scale):
-                                for sx in range(scale):
-                                    vox.set_value(x+sx, y+sy, z+sz, 1)
-        vox.calc_distances()
-        if self.filename:
-            vox.save_json(cache_filename)
+    def create_voxel_distance_field(self, scale, method="edt"):
+        """
+        Returns a VoxelDistanceField with `scale` voxels per chunk voxel,
+        `method` is one of VoxelDistanceField.METHODS
+        """
+        def _create():
+            vox = VoxelDistanceField.from_occupancy(self.occupancy(), scale)
+            vox.calc_distances_by_name(method)
+            return vox
+
+        vox = self._cached("vdf", VoxelDistanceField, _create, scale=scale, method=method)
         vox.chunk = self
         return vox
 
@@ -264,8 +567,20 @@ class WorldChunk:
         vdf = self.create_voxel_distance_field(scale)
         tex = vdf.create_texture3d(name)
         OpenGlAssets.register(name, tex)
+        self._voxel_distance_textures[scale] = (vdf, tex)
         return tex
 
+    def update_voxel_distance_texture3d(self, box_min, box_max):
+        """
+        Update the distance field textures after the voxels in the
+        xyz box [box_min, box_max) have been changed with set_block.
+        Only the affected part of the distance field is recalculated and uploaded.
+        """
+        occupancy = self.occupancy()
+        for vdf, tex in self._voxel_distance_textures.values():
+            changed_min, changed_max = vdf.update_occupancy(occupancy, box_min, box_max)
+            vdf.update_texture3d(tex, changed_min, changed_max)
+
     def cast_voxel_ray(self, ro, rd, max_steps=None):
         """
         iq, nijhoff, https://www.shadertoy.com/view/4ds3WS
@@ -286,7 +601,7 @@ class WorldChunk:
             mm = glm.step(dis.xyz, dis.yxy) * glm.step(dis.xyz, dis.zzx)
             dis += mm * rs * ri
             pos += mm * rs
-            if self.block(int(pos.x), int(pos.y), int(pos.z)).space_type:
+            if self.is_occupied(int(pos.x), int(pos.y), int(pos.z)):
                 hit = True
                 break
 
@@ -297,22 +612,94 @@ class WorldChunk:
 
         return t, hit
 
+    def cast_voxel_rays(self, origins, directions, max_steps=None):
+        """
+        Cast many rays at once with the same traversal as cast_voxel_ray.
+
+        :param origins: [N, 3] array of xyz ray origins
+        :param directions: [N, 3] array of xyz ray directions
+        :return: tuple of
+            [N] distances along the directions to the hit voxel surface, inf for no hit,
+            [N, 3] int xyz positions of the hit voxels, -1 for no hit,
+            [N, 3] int normals of the hit voxel faces, 0 for no hit
+        """
+        if max_steps is None:
+            max_steps = max(self.size())
+
+        ro = np.asarray(origins, dtype="float64").reshape(-1, 3)
+        rd = np.asarray(directions, dtype="float64").reshape(-1, 3) + 0.0000001
+        num = len(ro)
+        distances = np.full(num, np.inf)
+        voxels = np.full((num, 3), -1, dtype="int64")
+        normals = np.zeros((num, 3), dtype="int64")
+
+        occupied = self.occupancy()
+        size = np.array(self.size())
+        ri = 1. / rd
+        rs = np.sign(rd)
+        pos = np.floor(ro)
+        dis = (pos - ro + .5 + rs * .5) * ri
+        # original index of the rays still traversing, the other arrays shrink with it
+        index = np.arange(num)
+
+        for i in range(max_steps):
+            if not len(index):
+                break
+            dx, dy, dz = dis.T
+            mm = np.stack([(dy >= dx) & (dz >= dx), (dx >= dy) & (dz >= dy), (dy >= dz) & (dx >= dz)], axis=-1)
+            dis += mm * rs * ri
+            pos += mm * rs
+
+            ipos = pos.astype("int64")
+            hit = np.all((ipos >= 0) & (ipos < size), axis=-1)
+            hit[hit] = occupied[ipos[hit, 2], ipos[hit, 1], ipos[hit, 0]]
+            if hit.any():
+                mini = (pos[hit] - ro[index[hit]] + .5 - .5 * rs[hit]) * ri[hit]
+                distances[index[hit]] = mini.max(axis=-1)
+                voxels[index[hit]] = ipos[hit]
+                normals[index[hit]] = -(mm[hit] * rs[hit])
+
+            # rays that left the chunk can not come back
+            leaving = np.any(((ipos < 0) & (rs < 0)) | ((ipos >= size) & (rs > 0)), axis=-1)
+            keep = ~(hit | leaving)
+            index, ri, rs, pos, dis = (a[keep] for a in (index, ri, rs, pos, dis))
+
+        return distances, voxels, normals
+
     @property
     def waypoints(self):
         if self._waypoints is None:
-            self._waypoints = self.create_waypoints()
+            from ..ai import WayPoints
+            self._waypoints = self._cached("waypoints", WayPoints, self.create_waypoints)
         return self._waypoints
 
+    def update_waypoints(self, box_min, box_max):
+        """
+        Update the edges of the `waypoints` after the voxels in the
+        xyz box [box_min, box_max) have been changed with set_block.
+        Only the positions around the box are re-evaluated, the node ids are kept.
+        """
+        if self._waypoints is None:
+            return
+        # a connection depends on the voxels in its bounding box
+        #   and on those one below and one above
+        edge_min = (box_min[0], box_min[1], box_min[2] - 1)
+        edge_max = (box_max[0] - 1, box_max[1] - 1, box_max[2])
+        positions, edges = self.waypoint_arrays(
+            (box_min[0] - 1, box_min[1] - 1, 0), (box_max[0] + 1, box_max[1] + 1, 0)
+        )
+        self._waypoints.update_edges(positions, edges, edge_min, edge_max)
+
     def create_waypoints_old(self, steps=1):
         from ..ai import WayPoints
         wp = WayPoints()
         z = 1
         for y in range(0, self.num_y, steps):
             for x in range(0, self.num_x, steps):
-                if self.block(x, y, z).space_type == 0:
+                if not self.is_occupied(x, y, z):
                     doit = True
                     for x1 in range(x, x + steps + 1):
-                        if self.block(x1, y, z).space_type != 0:
+                        if self.is_occupied(x1, y, z):
                             doit = False
                             break
                     if doit:
@@ -320,7 +707,7 @@ class WorldChunk:
 
                     doit = True
                     for y1 in range(y, y+steps+1):
-                        if self.block(x, y1, z).space_type != 0:
+                        if self.is_occupied(x, y1, z):
                             doit = False
                             break
                     if doit:
@@ -329,9 +716,9 @@ class WorldChunk:
                     if steps > 0:
                         doit = True
                         for i in range(steps+1):
-                            if self.block(x+i, y+i, z).space_type != 0 or \
-                                    (self.block(x+i+1, y+i, z).space_type != 0 and
-                                     self.block(x+i, y+i+1, z).space_type != 0):
+                            if self.is_occupied(x+i, y+i, z) or \
+                                    (self.is_occupied(x+i+1, y+i, z) and
+                                     self.is_occupied(x+i, y+i+1, z)):
                                 doit = False
                                 break
                         if doit:
@@ -339,9 +726,9 @@ class WorldChunk:
 
                         doit = True
                         for i in range(steps+1):
-                            if self.block(x+i, y-i, z).space_type != 0 or \
-                                    (self.block(x+i+1, y-i, z).space_type != 0 and
-                                     self.block(x+i, y-i-1, z).space_type != 0):
+                            if self.is_occupied(x+i, y-i, z) or \
+                                    (self.is_occupied(x+i+1, y-i, z) and
+                                     self.is_occupied(x+i, y-i-1, z)):
                                 doit = False
                                 break
                         if doit:
@@ -350,7 +737,99 @@ class WorldChunk:
         print("waypoints", wp.num_nodes, wp.num_edges)
         return wp
 
-    def create_waypoints(self):
+    def create_waypoints(self, min_component_size=2):
+        """
+        Returns the WayPoints of all walkable positions.
+
+        A position is walkable when it's free and the voxel below is occupied.
+        Edges follow the same rules as create_waypoints_floodfill but are computed
+        for all positions at once. Instead of flood-filling from one start position,
+        all connected components with at least `min_component_size` nodes are kept.
+        """
+        from ..ai import WayPoints
+        nodes, edges = self.connected_waypoints(*self.waypoint_arrays(), min_component_size)
+        return WayPoints.from_arrays({"positions": nodes, "edges": edges})
+
+    @staticmethod
+    def connected_waypoints(nodes: np.ndarray, edges: np.ndarray, min_component_size: int):
+        """
+        Returns the nodes and edges of waypoint_arrays without the connected
+        components of less than `min_component_size` nodes, with the edges re-indexed
+        """
+        if not len(nodes):
+            return nodes, edges
+        graph = scipy.sparse.coo_matrix(
+            (np.ones(len(edges), dtype="int8"), (edges[:, 0], edges[:, 1])),
+            shape=(len(nodes), len(nodes)),
+        )
+        num_labels, labels = scipy.sparse.csgraph.connected_components(graph, directed=False)
+        keep = (np.bincount(labels, minlength=num_labels) >= min_component_size)[labels]
+        new_index = np.cumsum(keep) - 1
+        return nodes[keep], new_index[edges[keep[edges[:, 0]]]]
+
+    def waypoint_arrays(self, box_min=None, box_max=None):
+        """
+        Returns the [node, xyz] positions of all walkable voxels and the [edge, 2] node indices
+        of the walkable connections, each connection only once.
+
+        If the xyz box [box_min, box_max) is given, only the positions in its x and y range
+        are evaluated, for all z. The box may reach one voxel into the border,
+        which holds the voxels of the neighbours in a ChunkManager.
+        """
+        b = self.BORDER
+        x0, y0, x1, y1 = 0, 0, self.num_x, self.num_y
+        if box_min is not None and box_max is not None:
+            x0, y0 = max(-1, box_min[0]), max(-1, box_min[1])
+            x1, y1 = max(x0, min(x1 + 1, box_max[0])), max(y0, min(y1 + 1, box_max[1]))
+        nz, ny, nx = self.num_z + 1, y1 - y0, x1 - x0
+        occupied = self.occupancy(padded=True)
+
+        def _occ(dz, dy=0, dx=0):
+            """occupancy at offset for all node positions from z = 0 to num_z"""
+            return occupied[b+dz:b+dz+nz, b+y0+dy:b+y0+dy+ny, b+x0+dx:b+x0+dx+nx]
+
+        walkable = ~_occ(0) & _occ(-1)
+        index = np.full(walkable.shape, -1, dtype="int64")
+        index[walkable] = np.arange(np.count_nonzero(walkable))
+
+        edges = []
+
+        def _add(mask, dz, dy, dx):
+            # only the targets inside the chunk or box
+            mask = mask.copy()
+            if dy:
+                mask[:, slice(None, 1) if dy < 0 else slice(-1, None)] = False
+            if dx:
+                mask[:, :, slice(None, 1) if dx < 0 else slice(-1, None)] = False
+            z, y, x = np.nonzero(mask)
+            edges.append(np.stack([index[z, y, x], index[z + dz, y + dy, x + dx]], axis=-1))
+
+        for dy, dx in ((0, -1), (0, 1), (-1, 0), (1, 0)):
+            free = walkable & ~_occ(1, dy, dx)
+            up = _occ(0, dy, dx)
+            _add(free & up, 1, dy, dx)
+            free &= ~up
+            same = _occ(-1, dy, dx)
+            _add(free & same, 0, dy, dx)
+            _add(free & ~same & _occ(-2, dy, dx), -1, dy, dx)
+
+        for dy, dx in ((-1, -1), (-1, 1), (1, 1), (1, -1)):
+            free = walkable.copy()
+            for dz in (0, 1):
+                free &= ~(_occ(dz, dy, dx) | _occ(dz, 0, dx) | _occ(dz, dy, 0))
+            same = _occ(-1, dy, dx)
+            _add(free & same, 0, dy, dx)
+            _add(free & ~same & _occ(-2, dy, dx), -1, dy, dx)
+
+        edges = np.sort(np.concatenate(edges).reshape(-1, 2), axis=-1)
+        num = max(1, int(index.max(initial=-1)) + 1)
+        edges = np.unique(edges[:, 0] * num + edges[:, 1])
+        edges = np.stack([edges // num, edges % num], axis=-1)
+
+        z, y, x = np.nonzero(walkable)
+        return np.stack([x + x0, y + y0, z], axis=-1), edges
+
+    def create_waypoints_floodfill(self):
         """floodfill"""
         from ..ai import WayPoints
         wp = WayPoints()
@@ -358,6 +837,8 @@ class WorldChunk:
         x, y, z = 2, 2, self.num_z+1
         while not self.is_wall(x, y, z-1, self.TOP):
             z -= 1
+            if z < 1:
+                return wp
 
         visited = set()
         visit = {(x, y, z)}
@@ -1,7 +1,7 @@
 import glm
 
-from lib.ai import *
 from .WorldChunk import WorldChunk
+from .ChunkManager import ChunkManager
 from .Tileset import Tileset
 from .WorldProjection import WorldProjection
 from .render.ChunkRenderer import ChunkRenderer
@@ -9,30 +9,76 @@ from lib.opengl.RenderSettings import RenderSettings
 
 
 class WorldEngine:
+    """
+    The world chunk, its agents and the rendering of both.
 
-    def __init__(self):
+    With `headless` only the simulation is created, no projection,
+    render settings, tileset image or agent renderers, so `update` runs
+    without an OpenGL context and `render` is not available.
+
+    With a `chunk_size`, the level is streamed by a ChunkManager around the player
+    and the agents walk on its stitched waypoints. Rendering the chunks of a
+    ChunkManager is not supported yet, so it requires `headless`.
+    """
+
+    def __init__(
+            self,
+            headless=False,
+            level_filename="./assets/tiled/level03.json",
+            cache=True,
+            chunk_size=None,
+            load_radius=1,
+    ):
+        """
+        :param cache: ChunkCache of the level, see `WorldChunk.from_tiled`
+        :param chunk_size: (x, y, z) size of the chunks of a ChunkManager, None loads the level as one chunk
+        :param load_radius: number of chunks around the player's chunk that the ChunkManager keeps loaded
+        """
+        if chunk_size is not None and not headless:
+            raise ValueError("WorldEngine(chunk_size=%s) requires headless=True" % (chunk_size, ))
+        # lib.ai imports lib.world
+        from lib.ai import Agents
+
+        self.headless = headless
         self.edit_mode = False
         self.click_voxel = (30,10,10)
         self.debug_view = 0
 
         self.renderer = None
-        self.projection = WorldProjection(480, 320, projection=WorldProjection.P_ISOMETRIC)
-        self.render_settings = RenderSettings(480, 320, projection=self.projection)
+        self.projection = None
+        self.render_settings = None
+        if not self.headless:
+            self.projection = WorldProjection(480, 320, projection=WorldProjection.P_ISOMETRIC)
+            self.render_settings = RenderSettings(480, 320, projection=self.projection)
 
         # chunk
-        self.tileset = Tileset.from_image(16, 16, "./assets/tileset02.png")
-        self.chunk = WorldChunk(self.tileset)
-
-        if 0:
-            #self.chunk.from_heightmap(gen_heightmap())
-            self.chunk.from_heightmap(HEIGHTMAP, do_flip_y=True)
+        if self.headless:
+            self.tileset = Tileset(16, 16)
+        else:
+            self.tileset = Tileset.from_image(16, 16, "./assets/tileset02.png")
+        player_position = glm.vec3(14, 14, 10) + .5
+        self.chunk_manager = None
+        if chunk_size is not None:
+            self.chunk_manager = ChunkManager(
+                self.tileset, ChunkManager.tiled_source(level_filename),
+                chunk_size=chunk_size, load_radius=load_radius, build=False,
+            )
+            self.chunk_manager.update(player_position.xy)
+            # provides the voxel queries and waypoints of a chunk
+            self.chunk = self.chunk_manager
         else:
-            self.chunk.from_tiled("./assets/tiled/level03.json")
+            self.chunk = WorldChunk(self.tileset)
+
+            if 0:
+                #self.chunk.from_heightmap(gen_heightmap())
+                self.chunk.from_heightmap(HEIGHTMAP, do_flip_y=True)
+            else:
+                self.chunk.from_tiled(level_filename, cache=cache)
 
         # player
-        self.agents = Agents(self.chunk)
+        self.agents = Agents(self.chunk, headless=self.headless)
         self.agents.create_agent("player", "./assets/pokeson.png")
-        self.agents["player"].set_position(glm.vec3(14, 14, 10) + .5)
+        self.agents["player"].set_position(player_position)
 
         # other guy
         follow = "player"
@@ -44,12 +90,18 @@ class WorldEngine:
             follow = name
 
     def update(self, dt):
+        if self.chunk_manager is not None:
+            self.chunk_manager.update(self.agents["player"].sposition.xy)
         self.agents.update(dt)
 
+        if self.headless:
+            return
         self.projection.user_transformation = glm.translate(glm.mat4(1), -self.agents["player"].sposition)
         self.projection.update(dt)
 
     def render(self, time):
+        if self.headless:
+            raise RuntimeError("WorldEngine(headless=True) can not render")
         self.render_settings.time = time
 
         if self.renderer is None:
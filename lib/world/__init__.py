@@ -1,3 +1,5 @@
+from .ChunkCache import ChunkCache
+from .ChunkManager import ChunkManager
 from .TiledImport import TiledImport
 from .Tileset import Tileset
 from .VoxelDistanceField import VoxelDistanceField
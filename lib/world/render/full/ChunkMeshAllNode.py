@@ -17,6 +17,7 @@ class ChunkMeshAllNode(RenderNode):
         self.chunk_tex = None
         self.vdf_tex = None
         self.vdf_scale = 1
+        self.greedy_mesh = False
 
     def has_depth_output(self):
         return True
@@ -35,7 +36,7 @@ class ChunkMeshAllNode(RenderNode):
         # level mesh
         mesh_name = "mesh-%s-drawable" % self.chunk.id
         print("creating mesh")
-        self.mesh = self.chunk.create_mesh()
+        self.mesh = self.chunk.create_mesh(greedy=self.greedy_mesh)
         print("done..")
         if OpenGlAssets.has(mesh_name):
             self.mesh_drawable = OpenGlAssets.get(mesh_name)
@@ -12,12 +12,14 @@ in vec3 a_normal;
 in vec4 a_color;
 in vec2 a_texcoord;
 in vec3 a_ambient;
+in vec4 a_tile;
 
 out vec4 v_pos;
 out vec3 v_normal;
 out vec4 v_color;
 out vec2 v_texcoord;
 out vec3 v_ambient;
+out vec4 v_tile;
 out mat3 v_normal_space;
 
 /** Returns the matrix to multiply the light-direction normal */
@@ -38,6 +40,7 @@ void main()
     v_color = a_color;
     v_texcoord = a_texcoord;
     v_ambient = a_ambient;
+    v_tile = a_tile;
     v_normal_space = calc_light_matrix(mat4(1));
     gl_Position = u_projection * a_position;
 }
@@ -45,7 +48,8 @@ void main()
 """
 
 frag_src = DEFAULT_SHADER_VERSION + """
-#line 49
+#include <chunk-tile.glsl>
+#line 53
 uniform sampler2D u_tex1;
 uniform sampler3D u_chunk_tex;
 uniform sampler3D u_vdf_tex;
@@ -63,6 +67,7 @@ in vec4 v_pos;
 in vec3 v_normal;
 in vec2 v_texcoord;
 in vec3 v_ambient;
+in vec4 v_tile;
 in mat3 v_normal_space;
 
 out vec4 fragColor;
@@ -206,12 +211,13 @@ vec3 environment_color(in vec3 dir) {
 }
 
 void main() {
-    vec4 tex = texture2D(u_tex1, v_texcoord);
+    vec2 texcoord = chunk_tile_texcoord(v_texcoord, v_tile);
+    vec4 tex = texture2D(u_tex1, texcoord);
         
     vec3 col = vec3(0);
     
     vec3 normal = vec3(0, 0, 1);        
-    vec2 v_normcoord = v_texcoord + vec2(.5, 0.);
+    vec2 v_normcoord = texcoord + vec2(.5, 0.);
     vec4 normal_texel = texture2D(u_tex1, v_normcoord);
     normal = normalize(mix(normal, normal_texel.xyz, normal_texel.w));
     normal = v_normal_space * normal;
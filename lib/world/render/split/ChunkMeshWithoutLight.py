@@ -12,12 +12,14 @@ in vec3 a_normal;
 in vec4 a_color;
 in vec2 a_texcoord;
 in vec3 a_ambient;
+in vec4 a_tile;
 
 out vec4 v_pos;
 out vec3 v_normal;
 out vec4 v_color;
 out vec2 v_texcoord;
 out vec3 v_ambient;
+out vec4 v_tile;
 
 void main()
 {
@@ -26,13 +28,15 @@ void main()
     v_color = a_color;
     v_texcoord = a_texcoord;
     v_ambient = a_ambient;
+    v_tile = a_tile;
     gl_Position = u_projection * a_position;
 }
 
 """
 
 frag_src = DEFAULT_SHADER_VERSION + """
-#line 35
+#include <chunk-tile.glsl>
+#line 39
 uniform sampler2D u_tex1;
 uniform sampler3D u_vdf_tex;
 
@@ -45,6 +49,7 @@ in vec4 v_pos;
 in vec3 v_normal;
 in vec2 v_texcoord;
 in vec3 v_ambient;
+in vec4 v_tile;
 
 out vec4 fragColor;
 
@@ -56,7 +61,8 @@ float distance_at(in vec3 pos) {
 }
 
 void main() {
-    vec4 tex = texture2D(u_tex1, v_texcoord);
+    vec2 texcoord = chunk_tile_texcoord(v_texcoord, v_tile);
+    vec4 tex = texture2D(u_tex1, texcoord);
     
     // ambient occlusion    
     vec3 col = tex.xyz * pow(distance_at(v_pos.xyz), .5);
@@ -0,0 +1,142 @@
+import argparse
+import random
+import sys
+import time
+
+import pyglet
+
+# no hidden OpenGL window, the simulation runs on machines without display or GPU
+pyglet.options["shadow_window"] = False
+
+import glm
+import numpy as np
+import scipy.sparse.csgraph
+
+from lib.world import WorldEngine
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Step the headless world simulation and report its speed"
+    )
+    parser.add_argument(
+        "--ticks", type=int, default=600,
+        help="Number of updates to run",
+    )
+    parser.add_argument(
+        "--dt", type=float, default=1. / 60.,
+        help="Simulated seconds per update",
+    )
+    parser.add_argument(
+        "--agents", type=int, default=100,
+        help="Number of additional agents that walk to random goals",
+    )
+    parser.add_argument(
+        "--level", type=str, default="./assets/tiled/level03.json",
+        help="Tiled level file",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=23,
+        help="Seed of the random goals",
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=None,
+        help="Stream the level in chunks of this width and height around the player",
+    )
+    return parser.parse_args()
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process or None if unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return max_rss / 1024. / (1024. if sys.platform == "darwin" else 1.)
+
+
+def reachable_nodes(waypoints, node=None) -> np.ndarray:
+    """The waypoint ids of the connected component of `node`, default the largest"""
+    graph = waypoints.csr()
+    matrix = scipy.sparse.csr_matrix(
+        (graph.costs, graph.indices, graph.indptr), shape=(graph.num_nodes, graph.num_nodes)
+    )
+    num, labels = scipy.sparse.csgraph.connected_components(matrix, directed=False)
+    label = np.bincount(labels).argmax() if node is None else labels[node]
+    return np.flatnonzero(labels == label)
+
+
+def run_simulation(
+        num_ticks=600, dt=1. / 60., num_agents=100, level_filename="./assets/tiled/level03.json", seed=23,
+        cache=True, chunk_size=None,
+):
+    """
+    Returns a dict with the timings and counts of the run
+
+    :param cache: ChunkCache of the level, see `WorldChunk.from_tiled`
+    :param chunk_size: (x, y, z) chunk size of the ChunkManager, None for a single chunk
+    """
+    rnd = random.Random(seed)
+
+    start_time = time.time()
+    engine = WorldEngine(headless=True, level_filename=level_filename, cache=cache, chunk_size=chunk_size)
+    waypoints = engine.chunk.waypoints
+    nodes = reachable_nodes(waypoints)
+
+    def random_pos():
+        return glm.vec3(waypoints.id_to_pos[int(nodes[rnd.randrange(len(nodes))])])
+
+    names = ["wanderer%s" % i for i in range(num_agents)]
+    for name in names:
+        engine.agents.create_agent(name)
+        engine.agents[name].set_position(random_pos() + (.5, .5, 0))
+    setup_seconds = time.time() - start_time
+
+    start_time = time.time()
+    for tick in range(num_ticks):
+        for name in names:
+            if engine.agents.is_idle(name):
+                engine.agents.set_goal(name, random_pos())
+        engine.update(dt)
+    seconds = max(time.time() - start_time, 1e-9)
+
+    return {
+        "agents": len(engine.agents),
+        "waypoints": waypoints.num_nodes,
+        "setup_seconds": setup_seconds,
+        "ticks": num_ticks,
+        "seconds": seconds,
+        "ticks_per_second": num_ticks / seconds,
+        "path_requests": engine.agents.num_path_requests,
+        "path_requests_per_second": engine.agents.num_path_requests / seconds,
+        "paths_per_second": engine.agents.num_paths / seconds,
+        "peak_memory_mb": peak_memory_mb(),
+    }
+
+
+def print_report(stats: dict):
+    print("agents:            %s" % stats["agents"])
+    print("waypoints:         %s" % stats["waypoints"])
+    print("setup:             %.2f sec" % stats["setup_seconds"])
+    print("ticks:             %s in %.2f sec" % (stats["ticks"], stats["seconds"]))
+    print("ticks/sec:         %.2f" % stats["ticks_per_second"])
+    print("path requests:     %s" % stats["path_requests"])
+    print("path requests/sec: %.2f" % stats["path_requests_per_second"])
+    print("paths found/sec:   %.2f" % stats["paths_per_second"])
+    if stats["peak_memory_mb"] is not None:
+        print("peak memory:       %.1f MB" % stats["peak_memory_mb"])
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    print_report(run_simulation(
+        num_ticks=args.ticks,
+        dt=args.dt,
+        num_agents=args.agents,
+        level_filename=args.level,
+        seed=args.seed,
+        chunk_size=None if args.chunk_size is None else (args.chunk_size, args.chunk_size, 16),
+    ))
@@ -269,7 +269,7 @@ class ChunkWindow(pyglet.window.Window):
             pos = glm.floor(ro + t * rd)
             self.hit_voxel = pos
             ihit = tuple(int(x) for x in pos)
-            self.agents.set_goal("player", ihit)
+            self.agents.set_goal("player", ihit, priority=1)
 
             if 0:  # editor
                 block = self.chunk.block(*ihit)
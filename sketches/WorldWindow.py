@@ -82,7 +82,7 @@ class WorldWindow(pyglet.window.Window):
             pos = glm.floor(ro + t * rd)
             self.world.click_voxel = pos
             ihit = tuple(int(x) for x in pos)
-            self.world.agents.set_goal("player", ihit)
+            self.world.agents.set_goal("player", ihit, priority=1)
 
     def on_key_press(self, symbol, modifiers):
         if symbol == pyglet.window.key.ESCAPE:
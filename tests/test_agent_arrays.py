@@ -0,0 +1,138 @@
+import os
+import random
+import unittest
+
+import glm
+import numpy as np
+
+from lib.ai import Agent, AgentArrays
+from lib.world import WorldChunk, Tileset
+from tests.util import Timer
+
+
+def create_chunk():
+    chunk = WorldChunk(Tileset(16, 16))
+    chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+    return chunk
+
+
+def random_positions(chunk, num, seed=23):
+    rnd = random.Random(seed)
+    positions = [chunk.waypoints.id_to_pos[rnd.randrange(chunk.waypoints.num_nodes)] for i in range(num)]
+    return [glm.vec3(p) + (.5, .5, 0) for p in positions]
+
+
+def random_directions(rnd, num):
+    return [glm.vec3(rnd.uniform(-1, 1), rnd.uniform(-1, 1), rnd.uniform(-.3, .3)) for i in range(num)]
+
+
+class _Renderer:
+    """Stand-in for AgentRenderer without textures"""
+
+    def release(self):
+        pass
+
+
+class TestAgentArrays(unittest.TestCase):
+
+    def test_add_remove(self):
+        arrays = AgentArrays(capacity=2)
+        indices = [arrays.add((i, 0, 0)) for i in range(5)]
+        self.assertEqual(len(indices), len(set(indices)))
+        self.assertEqual(5, len(arrays))
+        self.assertGreaterEqual(arrays.capacity, 5)
+        for i, index in enumerate(indices):
+            self.assertEqual([i, 0, 0], arrays.position[index].tolist())
+            self.assertEqual([i, 0, 0], arrays.sposition[index].tolist())
+
+        arrays.remove(indices[1])
+        arrays.remove(indices[1])
+        self.assertEqual(4, len(arrays))
+        self.assertNotIn(indices[1], arrays.indices().tolist())
+        self.assertEqual(indices[1], arrays.add())
+
+    def test_agent_view(self):
+        chunk = create_chunk()
+        agent = Agent(chunk, renderer=_Renderer())
+        agent.set_position((5, 6, 7))
+        self.assertEqual(glm.vec3(5, 6, 7), agent.position)
+        self.assertEqual(glm.vec3(5, 6, 7), agent.sposition)
+        agent.velocity += (0, 0, 2)
+        self.assertEqual(glm.vec3(0, 0, 2), agent.velocity)
+        agent.move(glm.vec3(-1, 0, 0))
+        self.assertEqual(AgentArrays.LEFT, agent.direction)
+
+        arrays = AgentArrays()
+        arrays.add()
+        agent.attach(arrays)
+        self.assertIs(arrays, agent.arrays)
+        self.assertEqual(2, len(arrays))
+        self.assertEqual(glm.vec3(4, 6, 7), agent.position)
+        self.assertEqual(glm.vec3(0, 0, 2), agent.velocity)
+
+    def test_update_equals_update_old(self):
+        chunk = create_chunk()
+        rnd = random.Random(42)
+        positions = random_positions(chunk, 100)
+        arrays = AgentArrays()
+        agents = [Agent(chunk, renderer=_Renderer(), arrays=arrays) for p in positions]
+        agents_old = [Agent(chunk, renderer=_Renderer()) for p in positions]
+        for agent, agent_old, pos in zip(agents, agents_old, positions):
+            agent.set_position(pos)
+            agent_old.set_position(pos)
+
+        for frame in range(100):
+            dt = rnd.uniform(1. / 120, 1. / 20)
+            if frame % 10 == 0:
+                directions = random_directions(rnd, len(agents))
+                for agent, agent_old, dir in zip(agents, agents_old, directions):
+                    agent.move(dir)
+                    agent_old.move(dir)
+                    if frame % 20 == 0:
+                        agent.jump()
+                        agent_old.jump()
+            arrays.update(dt, chunk)
+            for agent in agents_old:
+                agent.update_old(dt)
+
+            for agent, agent_old in zip(agents, agents_old):
+                for name in ("position", "sposition", "velocity"):
+                    np.testing.assert_allclose(
+                        getattr(agent_old, name), getattr(agent, name), atol=1e-5, err_msg=name,
+                    )
+                self.assertAlmostEqual(agent_old.anim_stage, agent.anim_stage, places=5)
+                self.assertEqual(agent_old.direction, agent.direction)
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestAgentArraysBenchmark(unittest.TestCase):
+    """
+    update 5000 agents
+    Agent.update_old    0.2442 sec/update
+    AgentArrays.update  0.0042 sec/update
+    """
+
+    def test_benchmark(self):
+        chunk = create_chunk()
+        rnd = random.Random(42)
+        positions = random_positions(chunk, 5000)
+        directions = random_directions(rnd, len(positions))
+        arrays = AgentArrays()
+        agents = [Agent(chunk, renderer=_Renderer(), arrays=arrays) for p in positions]
+        for agent, pos, dir in zip(agents, positions, directions):
+            agent.set_position(pos)
+            agent.move(dir)
+
+        print("\nupdate %s agents" % len(agents))
+        num = 5
+        with Timer(num) as timer:
+            for i in range(num):
+                for agent in agents:
+                    agent.update_old(1. / 60)
+        print("Agent.update_old    %.4f sec/update" % timer.spf())
+
+        num = 100
+        with Timer(num) as timer:
+            for i in range(num):
+                arrays.update(1. / 60, chunk)
+        print("AgentArrays.update  %.4f sec/update" % timer.spf())
@@ -0,0 +1,118 @@
+import os
+import random
+import unittest
+
+import numpy as np
+
+from lib.ai import AStar, WayPoints, WayPointsCSR
+from lib.world import WorldChunk, Tileset
+from tests.test_world_chunk import create_random_chunk
+from tests.util import Timer, assert_numpy_equal
+
+
+def create_waypoints(seed=23):
+    """floor with random blocks"""
+    chunk = create_random_chunk(16, 14, 4, probability=.15, seed=seed)
+    chunk.space_type[0] = 1
+    chunk.clear_cache()
+    return chunk.create_waypoints()
+
+
+def random_node_pairs(waypoints, num, seed=23):
+    rnd = random.Random(seed)
+    return [
+        (rnd.randrange(waypoints.num_nodes), rnd.randrange(waypoints.num_nodes))
+        for i in range(num)
+    ]
+
+
+class TestWayPointsCSR(unittest.TestCase):
+
+    def test_adjacency(self):
+        waypoints = create_waypoints()
+        csr = waypoints.csr()
+        self.assertEqual(waypoints.num_nodes, csr.num_nodes)
+        astar = AStar(waypoints)
+        for node in range(waypoints.num_nodes):
+            self.assertEqual(waypoints.adjacent_nodes(node), set(csr.adjacent_nodes(node).tolist()))
+            for neighbor, cost in zip(csr.adjacent_nodes(node), csr.adjacent_costs(node)):
+                self.assertAlmostEqual(astar.heuristic_step_cost(node, int(neighbor), None), cost)
+
+    def test_from_arrays(self):
+        csr = WayPointsCSR.from_arrays(
+            [[0, 0, 0], [1, 0, 0], [1, 1, 1], [5, 5, 5]],
+            [[0, 1], [1, 0], [2, 1], [1, 2], [3, 3]],
+            z_penalty=2,
+        )
+        self.assertEqual(2, csr.num_edges)
+        assert_numpy_equal(np.array([0, 1, 3, 4, 4]), csr.indptr)
+        assert_numpy_equal(np.array([1, 0, 2, 1]), csr.indices)
+        self.assertAlmostEqual(np.sqrt(2) + 2, csr.path_cost([0, 1, 2]) - 1)
+
+    def test_invalidate(self):
+        waypoints = WayPoints()
+        waypoints.add_edge_pos((0, 0, 0), (1, 0, 0))
+        self.assertIs(waypoints.csr(), waypoints.csr())
+        self.assertEqual(1, waypoints.csr().num_edges)
+        waypoints.add_edge_pos((1, 0, 0), (2, 0, 0))
+        self.assertEqual(3, waypoints.csr().num_nodes)
+        self.assertEqual(2, waypoints.csr().num_edges)
+
+
+class TestAStar(unittest.TestCase):
+
+    def test_compare_old(self):
+        for seed in range(3):
+            waypoints = create_waypoints(seed)
+            astar = AStar(waypoints)
+            csr = waypoints.csr()
+            for start, end in random_node_pairs(waypoints, 30, seed):
+                expected = astar.search_old(start, end)
+                path = astar.search(start, end)
+                if expected is None:
+                    self.assertIsNone(path)
+                    continue
+                self.assertEqual(start, path[0])
+                self.assertEqual(end, path[-1])
+                self.assertAlmostEqual(csr.path_cost(expected), csr.path_cost(path))
+
+    def test_unreachable(self):
+        waypoints = WayPoints()
+        waypoints.add_edge_pos((0, 0, 0), (1, 0, 0))
+        waypoints.add_edge_pos((5, 0, 0), (6, 0, 0))
+        astar = AStar(waypoints)
+        self.assertIsNone(astar.search(0, 2))
+        self.assertEqual([0, 1], astar.search(0, 1))
+        self.assertEqual([3], astar.search(3, 3))
+        # growing graph after a search
+        waypoints.add_edge_pos((1, 0, 0), (5, 0, 0))
+        self.assertEqual([0, 1, 2, 3], astar.search(0, 3))
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestAStarBenchmark(unittest.TestCase):
+    """
+    level03 5027 nodes
+    csr                               0.034 sec
+       10 agents  search_old     0.1973 sec      50.69 paths/sec
+       10 agents  search         0.0364 sec     275.02 paths/sec
+      100 agents  search_old     1.9967 sec      50.08 paths/sec
+      100 agents  search         0.3685 sec     271.36 paths/sec
+    """
+
+    def test_benchmark(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+        waypoints = chunk.waypoints
+        print(f"\nlevel03 {waypoints.num_nodes} nodes")
+        with Timer() as timer:
+            waypoints.csr().to_lists()
+        print(f"csr {timer.seconds():35} sec")
+        for num_agents in (10, 100):
+            pairs = random_node_pairs(waypoints, num_agents)
+            for name in ("search_old", "search"):
+                astar = AStar(waypoints)
+                with Timer(num_agents) as timer:
+                    for start, end in pairs:
+                        getattr(astar, name)(start, end)
+                print(f"{num_agents:5} agents  {name:12} {timer.seconds():8} sec {timer.fps():10} paths/sec")
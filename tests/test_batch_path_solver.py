@@ -0,0 +1,75 @@
+import os
+import unittest
+
+from lib.ai import AStar, BatchPathSolver
+from lib.world import WorldChunk, Tileset
+from tests.test_astar import create_waypoints, random_node_pairs
+from tests.util import Timer
+
+
+class TestBatchPathSolver(unittest.TestCase):
+
+    def test_solve(self):
+        waypoints = create_waypoints()
+        astar = AStar(waypoints)
+        pairs = random_node_pairs(waypoints, 50)
+        with BatchPathSolver(waypoints, num_processes=2, min_batch_size=10) as solver:
+            self.assertEqual([astar.search(*p) for p in pairs], solver.solve(pairs))
+            self.assertTrue(solver.is_running)
+            names = [shm.name for shm in solver._blocks]
+        self.assertFalse(solver.is_running)
+        for name in names:
+            self.assertFalse(os.path.exists("/dev/shm/%s" % name.lstrip("/")))
+
+    def test_small_batch(self):
+        waypoints = create_waypoints()
+        astar = AStar(waypoints)
+        pairs = random_node_pairs(waypoints, 5)
+        with BatchPathSolver(waypoints, num_processes=2, min_batch_size=10) as solver:
+            self.assertEqual([astar.search(*p) for p in pairs], solver.solve(pairs))
+            self.assertFalse(solver.is_running)
+
+    def test_version(self):
+        waypoints = create_waypoints()
+        astar = AStar(waypoints)
+        pairs = [(0, waypoints.num_nodes - 1)] * 4
+        with BatchPathSolver(waypoints, num_processes=2, min_batch_size=2) as solver:
+            self.assertGreater(len(solver.solve(pairs)[0]), 2)
+            waypoints.add_edge(0, waypoints.num_nodes - 1)
+            self.assertEqual([[0, waypoints.num_nodes - 1]] * 4, solver.solve(pairs))
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestBatchPathSolverBenchmark(unittest.TestCase):
+    """
+    measured on a single cpu, so this only shows the overhead of the processes
+
+    level03 400 paths, 1 cpus
+    AStar                 1.323 sec     302.35 paths/sec
+    2 processes          1.2477 sec     320.59 paths/sec  (start 0.3486 sec)
+    4 processes          1.7139 sec     233.39 paths/sec  (start 0.603 sec)
+    8 processes           1.628 sec      245.7 paths/sec  (start 1.332 sec)
+    """
+
+    def test_benchmark(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+        waypoints = chunk.waypoints
+        pairs = random_node_pairs(waypoints, 400)
+        print(f"\nlevel03 {len(pairs)} paths, {os.cpu_count()} cpus")
+        astar = AStar(waypoints)
+        with Timer(len(pairs)) as timer:
+            for start, end in pairs:
+                astar.search(start, end)
+        print(f"AStar              {timer.seconds():8} sec {timer.fps():10} paths/sec")
+        for num_processes in (2, 4, 8):
+            with BatchPathSolver(waypoints, num_processes=num_processes) as solver:
+                with Timer() as timer:
+                    solver.solve(pairs[:num_processes * 32])
+                start_time = timer.seconds()
+                with Timer(len(pairs)) as timer:
+                    solver.solve(pairs)
+            print(
+                f"{num_processes} processes        {timer.seconds():8} sec {timer.fps():10} paths/sec"
+                f"  (start {start_time} sec)"
+            )
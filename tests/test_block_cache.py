@@ -0,0 +1,197 @@
+import gc
+import os
+import pickle
+import threading
+import unittest
+
+import numpy as np
+
+from lib.gen import *
+from tests.util import Timer, assert_numpy_equal
+
+
+class TestBlockCache(unittest.TestCase):
+
+    def test_lru_bytes(self):
+        cache = BlockCache(max_bytes=3 * 800)
+        owner = cache.new_owner()
+        for i in range(3):
+            cache.put(owner, i, np.zeros(100))
+        self.assertEqual(3 * 800, cache.bytes)
+        # touch 0, so 1 is the least recently used
+        self.assertIsNotNone(cache.get(owner, 0))
+        cache.put(owner, 3, np.zeros(100))
+        self.assertIsNone(cache.get(owner, 1))
+        for i in (0, 2, 3):
+            self.assertIsNotNone(cache.get(owner, i))
+        self.assertEqual(BlockCacheInfo(4, 1, 1, 3, 3 * 800, 3 * 800), cache.cache_info(owner))
+
+        # a large block evicts several small ones
+        cache.put(owner, 4, np.zeros(200))
+        self.assertEqual(2, len(cache))
+        self.assertEqual(3, cache.cache_info().evictions)
+        # and a block larger than the budget is kept alone
+        cache.put(owner, 5, np.zeros(1000))
+        self.assertEqual(1, len(cache))
+        self.assertEqual(8000, cache.bytes)
+
+    def test_owners(self):
+        cache = BlockCache(max_bytes=4 * 800)
+        owner1, owner2 = cache.new_owner(), cache.new_owner()
+        cache.put(owner1, (0, 0), np.zeros(100))
+        cache.put(owner2, (0, 0), np.ones(100))
+        self.assertEqual(0., cache.get(owner1, (0, 0))[0])
+        self.assertEqual(1., cache.get(owner2, (0, 0))[0])
+
+        # the budget is shared
+        cache.put(owner2, (1, 0), np.ones(100))
+        cache.put(owner2, (2, 0), np.ones(100))
+        cache.put(owner2, (3, 0), np.ones(100))
+        self.assertIsNone(cache.get(owner1, (0, 0)))
+        self.assertEqual(1, cache.cache_info(owner1).evictions)
+        self.assertEqual(0, cache.cache_info(owner2).evictions)
+
+        cache.clear(owner2)
+        self.assertEqual(0, len(cache))
+        self.assertEqual((0, 0), cache.cache_info(owner2)[3:5])
+
+    def test_sampler(self):
+        cache = BlockCache(max_bytes=10 * 16 * 16 * 8)
+        sampler = RandomSampler2D(block_size=16, cache=cache)
+        uncached = RandomSampler2D(block_size=16, cache=BlockCache(max_bytes=0))
+        for i in range(3):
+            for x in range(-4, 4):
+                assert_numpy_equal(sampler.get_block(x, 0), sampler.get_block_cached(x, 0))
+        info = sampler.cache_info()
+        self.assertEqual(8, info.misses)
+        self.assertEqual(16, info.hits)
+        self.assertEqual(8, info.blocks)
+        self.assertEqual(8 * 16 * 16 * 8, info.bytes)
+
+        assert_numpy_equal(uncached(-20, -20, 60, 50), sampler(-20, -20, 60, 50))
+        self.assertLessEqual(sampler.cache_info().bytes, cache.max_bytes)
+        self.assertGreater(sampler.cache_info().evictions, 0)
+
+        sampler.clear_cache()
+        self.assertEqual(0, len(cache))
+
+    def test_nested_samplers(self):
+        cache = BlockCache()
+        sampler = NoiseSampler2D(resolution=4, block_size=32, cache=cache)
+        sampler(0, 0, 64, 64)
+        self.assertEqual(4, sampler.cache_info().blocks)
+        self.assertEqual(9, sampler.random_sampler.cache_info().blocks)
+        self.assertEqual(13, cache.cache_info().blocks)
+
+    def test_release_on_delete(self):
+        cache = BlockCache()
+        sampler = RandomSampler2D(block_size=16, cache=cache)
+        sampler(0, 0, 32, 32)
+        self.assertEqual(4, len(cache))
+        del sampler
+        gc.collect()
+        cache.put(cache.new_owner(), 0, np.zeros(1))
+        self.assertEqual(1, len(cache))
+        self.assertEqual(8, cache.bytes)
+
+    def test_unpickle_after_clear(self):
+        sampler = NoiseSampler2D(resolution=4, block_size=16, cache=BlockCache())
+        cache = BlockCache.default()
+        num_owners = len(cache._stats)
+        unpickled = pickle.loads(pickle.dumps(sampler))
+        unpickled(0, 0, 16, 16)
+        self.assertEqual(num_owners + 2, len(cache._stats))
+        # the same sampler reuses the blocks
+        self.assertIs(unpickled._cache_owner, pickle.loads(pickle.dumps(sampler))._cache_owner)
+
+        for i in range(3):
+            sampler.clear_cache()
+            unpickled = pickle.loads(pickle.dumps(sampler))
+            unpickled(0, 0, 16, 16)
+            self.assertEqual(1, unpickled.cache_info().misses)
+        # the owners of the cleared generations are released
+        self.assertEqual(num_owners + 2, len(cache._stats))
+
+    def test_unpickled_owners_bounded(self):
+        cache = BlockCache.default()
+        samplers = [RandomSampler2D(seed=i, block_size=8, cache=BlockCache()) for i in range(5)]
+        max_owners = BlockSampler2DBase.MAX_UNPICKLED_OWNERS
+        BlockSampler2DBase.MAX_UNPICKLED_OWNERS = 2
+        try:
+            kept = pickle.loads(pickle.dumps(samplers[0]))
+            kept(0, 0, 8, 8)
+            owners = []
+            for sampler in samplers[1:]:
+                unpickled = pickle.loads(pickle.dumps(sampler))
+                unpickled(0, 0, 8, 8)
+                owners.append(unpickled._cache_owner)
+            del unpickled
+            # the owners of the least recently unpickled samplers are released
+            self.assertEqual([False, False, True, True], [o in cache._stats for o in owners])
+            # except while still used
+            self.assertEqual((0, 1), kept.cache_info()[:2])
+            self.assertIsNotNone(cache.get(kept._cache_owner, (0, 0)))
+
+            owner = kept._cache_owner
+            del kept
+            gc.collect()
+            pickle.loads(pickle.dumps(samplers[1]))(0, 0, 8, 8)
+            self.assertNotIn(owner, cache._stats)
+        finally:
+            BlockSampler2DBase.MAX_UNPICKLED_OWNERS = max_owners
+
+    def test_threads(self):
+        cache = BlockCache(max_bytes=20 * 8 * 8 * 8)
+        samplers = [RandomSampler2D(seed=i, block_size=8, cache=cache) for i in range(4)]
+
+        def _run(sampler):
+            for i in range(50):
+                sampler(i * 3, -i * 2, 20, 20)
+
+        threads = [threading.Thread(target=_run, args=(s, )) for s in samplers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        info = cache.cache_info()
+        self.assertLessEqual(info.bytes, info.max_bytes)
+        self.assertEqual(info.bytes, sum(s.cache_info().bytes for s in samplers))
+        self.assertEqual(info.blocks, len(cache))
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestBlockCacheBenchmark(unittest.TestCase):
+    """
+    budget 1 MB, 29.9 ms per frame
+      biosphere_noise  hits   126 misses    90 evictions    89    1 blocks      128 KB
+      noise            hits   127 misses    89 evictions    85    4 blocks      512 KB
+      ca_sampler       hits   546 misses   280 evictions   268   12 blocks       96 KB
+
+    budget 4 MB, 7.4 ms per frame
+      biosphere_noise  hits   201 misses    15 evictions     3   12 blocks     1536 KB
+      noise            hits   201 misses    15 evictions     3   12 blocks     1536 KB
+      ca_sampler       hits   752 misses    74 evictions     6   68 blocks      544 KB
+
+    budget 16 MB, 6.6 ms per frame
+      biosphere_noise  hits   204 misses    12 evictions     0   12 blocks     1536 KB
+      noise            hits   204 misses    12 evictions     0   12 blocks     1536 KB
+      ca_sampler       hits   758 misses    68 evictions     0   68 blocks      544 KB
+    """
+
+    def test_tilemap_budgets(self):
+        from tilegame.map import TilemapSampler
+
+        for max_mb in (1, 4, 16, 64):
+            cache = BlockCache(max_bytes=max_mb * 1024 * 1024)
+            sampler = TilemapSampler(cache=cache)
+            # scroll over the map and back
+            with Timer(100) as timer:
+                for i in list(range(50)) + list(reversed(range(50))):
+                    sampler(i * 8, i * 5, 64, 48)
+            print(f"\nbudget {max_mb} MB, {timer.spf()*1000.:.1f} ms per frame")
+            for name in ("biosphere_noise", "noise", "ca_sampler"):
+                info = getattr(sampler, name).cache_info()
+                print(
+                    f"  {name:16} hits {info.hits:5} misses {info.misses:5} evictions {info.evictions:5}"
+                    f" {info.blocks:4} blocks {info.bytes / 1024:8.0f} KB"
+                )
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from lib.world import ChunkCache, WorldChunk, Tileset
+from tests.test_world_chunk import create_chunk, create_random_chunk
+from tests.util import assert_numpy_equal
+
+
+class TestChunkCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = ChunkCache(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def num_entries(self):
+        return len([f for f in os.listdir(self.temp_dir.name) if not f.startswith(".")])
+
+    def test_content_hash(self):
+        chunk1 = create_random_chunk(5, 6, 4)
+        chunk2 = create_random_chunk(5, 6, 4)
+        self.assertEqual(chunk1.content_hash(), chunk2.content_hash())
+        chunk2.set_block(1, 1, 1, 1 - chunk2.space_type[1, 1, 1])
+        self.assertNotEqual(chunk1.content_hash(), chunk2.content_hash())
+        self.assertNotEqual(chunk1.content_hash(), create_random_chunk(6, 5, 4).content_hash())
+
+    def test_save_load(self):
+        chunk = create_random_chunk(5, 6, 4)
+        self.assertIsNone(self.cache.load(chunk, "data", a=1))
+        self.cache.save(chunk, "data", {"x": np.arange(10)}, a=1)
+        assert_numpy_equal(np.arange(10), self.cache.load(chunk, "data", a=1)["x"])
+        self.assertIsNone(self.cache.load(chunk, "data", a=2))
+        self.assertIsNone(self.cache.load(chunk, "other", a=1))
+
+        chunk.set_block(0, 0, 0, 1 - chunk.space_type[0, 0, 0])
+        self.assertIsNone(self.cache.load(chunk, "data", a=1))
+
+        self.cache.clear()
+        self.assertFalse(os.path.exists(self.temp_dir.name))
+
+    def test_mesh(self):
+        chunk = create_random_chunk(7, 8, 5)
+        chunk.cache = self.cache
+        for greedy in (False, True):
+            mesh1 = chunk.create_mesh(greedy=greedy)
+            mesh2 = chunk.create_mesh(greedy=greedy)
+            for name, values in mesh1.to_arrays().items():
+                assert_numpy_equal(values, mesh2.to_arrays()[name])
+            self.assertEqual(sorted(mesh1.attribute_names()), sorted(mesh2.attribute_names()))
+        self.assertEqual(2, self.num_entries())
+
+    def test_voxel_distance_field(self):
+        chunk = create_random_chunk(7, 8, 5)
+        chunk.cache = self.cache
+        vdf1 = chunk.create_voxel_distance_field(2)
+        vdf2 = chunk.create_voxel_distance_field(2)
+        self.assertEqual(
+            (vdf1.width, vdf1.height, vdf1.depth),
+            (vdf2.width, vdf2.height, vdf2.depth),
+        )
+        assert_numpy_equal(vdf1.distance_array(), vdf2.distance_array())
+        assert_numpy_equal(vdf1.occupancy(), vdf2.occupancy())
+        self.assertIs(chunk, vdf2.chunk)
+
+    def test_waypoints(self):
+        chunk = create_chunk([[1] * 36, [0] * 36], 6, 6)
+        chunk.cache = self.cache
+        wp1 = chunk.waypoints
+        chunk._waypoints = None
+        wp2 = chunk.waypoints
+        self.assertEqual(1, self.num_entries())
+        self.assertGreater(wp1.num_nodes, 0)
+        self.assertEqual(wp1.id_to_pos, wp2.id_to_pos)
+        self.assertEqual(wp1.pos_to_id, wp2.pos_to_id)
+        self.assertEqual(wp1._edge_fwd, wp2._edge_fwd)
+        self.assertEqual(wp1._edge_back, wp2._edge_back)
+
+    def test_from_tiled(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level01.json", cache=self.cache)
+        self.assertIs(self.cache, chunk.cache)
+        self.assertGreater(chunk.waypoints.num_nodes, 0)
+        self.assertEqual(1, self.num_entries())
+
+        chunk.from_tiled("./assets/tiled/level01.json", cache=None)
+        self.assertIsNone(chunk.cache)
+        self.assertFalse(os.path.exists("./assets/tiled/level01.json-cache"))
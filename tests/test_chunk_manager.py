@@ -0,0 +1,198 @@
+import random
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from lib.gen import Worker, RandomSampler2D
+from lib.geom import ArrayMesh
+from lib.world import ChunkManager
+from tests.test_world_chunk import create_tiled, create_chunk
+from tests.util import assert_numpy_equal
+
+
+def create_world_layers(width, height, depth, seed=23):
+    """Random blocks on a floor, everything is walkable"""
+    rnd = random.Random(seed)
+    layers = [[rnd.randrange(1, 17) for i in range(width * height)]]
+    for z in range(1, depth):
+        layers.append([
+            rnd.randrange(1, 17) if z == 1 and rnd.random() < .2 else 0
+            for i in range(width * height)
+        ])
+    return layers
+
+
+def edge_set(waypoints):
+    return {
+        frozenset((waypoints.id_to_pos[i1], waypoints.id_to_pos[i2]))
+        for i1 in waypoints._edge_fwd for i2 in waypoints._edge_fwd[i1]
+    }
+
+
+class TestChunkManager(unittest.TestCase):
+
+    def create_world(self, width=24, height=20, depth=4, chunk_size=(8, 10, 4), **kwargs):
+        layers = create_world_layers(width, height, depth)
+        chunk = create_chunk(layers, width, height)
+        manager = ChunkManager(
+            chunk.tileset, ChunkManager.tiled_source(create_tiled(layers, width, height)),
+            chunk_size=chunk_size, **kwargs
+        )
+        return chunk, manager
+
+    def test_source(self):
+        chunk, manager = self.create_world()
+        for key in ((0, 0), (2, 1), (-1, 0), (3, 1)):
+            ox, oy, oz = manager.chunk_offset(key)
+            part = manager.load(key)
+            self.assertEqual((8, 10, 4), part.size())
+            for x, y, z in ((0, 0, 0), (7, 9, 1), (3, 4, 0)):
+                self.assertEqual(
+                    chunk.is_occupied(x + ox, y + oy, z + oz),
+                    manager.is_occupied(x + ox, y + oy, z + oz),
+                )
+        self.assertEqual((1, 0), manager.chunk_key(15, 9))
+        self.assertEqual((-1, -1), manager.chunk_key(-1, -1))
+
+    def test_stitching(self):
+        chunk, manager = self.create_world()
+        for y in range(2):
+            for x in range(3):
+                manager.load((x, y))
+
+        faces = chunk.exposed_faces()
+        ambient = chunk.ambient_table()
+        for key in manager.keys():
+            part = manager.chunk(key)
+            ox, oy, oz = manager.chunk_offset(key)
+            assert_numpy_equal(faces[:, oy:oy+10, ox:ox+8], part.exposed_faces(), msg=f"chunk {key}")
+            assert_numpy_equal(ambient[:, oy:oy+11, ox:ox+9], part.ambient_table(), msg=f"chunk {key}")
+            self.assertTrue(manager.is_built(key))
+
+        num_triangles = sum(manager.mesh(key).num_triangles for key in manager.keys())
+        self.assertEqual(chunk.create_mesh().num_triangles, num_triangles)
+
+    def test_waypoints(self):
+        chunk, manager = self.create_world()
+        for y in range(2):
+            for x in range(3):
+                manager.load((x, y))
+        self.assertEqual(edge_set(chunk.waypoints), edge_set(manager.waypoints))
+
+    def test_waypoints_corridor(self):
+        # walls with a 1-wide corridor that ends one voxel into the next chunk
+        #   and a dead end whose only neighbour is across the border
+        width, height = 16, 10
+        layers = [[1] * width * height, [1] * width * height, [1] * width * height]
+        for x in range(2, 9):
+            layers[1][5 * width + x] = layers[2][5 * width + x] = 0
+        for x in (7, 8):
+            layers[1][2 * width + x] = layers[2][2 * width + x] = 0
+        chunk = create_chunk(layers, width, height)
+        manager = ChunkManager(
+            chunk.tileset, ChunkManager.tiled_source(create_tiled(layers, width, height)),
+            chunk_size=(8, 10, 3),
+        )
+        manager.load((0, 0))
+        manager.load((1, 0))
+
+        expected, waypoints = chunk.waypoints, manager.waypoints
+        self.assertIn((8, 4, 1), waypoints.pos_to_id)
+        self.assertIn((8, 7, 1), waypoints.pos_to_id)
+        self.assertEqual(set(expected.pos_to_id), set(waypoints.pos_to_id))
+        self.assertEqual(edge_set(expected), edge_set(waypoints))
+        self.assertEqual(
+            set(chunk.create_waypoints(min_component_size=1).pos_to_id),
+            set(manager.create_waypoints(min_component_size=1).pos_to_id),
+        )
+
+    def test_streaming(self):
+        tileset = create_chunk([[1]], 1, 1).tileset
+        manager = ChunkManager(
+            tileset, ChunkManager.heightmap_source(RandomSampler2D(block_size=8), max_height=3),
+            chunk_size=(8, 8, 4),
+        )
+        manager.update((12, 12))
+        self.assertEqual(set(manager.keys_around(12, 12)), set(manager.keys()))
+        self.assertEqual(9, len(manager.keys()))
+        self.assertTrue(all(manager.is_built(key) for key in manager.keys()))
+
+        self.assertEqual(
+            sum(
+                manager.chunk(key).padded_space_type.nbytes + manager.chunk(key).padded_texture.nbytes
+                + sum(a.nbytes for a in manager.mesh(key).to_arrays().values())
+                + sum(a.nbytes for a in manager.voxel_distance_field(key).to_arrays().values())
+                for key in manager.keys()
+            ),
+            manager.memory_usage(),
+        )
+        # the sizes are not recalculated every frame
+        with mock.patch.object(ArrayMesh, "to_arrays") as to_arrays:
+            manager.update((12, 12))
+            to_arrays.assert_not_called()
+
+        chunk_bytes = manager.memory_usage() // 9
+        manager.max_bytes = chunk_bytes * 12
+        manager.update((100, 12))
+        self.assertTrue(set(manager.keys_around(100, 12)) <= set(manager.keys()))
+        self.assertLessEqual(len(manager.keys()), 12)
+        self.assertFalse(manager.is_loaded((0, 0)))
+
+        # nothing within load_radius is evicted
+        manager.max_bytes = 0
+        manager.update((100, 12))
+        self.assertEqual(set(manager.keys_around(100, 12)), set(manager.keys()))
+        self.assertEqual(sum(manager.memory_usage(key) for key in manager.keys()), manager.memory_usage())
+
+    def test_waypoints_streaming(self):
+        tileset = create_chunk([[1]], 1, 1).tileset
+        manager = ChunkManager(
+            tileset, ChunkManager.heightmap_source(RandomSampler2D(block_size=8), max_height=3),
+            chunk_size=(8, 8, 4), max_bytes=1, build=False,
+        )
+        manager.update((4, 4))
+        waypoints = manager.waypoints
+        max_nodes = 0
+        for step in range(30):
+            version = waypoints.version
+            manager.update((4 + step * 3, 4 + step))
+            self.assertIs(waypoints, manager.waypoints)
+            expected = manager.create_waypoints()
+            self.assertEqual(edge_set(expected), edge_set(waypoints), msg=f"step {step}")
+            self.assertEqual(set(expected.pos_to_id), set(waypoints.pos_to_id))
+            # the changes of one step are logged
+            self.assertIsNotNone(waypoints.changed_edges(version))
+            max_nodes = max(max_nodes, waypoints.num_nodes)
+        # the ids of unloaded chunks are reused
+        self.assertLessEqual(max_nodes, 12 * 8 * 8)
+        self.assertEqual(
+            sorted(waypoints.pos_to_id.values()),
+            sorted(set(range(waypoints.num_nodes)) - set(waypoints._free_ids)),
+        )
+
+    def test_worker(self):
+        chunk, manager = self.create_world(worker=Worker("test-chunk-manager"))
+        manager.worker.start()
+        try:
+            start_time = time.time()
+            while time.time() - start_time < 10:
+                manager.update((12, 15))
+                if len(manager.keys()) == 9 and all(manager.is_built(key) for key in manager.keys()):
+                    break
+                time.sleep(.01)
+        finally:
+            manager.worker.stop()
+
+        self.assertEqual(set(manager.keys_around(12, 15)), set(manager.keys()))
+        faces = chunk.exposed_faces()
+        ambient = chunk.ambient_table()
+        for key in ((0, 0), (1, 0), (2, 1)):
+            ox, oy, oz = manager.chunk_offset(key)
+            mesh = manager.mesh(key)
+            self.assertEqual(2 * np.count_nonzero(faces[:, oy:oy+10, ox:ox+8]), mesh.num_triangles)
+            assert_numpy_equal(
+                ambient[:, oy:oy+11, ox:ox+9][tuple(mesh.vertices[:, ::-1].astype("int").T)].astype("float32"),
+                mesh.attributes_array("a_ambient")[:, 0],
+            )
@@ -0,0 +1,324 @@
+import math
+import os
+import random
+import unittest
+
+import glm
+
+from lib.ai import AStar, Agents, DStarLite, WayPoints
+from lib.world import WorldChunk, Tileset
+from tests.test_astar import create_waypoints, random_node_pairs
+from tests.util import Timer
+
+
+def remove_path_edges(waypoints, path, num, rnd):
+    """Remove `num` random edges of `path`, returns the list of removed edges"""
+    edges = list(zip(path, path[1:]))
+    removed = rnd.sample(edges, min(num, len(edges)))
+    for n1, n2 in removed:
+        waypoints.remove_edge(n1, n2)
+    return removed
+
+
+class TestWayPointsChanges(unittest.TestCase):
+
+    def test_changed_edges(self):
+        waypoints = WayPoints()
+        waypoints.add_edge_pos((0, 0, 0), (1, 0, 0))
+        waypoints.add_edge_pos((1, 0, 0), (2, 0, 0))
+        version = waypoints.version
+        self.assertEqual([], waypoints.changed_edges(version))
+        self.assertEqual([(0, 1), (1, 2)], waypoints.changed_edges(0))
+
+        waypoints.remove_edge(1, 2)
+        waypoints.add_edge(0, 2)
+        self.assertEqual([(1, 2), (0, 2)], waypoints.changed_edges(version))
+        self.assertEqual([(0, 2)], waypoints.changed_edges(version + 1))
+
+    def test_update_edges(self):
+        waypoints = WayPoints()
+        waypoints.add_edge_pos((0, 0, 0), (1, 0, 0))
+        waypoints.add_edge_pos((1, 0, 0), (2, 0, 0))
+        waypoints.add_edge_pos((5, 0, 0), (6, 0, 0))
+        version = waypoints.version
+
+        positions = [(0, 0, 0), (1, 0, 0), (2, 0, 0), (3, 0, 0), (6, 0, 0)]
+        # only within the box, (5, 0, 0) - (6, 0, 0) stays
+        waypoints.update_edges(positions, [(0, 1), (2, 3)], (0, 0, 0), (3, 0, 0))
+        self.assertEqual([(1, 2), (2, 5)], waypoints.changed_edges(version))
+        self.assertEqual({1}, waypoints.adjacent_nodes(0))
+        self.assertEqual({5}, waypoints.adjacent_nodes(2))
+        self.assertEqual({3}, waypoints.adjacent_nodes(4))
+        # node ids are kept, new ones appended
+        self.assertEqual((1, 0, 0), waypoints.id_to_pos[1])
+        self.assertEqual((3, 0, 0), waypoints.id_to_pos[5])
+
+        waypoints.update_edges(positions, [(0, 1), (2, 3)])
+        self.assertEqual(set(), waypoints.adjacent_nodes(3))
+        self.assertEqual(6, waypoints.num_nodes)
+        # nodes that lost their edges are removed and their ids reused
+        self.assertNotIn((5, 0, 0), waypoints.pos_to_id)
+        self.assertNotIn((6, 0, 0), waypoints.pos_to_id)
+        version = waypoints.version
+        waypoints.add_edge_pos((7, 0, 0), (8, 0, 0))
+        self.assertEqual({3, 4}, {waypoints.pos_to_id[(7, 0, 0)], waypoints.pos_to_id[(8, 0, 0)]})
+        self.assertEqual(6, waypoints.num_nodes)
+        self.assertEqual([((7, 0, 0), (8, 0, 0))], waypoints.changed_edges(version, positions=True))
+
+    def test_update_edges_box(self):
+        waypoints = WayPoints()
+        for x in range(4):
+            waypoints.add_edge_pos((x, 0, 0), (x + 1, 1, 0))
+        # only the edges crossing x = 2 are replaced
+        waypoints.update_edges([(1, 0, 0), (2, 1, 0), (2, 0, 0)], [(0, 1), (2, 1)], (2, 0, 0), (2, 1, 0))
+        self.assertEqual({(1, 1, 0)}, {waypoints.id_to_pos[n] for n in waypoints.adjacent_nodes(0)})
+        self.assertIn((3, 0, 0), waypoints.pos_to_id)
+        self.assertEqual(
+            {(1, 0, 0), (2, 0, 0)},
+            {waypoints.id_to_pos[n] for n in waypoints.adjacent_nodes(waypoints.pos_to_id[(2, 1, 0)])},
+        )
+        self.assertNotIn((3, 1, 0), waypoints.pos_to_id)
+
+    def test_changes_dropped(self):
+        waypoints = WayPoints()
+        waypoints.MAX_EDGE_CHANGES = 4
+        for i in range(6):
+            waypoints.add_edge_pos((i, 0, 0), (i + 1, 0, 0))
+        self.assertIsNone(waypoints.changed_edges(0))
+        self.assertEqual([(4, 5), (5, 6)], waypoints.changed_edges(4))
+
+
+class TestDStarLite(unittest.TestCase):
+
+    def assert_path(self, waypoints, dstar, expected):
+        path = dstar.path()
+        if expected is None:
+            self.assertIsNone(path)
+            return
+        self.assertEqual(dstar.start_node, path[0])
+        self.assertEqual(dstar.goal_node, path[-1])
+        for n1, n2 in zip(path, path[1:]):
+            self.assertIn(n2, waypoints.adjacent_nodes(n1))
+        csr = waypoints.csr()
+        self.assertAlmostEqual(csr.path_cost(expected), csr.path_cost(path), places=5)
+        self.assertAlmostEqual(csr.path_cost(expected), dstar.distance(), places=5)
+
+    def test_search(self):
+        waypoints = create_waypoints()
+        astar = AStar(waypoints)
+        for start, goal in random_node_pairs(waypoints, 30):
+            self.assert_path(waypoints, DStarLite(waypoints, start, goal), astar.search(start, goal))
+
+    def test_replan(self):
+        rnd = random.Random(42)
+        for seed in range(4):
+            waypoints = create_waypoints(seed=seed)
+            astar = AStar(waypoints)
+            for start, goal in random_node_pairs(waypoints, 5, seed=seed):
+                dstar = DStarLite(waypoints, start, goal)
+                for i in range(3):
+                    path = dstar.path()
+                    if path is None or len(path) < 2:
+                        break
+                    removed = remove_path_edges(waypoints, path, 2, rnd)
+                    dstar.replan()
+                    self.assert_path(waypoints, dstar, astar.search(start, goal))
+                    # and back
+                    for n1, n2 in removed:
+                        waypoints.add_edge(n1, n2)
+                    dstar.replan()
+                    self.assert_path(waypoints, dstar, astar.search(start, goal))
+                    waypoints.remove_edge(*removed[0])
+
+    def test_move_start(self):
+        rnd = random.Random(23)
+        waypoints = create_waypoints()
+        astar = AStar(waypoints)
+        for start, goal in random_node_pairs(waypoints, 10):
+            dstar = DStarLite(waypoints, start, goal)
+            path = dstar.path()
+            while path is not None and len(path) > 3:
+                # walk two steps and change the map ahead
+                dstar.move_start(path[2])
+                remove_path_edges(waypoints, path[2:], 1, rnd)
+                path = dstar.replan()
+                self.assert_path(waypoints, dstar, astar.search(dstar.start_node, goal))
+
+    def test_unreachable(self):
+        waypoints = WayPoints()
+        waypoints.add_edge_pos((0, 0, 0), (1, 0, 0))
+        waypoints.add_edge_pos((1, 0, 0), (2, 0, 0))
+        dstar = DStarLite(waypoints, 0, 2)
+        self.assertEqual([0, 1, 2], dstar.path())
+        waypoints.remove_edge(1, 2)
+        self.assertIsNone(dstar.replan())
+        self.assertEqual(math.inf, dstar.distance())
+        waypoints.add_edge(0, 2)
+        self.assertEqual([0, 2], dstar.replan())
+
+    def test_replan_changes_dropped(self):
+        rnd = random.Random(23)
+        waypoints = create_waypoints()
+        waypoints.MAX_EDGE_CHANGES = 2
+        astar = AStar(waypoints)
+        start, goal = next(
+            (start, goal) for start, goal in random_node_pairs(waypoints, 30)
+            if len(astar.search(start, goal) or []) > 6
+        )
+        dstar = DStarLite(waypoints, start, goal)
+        num_expanded = dstar.num_expanded
+        remove_path_edges(waypoints, dstar.path(), 3, rnd)
+        self.assertIsNone(waypoints.changed_edges(dstar._version))
+        dstar.replan()
+        self.assert_path(waypoints, dstar, astar.search(start, goal))
+        self.assertEqual(waypoints.version, dstar._version)
+        # counted over all searches
+        self.assertGreater(dstar.num_expanded, num_expanded)
+
+    def test_expansions_scale_with_change(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+        waypoints = chunk.waypoints
+        rnd = random.Random(23)
+        num_initial, num_replan = 0, 0
+        for start, goal in random_node_pairs(waypoints, 20):
+            dstar = DStarLite(waypoints, start, goal)
+            path = dstar.path()
+            if path is None or len(path) < 30:
+                continue
+            num_expanded = dstar.num_expanded
+            removed = remove_path_edges(waypoints, path[len(path) // 2 - 5:len(path) // 2 + 5], 1, rnd)
+            dstar.replan()
+            num_initial += num_expanded
+            num_replan += dstar.num_expanded - num_expanded
+            for edge in removed:
+                waypoints.add_edge(*edge)
+        self.assertGreater(num_replan, 0)
+        self.assertLess(num_replan, num_initial / 3)
+
+    def test_agents_replan(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+        waypoints = chunk.waypoints
+        astar = AStar(waypoints)
+        start, goal = next(
+            (start, goal) for start, goal in random_node_pairs(waypoints, 100)
+            if len(astar.search(start, goal) or []) > 20
+        )
+        agents = Agents(chunk, headless=True)
+        agents.create_agent("walker")
+        agents["walker"].set_position(glm.vec3(waypoints.id_to_pos[start]) + (.5, .5, 0))
+        agents.set_goal("walker", waypoints.id_to_pos[goal])
+        while "walker" not in agents._paths:
+            agents.update(1. / 60.)
+
+        for i in range(3):
+            path = agents._paths["walker"]
+            remaining = path.path[path.cur_index:]
+            if len(remaining) < 6:
+                break
+            blocked = (remaining[4], remaining[5])
+            waypoints.remove_edge(*blocked)
+            agents.update(1. / 60.)
+            path = agents._paths["walker"]
+            self.assertEqual(goal, path.path[-1])
+            for edge in zip(path.path, path.path[1:]):
+                self.assertNotIn(blocked, (edge, edge[::-1]))
+            for j in range(30):
+                agents.update(1. / 60.)
+
+        for i in range(6000):
+            if agents.is_idle("walker"):
+                break
+            agents.update(1. / 60.)
+        self.assertTrue(agents.is_idle("walker"))
+        self.assertEqual({}, agents._replanners)
+        self.assertLess(
+            glm.distance(glm.vec3(waypoints.id_to_pos[goal]).xy + .5, agents["walker"].sposition.xy), 1.
+        )
+
+    def test_agents_set_block(self):
+        for hierarchical in (False, True):
+            chunk = WorldChunk(Tileset(16, 16))
+            chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+            waypoints = chunk.waypoints
+            astar = AStar(waypoints)
+            start, goal = next(
+                (start, goal) for start, goal in random_node_pairs(waypoints, 100)
+                if len(astar.search(start, goal) or []) > 20
+            )
+            agents = Agents(chunk, hierarchical=hierarchical, headless=True)
+            agents.create_agent("walker")
+            agents["walker"].set_position(glm.vec3(waypoints.id_to_pos[start]) + (.5, .5, 0))
+            agents.set_goal("walker", waypoints.id_to_pos[goal])
+            while "walker" not in agents._paths:
+                agents.update(1. / 60.)
+            for j in range(30):
+                agents.update(1. / 60.)
+
+            # put a block on a waypoint in front of the agent
+            path = agents._paths["walker"]
+            blocked = path.path[path.cur_index + 4]
+            chunk.set_block(*waypoints.id_to_pos[blocked], 1)
+            self.assertEqual(set(), waypoints.adjacent_nodes(blocked))
+            agents.update(1. / 60.)
+            path = agents._paths["walker"]
+            self.assertNotIn(blocked, path.path[path.cur_index:], msg=f"hierarchical={hierarchical}")
+
+            for i in range(6000):
+                if agents.is_idle("walker"):
+                    break
+                agents.update(1. / 60.)
+                path = agents._paths.get("walker")
+                if path is not None:
+                    self.assertNotIn(blocked, path.path[path.cur_index:])
+            self.assertTrue(agents.is_idle("walker"))
+            self.assertLess(
+                glm.distance(glm.vec3(waypoints.id_to_pos[goal]).xy + .5, agents["walker"].sposition.xy), 1.
+            )
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestDStarLiteBenchmark(unittest.TestCase):
+    """
+    replan 70 paths after removing one edge
+    AStar.search      0.3916 sec, 72462 expanded
+    DStarLite.replan  0.3071 sec, 6890 expanded
+    """
+
+    def test_benchmark(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+        waypoints = chunk.waypoints
+        astar = AStar(waypoints)
+        rnd = random.Random(23)
+        dstars = [DStarLite(waypoints, start, goal) for start, goal in random_node_pairs(waypoints, 100)]
+        dstars = [d for d in dstars if d.path() is not None and len(d.path()) >= 30]
+
+        # remove one edge in the middle of each path
+        astar_seconds, dstar_seconds = 0., 0.
+        astar_expanded, dstar_expanded = 0, 0
+        for dstar in dstars:
+            # catch up with the previous changes
+            path = dstar.replan()
+            removed = remove_path_edges(waypoints, path[len(path) // 2 - 5:len(path) // 2 + 5], 1, rnd)
+            # not timing the graph conversion
+            astar.graph().to_lists()
+
+            with Timer() as timer:
+                astar.search(dstar.start_node, dstar.goal_node)
+            astar_seconds += timer.seconds()
+            astar_expanded += astar.num_expanded
+
+            num_expanded = dstar.num_expanded
+            with Timer() as timer:
+                dstar.replan()
+            dstar_seconds += timer.seconds()
+            dstar_expanded += dstar.num_expanded - num_expanded
+
+            for edge in removed:
+                waypoints.add_edge(*edge)
+
+        print("\nreplan %s paths after removing one edge" % len(dstars))
+        print("AStar.search      %.4f sec, %s expanded" % (astar_seconds, astar_expanded))
+        print("DStarLite.replan  %.4f sec, %s expanded" % (dstar_seconds, dstar_expanded))
@@ -0,0 +1,125 @@
+import os
+import random
+import unittest
+
+from lib.ai import AStar, FlowField, WayPoints
+from lib.world import WorldChunk, Tileset
+from tests.test_astar import create_waypoints
+from tests.util import Timer
+
+
+class TestFlowField(unittest.TestCase):
+
+    def assert_paths(self, waypoints, field, exact_radius=None):
+        astar = AStar(waypoints)
+        csr = waypoints.csr()
+        for node in range(waypoints.num_nodes):
+            expected = astar.search(node, field.goal_node)
+            path = field.path(node)
+            if expected is None:
+                self.assertIsNone(path)
+                self.assertEqual(-1, field.next_node(node))
+                continue
+            self.assertEqual(node, path[0])
+            self.assertEqual(field.goal_node, path[-1])
+            self.assertEqual(len(path), len(set(path)))
+            for n1, n2 in zip(path, path[1:]):
+                self.assertIn(n2, waypoints.adjacent_nodes(n1))
+            cost = csr.path_cost(expected)
+            if exact_radius is None or cost <= exact_radius:
+                self.assertAlmostEqual(cost, csr.path_cost(path))
+                self.assertAlmostEqual(cost, field.distance(node))
+            else:
+                self.assertGreaterEqual(field.distance(node) + 1e-6, cost)
+
+    def test_field(self):
+        waypoints = create_waypoints()
+        field = FlowField(waypoints, 17)
+        self.assert_paths(waypoints, field)
+        self.assertEqual(17, field.next_node(17))
+        self.assertEqual([17], field.path(17))
+
+    def test_move_goal(self):
+        waypoints = create_waypoints()
+        path = AStar(waypoints).search(waypoints.pos_to_id[(8, 7, 1)], waypoints.pos_to_id[(15, 13, 1)])[:4]
+        field = FlowField(waypoints, path[0], refresh_radius=6)
+        for node in path[1:]:
+            field.set_goal(node)
+            self.assert_paths(waypoints, field, exact_radius=6)
+        self.assertEqual(1, field.num_full_updates)
+        self.assertEqual(3, field.num_partial_updates)
+        # too far away
+        field.set_goal(waypoints.pos_to_id[(1, 1, 1)])
+        self.assertEqual(2, field.num_full_updates)
+        self.assert_paths(waypoints, field)
+
+    def test_graph_change(self):
+        waypoints = WayPoints()
+        for x in range(5):
+            waypoints.add_edge_pos((x, 0, 0), (x + 1, 0, 0))
+        field = FlowField(waypoints, 0)
+        self.assertEqual([5, 4, 3, 2, 1, 0], field.path(5))
+        waypoints.add_edge(5, 0)
+        self.assertEqual([5, 0], field.path(5))
+        self.assertEqual(2, field.num_full_updates)
+
+    def test_walk(self):
+        waypoints = WayPoints()
+        for x in range(5):
+            waypoints.add_edge_pos((x, 0, 0), (x + 1, 0, 0))
+        field = FlowField(waypoints, 0)
+        segments = field.walk(5)
+        self.assertEqual([5, 4], next(segments))
+        self.assertEqual([4, 3], next(segments))
+        field.set_goal(5)
+        self.assertEqual([3, 4], next(segments))
+        self.assertEqual([4, 5], next(segments))
+        self.assertIsNone(next(segments, None))
+        self.assertEqual([[0, 1], [1, 2]], list(field.walk(0, stop_distance=3)))
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestFlowFieldBenchmark(unittest.TestCase):
+    """
+    level03 5027 nodes, 100 agents with the same goal
+    AStar per agent           0.1374 sec
+    FlowField + paths         0.0025 sec
+    next_node                    0.0 sec
+    moving goal full update       0.001 sec/update
+    moving goal partial update   0.0002 sec/update
+    """
+
+    def test_benchmark(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+        waypoints = chunk.waypoints
+        goal = waypoints.closest_node((30, 30, 1))
+        field = FlowField(waypoints, goal)
+        starts = [n for n in range(0, waypoints.num_nodes, 7) if field.next_node(n) >= 0][:100]
+        print(f"\nlevel03 {waypoints.num_nodes} nodes, {len(starts)} agents with the same goal")
+
+        astar = AStar(waypoints)
+        with Timer(len(starts)) as timer:
+            for start in starts:
+                astar.search(start, goal)
+        print(f"AStar per agent         {timer.seconds():8} sec")
+        with Timer(len(starts)) as timer:
+            field = FlowField(waypoints, goal)
+            for start in starts:
+                field.path(start)
+        print(f"FlowField + paths       {timer.seconds():8} sec")
+        with Timer(len(starts)) as timer:
+            for start in starts:
+                field.next_node(start)
+        print(f"next_node               {timer.seconds():8} sec")
+
+        rnd = random.Random(23)
+        goals = [goal]
+        for i in range(50):
+            goals.append(rnd.choice(sorted(waypoints.adjacent_nodes(goals[-1]))))
+        for name, radius in (("full update", 0), ("partial update", 16)):
+            field = FlowField(waypoints, goal, refresh_radius=radius)
+            with Timer(len(goals)) as timer:
+                for g in goals:
+                    field.set_goal(g)
+            print(f"moving goal {name:14} {timer.spf():8} sec/update")
@@ -0,0 +1,187 @@
+import os
+import unittest
+
+import glm
+
+from lib.ai import AStar, Agents, HierarchicalAStar
+from lib.world import WorldChunk, Tileset
+from tests.test_astar import create_waypoints, random_node_pairs
+from tests.util import Timer
+
+
+class TestHierarchicalAStar(unittest.TestCase):
+
+    def assert_path(self, waypoints, path, start, end):
+        self.assertEqual(start, path[0])
+        self.assertEqual(end, path[-1])
+        for n1, n2 in zip(path, path[1:]):
+            self.assertIn(n2, waypoints.adjacent_nodes(n1))
+
+    def test_compare_astar(self):
+        for seed in range(3):
+            waypoints = create_waypoints(seed)
+            astar = AStar(waypoints)
+            hpa = HierarchicalAStar(waypoints, cluster_size=4)
+            csr = waypoints.csr()
+            self.assertEqual(16, hpa.num_clusters)
+            cost, expected_cost = 0., 0.
+            for start, end in random_node_pairs(waypoints, 30, seed):
+                expected = astar.search(start, end)
+                path = hpa.search(start, end)
+                if expected is None:
+                    self.assertIsNone(path)
+                    continue
+                self.assert_path(waypoints, path, start, end)
+                self.assertLessEqual(csr.path_cost(expected), csr.path_cost(path) + 1e-6)
+                cost += csr.path_cost(path)
+                expected_cost += csr.path_cost(expected)
+            # 4x4 clusters are tiny, on the levels the paths are about 5% longer
+            self.assertLess(cost, expected_cost * 1.3)
+
+    def test_refine(self):
+        waypoints = create_waypoints()
+        hpa = HierarchicalAStar(waypoints, cluster_size=4)
+        start, end = waypoints.pos_to_id[(0, 0, 1)], waypoints.pos_to_id[(15, 13, 1)]
+        abstract_path = hpa.search_abstract(start, end)
+        self.assertEqual(start, abstract_path[0])
+        self.assertEqual(end, abstract_path[-1])
+        self.assertGreater(len(abstract_path), 4)
+
+        segments = hpa.refine(abstract_path)
+        segment = next(segments)
+        self.assertEqual(abstract_path[:2], [segment[0], segment[-1]])
+        path = segment + [n for s in segments for n in s[1:]]
+        self.assert_path(waypoints, path, start, end)
+        self.assertEqual(path, hpa.search(start, end))
+
+    def test_invalidate(self):
+        waypoints = create_waypoints()
+        hpa = HierarchicalAStar(waypoints, cluster_size=4)
+        hpa.search(0, 1)
+        # wall across x = 12/13
+        for y in range(3, 14):
+            for n1 in (waypoints.pos_to_id.get((12, y, 1)), waypoints.pos_to_id.get((13, y, 1))):
+                if n1 is not None:
+                    for n2 in list(waypoints.adjacent_nodes(n1)):
+                        waypoints.remove_edge(n1, n2)
+        hpa.invalidate((12, 3, 0), (13, 13, 3))
+        clusters = dict(hpa._clusters)
+        hpa.search(0, 1)
+        # far away clusters are kept,
+        #   the removed edges to x = 11 also rebuild the neighbours of cluster x = 2
+        self.assertIs(clusters[(0, 1)], hpa._clusters[(0, 1)])
+        self.assertIsNot(clusters[(2, 1)], hpa._clusters[(2, 1)])
+        self.assertIsNot(clusters[(3, 1)], hpa._clusters[(3, 1)])
+
+        expected = HierarchicalAStar(waypoints, cluster_size=4)
+        self.assertEqual(expected.num_entrances, hpa.num_entrances)
+        self.assertEqual(
+            {n: sorted(e) for n, e in expected._abstract.items()},
+            {n: sorted(e) for n, e in hpa._abstract.items()},
+        )
+        astar = AStar(waypoints)
+        for start, end in random_node_pairs(waypoints, 20):
+            self.assertEqual(astar.search(start, end) is None, hpa.search(start, end) is None)
+
+    def test_changed_edges(self):
+        waypoints = create_waypoints()
+        hpa = HierarchicalAStar(waypoints, cluster_size=4)
+        hpa.search(0, 1)
+        clusters = dict(hpa._clusters)
+        # the changes are read from the WayPoints
+        n1 = waypoints.pos_to_id[(13, 5, 1)]
+        for n2 in list(waypoints.adjacent_nodes(n1)):
+            waypoints.remove_edge(n1, n2)
+        hpa.search(0, 1)
+        self.assertIs(clusters[(0, 0)], hpa._clusters[(0, 0)])
+        self.assertIs(clusters[(1, 3)], hpa._clusters[(1, 3)])
+        self.assertIsNot(clusters[(3, 1)], hpa._clusters[(3, 1)])
+        self.assertNotIn(n1, hpa._clusters[(3, 1)].adjacency[waypoints.pos_to_id[(12, 5, 1)]])
+
+        expected = HierarchicalAStar(waypoints, cluster_size=4)
+        self.assertEqual(expected.num_entrances, hpa.num_entrances)
+        self.assertEqual(
+            {n: sorted(e) for n, e in expected._abstract.items()},
+            {n: sorted(e) for n, e in hpa._abstract.items()},
+        )
+
+        # too many changes to be logged
+        waypoints.MAX_EDGE_CHANGES = 2
+        for n2 in list(waypoints.adjacent_nodes(0)):
+            waypoints.remove_edge(0, n2)
+        waypoints.add_edge(n1, waypoints.pos_to_id[(12, 5, 1)])
+        hpa.search(1, 2)
+        self.assertIsNot(clusters[(0, 0)], hpa._clusters[(0, 0)])
+        self.assertIsNot(clusters[(1, 3)], hpa._clusters[(1, 3)])
+
+    def test_agents_changed_segment(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+        waypoints = chunk.waypoints
+        agents = Agents(chunk, hierarchical=True, headless=True)
+        hpa = agents._hierarchical
+        start, goal = next(
+            (start, goal) for start, goal in random_node_pairs(waypoints, 100)
+            if len(hpa.search_abstract(start, goal) or []) > 6
+        )
+        agents.create_agent("walker")
+        agents["walker"].set_position(glm.vec3(waypoints.id_to_pos[start]) + (.5, .5, 0))
+        agents.set_goal("walker", waypoints.id_to_pos[goal])
+        path = agents._paths["walker"]
+
+        # an entrance that is not refined yet becomes unreachable
+        abstract_path = hpa.search_abstract(start, goal)
+        blocked = abstract_path[len(abstract_path) // 2]
+        self.assertNotIn(blocked, path.path)
+        for n2 in list(waypoints.adjacent_nodes(blocked)):
+            waypoints.remove_edge(blocked, n2)
+        # not re-planned by Agents, the path notices when refining the segment
+        agents._waypoints_version = waypoints.version
+
+        for i in range(6000):
+            if agents.is_idle("walker"):
+                break
+            agents.update(1. / 60.)
+        self.assertTrue(agents.is_idle("walker"))
+        self.assertNotIn(blocked, path.path)
+        self.assertEqual(goal, path.path[-1])
+        self.assertLess(
+            glm.distance(glm.vec3(waypoints.id_to_pos[goal]).xy + .5, agents["walker"].sposition.xy), 1.
+        )
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestHierarchicalAStarBenchmark(unittest.TestCase):
+    """
+    level03 5027 nodes, 100 paths
+    AStar    build  0.0046 sec  search  0.4343 sec    92607 expanded  path cost 5056
+    HPA* 8   build   0.187 sec  search  0.1681 sec    19069 expanded  path cost 5397
+    HPA* 16  build  0.0779 sec  search  0.1446 sec    17830 expanded  path cost 5259
+    """
+
+    def test_benchmark(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+        waypoints = chunk.waypoints
+        csr = waypoints.csr()
+        pairs = random_node_pairs(waypoints, 100)
+        print(f"\nlevel03 {waypoints.num_nodes} nodes, {len(pairs)} paths")
+        for name, pathfinder in (
+                ("AStar", AStar(waypoints)),
+                ("HPA* 8", HierarchicalAStar(waypoints, cluster_size=8)),
+                ("HPA* 16", HierarchicalAStar(waypoints, cluster_size=16)),
+        ):
+            with Timer() as timer:
+                pathfinder.search(0, 0)
+            build_time = timer.seconds()
+            expanded, cost = 0, 0.
+            with Timer(len(pairs)) as timer:
+                for start, end in pairs:
+                    path = pathfinder.search(start, end)
+                    expanded += pathfinder.num_expanded
+                    if path:
+                        cost += csr.path_cost(path)
+            print(
+                f"{name:8} build {build_time:7} sec  search {timer.seconds():7} sec"
+                f" {expanded:8} expanded  path cost {round(cost)}"
+            )
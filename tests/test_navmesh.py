@@ -0,0 +1,227 @@
+import math
+import os
+import unittest
+
+import glm
+
+from lib.ai import AStar, Agents, NavMesh, WayPoints
+from lib.world import WorldChunk, Tileset
+from tests.test_astar import create_waypoints, random_node_pairs
+from tests.util import Timer
+
+
+def load_level():
+    chunk = WorldChunk(Tileset(16, 16))
+    chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+    return chunk
+
+
+def path_length(waypoints, path):
+    return sum(
+        math.dist(waypoints.id_to_pos[n1], waypoints.id_to_pos[n2])
+        for n1, n2 in zip(path, path[1:])
+    )
+
+
+class TestNavMesh(unittest.TestCase):
+
+    def assert_walkable(self, navmesh, path):
+        waypoints = navmesh.waypoints
+        for n1, n2 in zip(path, path[1:]):
+            self.assertTrue(
+                n2 in waypoints.adjacent_nodes(n1) or navmesh._is_straight_walkable(n1, n2),
+                "%s -> %s" % (waypoints.id_to_pos[n1], waypoints.id_to_pos[n2])
+            )
+
+    def assert_regions(self, navmesh):
+        waypoints = navmesh.waypoints
+        nodes_per_region = [0] * navmesh.num_regions
+        for node in range(waypoints.num_nodes):
+            region = navmesh.region_of(node)
+            x0, y0, x1, y1, z = navmesh.regions[region]
+            x, y, nz = waypoints.id_to_pos[node]
+            self.assertEqual(z, nz)
+            self.assertTrue(x0 <= x <= x1 and y0 <= y <= y1)
+            nodes_per_region[region] += 1
+        # every region is a full rectangle
+        for (x0, y0, x1, y1, z), num in zip(navmesh.regions, nodes_per_region):
+            self.assertEqual((x1 - x0 + 1) * (y1 - y0 + 1), num)
+
+    def test_regions(self):
+        chunk = load_level()
+        navmesh = NavMesh(chunk.waypoints)
+        self.assertLess(navmesh.num_regions, chunk.waypoints.num_nodes / 5)
+        self.assert_regions(navmesh)
+        for portal in navmesh.portals:
+            for n1, n2 in portal.edges:
+                self.assertEqual(portal.region1, navmesh.region_of(n1))
+                self.assertEqual(portal.region2, navmesh.region_of(n2))
+
+    def test_search_level(self):
+        chunk = load_level()
+        waypoints = chunk.waypoints
+        astar = AStar(waypoints)
+        navmesh = NavMesh(waypoints)
+        astar_length, navmesh_length = 0., 0.
+        astar_nodes, navmesh_nodes = 0, 0
+        for start, goal in random_node_pairs(waypoints, 100):
+            expected = astar.search(start, goal)
+            path = navmesh.search(start, goal)
+            if expected is None:
+                self.assertIsNone(path)
+                continue
+            self.assertEqual(start, path[0])
+            self.assertEqual(goal, path[-1])
+            self.assert_walkable(navmesh, path)
+            astar_length += path_length(waypoints, expected)
+            navmesh_length += path_length(waypoints, path)
+            astar_nodes += len(expected)
+            navmesh_nodes += len(path)
+
+        self.assertLess(navmesh_nodes, astar_nodes / 3)
+        self.assertLessEqual(navmesh_length, astar_length)
+
+    def test_search_random_chunks(self):
+        for seed in range(4):
+            waypoints = create_waypoints(seed=seed)
+            astar = AStar(waypoints)
+            navmesh = NavMesh(waypoints)
+            self.assert_regions(navmesh)
+            for start, goal in random_node_pairs(waypoints, 20, seed=seed):
+                expected = astar.search(start, goal)
+                path = navmesh.search(start, goal)
+                if expected is None:
+                    self.assertIsNone(path)
+                    self.assertIsNone(navmesh.search_regions(start, goal))
+                    continue
+                self.assertEqual([start, goal], [path[0], path[-1]])
+                self.assert_walkable(navmesh, path)
+                regions = navmesh.search_regions(start, goal)
+                self.assertEqual(navmesh.region_of(start), regions[0])
+                self.assertEqual(navmesh.region_of(goal), regions[-1])
+
+    def test_straight_line(self):
+        waypoints = WayPoints()
+        for x in range(10):
+            for y in range(3):
+                if x < 9:
+                    waypoints.add_edge_pos((x, y, 0), (x + 1, y, 0))
+                if y < 2:
+                    waypoints.add_edge_pos((x, y, 0), (x, y + 1, 0))
+        navmesh = NavMesh(waypoints)
+        self.assertEqual(1, navmesh.num_regions)
+        start, goal = waypoints.pos_to_id[(0, 0, 0)], waypoints.pos_to_id[(9, 2, 0)]
+        self.assertEqual([start, goal], navmesh.search(start, goal))
+
+    def test_rebuild_on_change(self):
+        waypoints = WayPoints()
+        for x in range(5):
+            waypoints.add_edge_pos((x, 0, 0), (x + 1, 0, 0))
+        navmesh = NavMesh(waypoints)
+        start, goal = waypoints.pos_to_id[(0, 0, 0)], waypoints.pos_to_id[(5, 0, 0)]
+        self.assertEqual([start, goal], navmesh.search(start, goal))
+
+        waypoints.remove_edge(waypoints.pos_to_id[(2, 0, 0)], waypoints.pos_to_id[(3, 0, 0)])
+        self.assertIsNone(navmesh.search(start, goal))
+        self.assertEqual(2, navmesh.num_regions)
+
+    def test_wall(self):
+        for use_set_block in (False, True):
+            chunk = load_level()
+            waypoints = chunk.waypoints
+            navmesh = NavMesh(waypoints)
+            start, goal = waypoints.pos_to_id[(81, 38, 1)], waypoints.pos_to_id[(91, 38, 1)]
+            self.assertEqual([start, goal], navmesh.search(start, goal))
+
+            # a wall across the region, the nodes without edges are kept by remove_edge
+            wall = [waypoints.pos_to_id[(82, y, 1)] for y in range(30, 48)]
+            for y in range(30, 48):
+                if use_set_block:
+                    chunk.set_block(82, y, 1, 1)
+                    chunk.set_block(82, y, 2, 1)
+                else:
+                    n1 = waypoints.pos_to_id[(82, y, 1)]
+                    for n2 in list(waypoints.adjacent_nodes(n1)):
+                        waypoints.remove_edge(n1, n2)
+            path = navmesh.search(start, goal)
+            self.assertFalse(navmesh._is_straight_walkable(start, goal))
+            self.assertEqual(goal, path[-1])
+            self.assertFalse(set(wall) & set(path))
+            for n1, n2 in zip(path, path[1:]):
+                (x1, y1, z1), (x2, y2, z2) = waypoints.id_to_pos[n1], waypoints.id_to_pos[n2]
+                if min(x1, x2) < 82 < max(x1, x2):
+                    # the wall is passed around its ends
+                    t = (82 - x1) / (x2 - x1)
+                    self.assertFalse(30 <= y1 + t * (y2 - y1) + .5 < 48, msg=f"{(x1, y1)} {(x2, y2)}")
+
+    def test_repair_unreachable(self):
+        waypoints = WayPoints()
+        for x in (0, 1, 5):
+            waypoints.add_edge_pos((x, 0, 0), (x + 1, 0, 0))
+        navmesh = NavMesh(waypoints)
+        navmesh.search(0, 1)
+        start, goal = waypoints.pos_to_id[(0, 0, 0)], waypoints.pos_to_id[(6, 0, 0)]
+        # the straight segment can not be walked and the waypoint search fails
+        self.assertIsNone(navmesh._repair([start, goal]))
+        self.assertIsNone(navmesh.search(start, goal))
+
+    def test_agents_navmesh(self):
+        chunk = load_level()
+        waypoints = chunk.waypoints
+        astar = AStar(waypoints)
+        start, goal = next(
+            (start, goal) for start, goal in random_node_pairs(waypoints, 100)
+            if len(astar.search(start, goal) or []) > 20
+        )
+        agents = Agents(chunk, headless=True, navmesh=True)
+        agents.create_agent("walker")
+        agents["walker"].set_position(glm.vec3(waypoints.id_to_pos[start]) + (.5, .5, 0))
+        agents.set_goal("walker", waypoints.id_to_pos[goal])
+        self.assertEqual(1, agents.num_paths)
+        self.assertLess(len(agents._paths["walker"].path), len(astar.search(start, goal)))
+
+        for i in range(6000):
+            if agents.is_idle("walker"):
+                break
+            agents.update(1. / 60.)
+        self.assertTrue(agents.is_idle("walker"))
+        self.assertLess(
+            glm.distance(glm.vec3(waypoints.id_to_pos[goal]).xy + .5, agents["walker"].sposition.xy), 1.
+        )
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestNavMeshBenchmark(unittest.TestCase):
+    """
+    NavMesh(5027 nodes, 481 regions, 802 portals), built in 0.1478 sec
+    200 paths
+    AStar.search    0.8300 sec, length 8922.0, 8258 nodes
+    NavMesh.search  0.8017 sec, length 8647.4, 1457 nodes
+    """
+
+    def test_benchmark(self):
+        chunk = load_level()
+        waypoints = chunk.waypoints
+        astar = AStar(waypoints)
+        astar.graph().to_lists()
+
+        with Timer() as timer:
+            navmesh = NavMesh(waypoints)
+        build_seconds = timer.seconds()
+
+        pairs = random_node_pairs(waypoints, 200)
+        results = dict()
+        for name, search in (("AStar.search", astar.search), ("NavMesh.search", navmesh.search)):
+            length, nodes = 0., 0
+            with Timer() as timer:
+                paths = [search(start, goal) for start, goal in pairs]
+            for path in paths:
+                if path is not None:
+                    length += path_length(waypoints, path)
+                    nodes += len(path)
+            results[name] = (timer.seconds(), length, nodes)
+
+        print("\n%s, built in %.4f sec" % (navmesh, build_seconds))
+        print("%s paths" % len(pairs))
+        for name, (seconds, length, nodes) in results.items():
+            print("%-15s %.4f sec, length %.1f, %s nodes" % (name, seconds, length, nodes))
@@ -0,0 +1,166 @@
+import os
+import random
+import unittest
+
+from lib.ai import AStar, PathCache, WayPoints
+from lib.world import WorldChunk, Tileset
+from tests.test_astar import create_waypoints, random_node_pairs
+from tests.util import Timer
+
+
+class CountingAStar(AStar):
+
+    def __init__(self, waypoints):
+        super().__init__(waypoints)
+        self.num_searches = 0
+
+    def search(self, start_node, end_node):
+        self.num_searches += 1
+        return super().search(start_node, end_node)
+
+
+class TestPathCache(unittest.TestCase):
+
+    def test_hits(self):
+        waypoints = create_waypoints()
+        astar = CountingAStar(waypoints)
+        cache = PathCache(astar, capacity=100)
+        for start, end in random_node_pairs(waypoints, 20):
+            path = cache.search(start, end)
+            self.assertEqual(astar.search_old(start, end), path)
+            self.assertEqual(path, cache.search(start, end))
+            if path:
+                # modifying the returned path does not change the cache
+                path.append(-1)
+                self.assertNotEqual(path, cache.search(start, end))
+        info = cache.cache_info()
+        self.assertEqual(info.misses, astar.num_searches)
+        self.assertEqual(40, info.hits + info.suffix_hits)
+        self.assertEqual(20, len(cache))
+
+    def test_suffix(self):
+        waypoints = create_waypoints()
+        astar = CountingAStar(waypoints)
+        cache = PathCache(astar)
+        start, end = waypoints.pos_to_id[(0, 0, 1)], waypoints.pos_to_id[(15, 13, 1)]
+        path = cache.search(start, end)
+        self.assertGreater(len(path), 10)
+        for i, node in enumerate(path):
+            self.assertEqual(path[i:], cache.search(node, end))
+        self.assertEqual(1, astar.num_searches)
+        self.assertEqual(len(path) - 1, cache.cache_info().suffix_hits)
+        self.assertEqual(1, cache.cache_info().hits)
+
+    def test_capacity(self):
+        waypoints = create_waypoints()
+        cache = PathCache(AStar(waypoints), capacity=3)
+        for i in range(5):
+            cache.search(0, 20 + i)
+        self.assertEqual(3, len(cache))
+        self.assertEqual({(0, 22), (0, 23), (0, 24)}, set(cache._paths))
+        cache.search(0, 22)
+        cache.search(0, 30)
+        self.assertEqual({(0, 22), (0, 24), (0, 30)}, set(cache._paths))
+        self.assertEqual({22: {0}, 24: {0}, 30: {0}}, cache._starts)
+
+    def test_version(self):
+        waypoints = WayPoints()
+        waypoints.add_edge_pos((0, 0, 0), (1, 0, 0))
+        waypoints.add_edge_pos((5, 0, 0), (6, 0, 0))
+        cache = PathCache(AStar(waypoints))
+        self.assertIsNone(cache.search(0, 3))
+        self.assertIsNone(cache.search(0, 3))
+        version = waypoints.version
+        waypoints.add_edge(0, 1)
+        self.assertEqual(version, waypoints.version)
+        waypoints.add_edge(1, 2)
+        self.assertEqual(version + 1, waypoints.version)
+        self.assertEqual([0, 1, 2, 3], cache.search(0, 3))
+        waypoints.remove_edge(2, 1)
+        self.assertIsNone(cache.search(0, 3))
+        self.assertEqual((1, 0, 3, 2), cache.cache_info()[:4])
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestPathCacheBenchmark(unittest.TestCase):
+    """
+    level03 followers, 119 requests
+    AStar                   0.025 sec
+    PathCache( 16)         0.0259 sec  hits    1  suffix hits    0  misses  118
+    PathCache( 64)         0.0274 sec  hits    1  suffix hits    0  misses  118
+    PathCache(256)         0.0259 sec  hits    1  suffix hits    0  misses  118
+
+    level03 re-planning, 465 requests
+    AStar                  0.3255 sec
+    PathCache( 16)           0.11 sec  hits    9  suffix hits  368  misses   88
+    PathCache( 64)         0.1099 sec  hits   26  suffix hits  356  misses   83
+    PathCache(256)         0.1086 sec  hits   84  suffix hits  305  misses   76
+    """
+
+    def test_benchmark(self):
+        """a chain of five followers behind a player, like Agents.set_follow at 10 fps"""
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+        waypoints = chunk.waypoints
+        astar = AStar(waypoints)
+        rnd = random.Random(23)
+        # the player walks between random goals
+        player_path = []
+        while len(player_path) < 300:
+            path = astar.search(player_path[-1] if player_path else 0, rnd.randrange(waypoints.num_nodes))
+            player_path += (path or [])[1:]
+
+        requests = []
+        agents = [player_path[0]] * 6
+        paths = [[]] * 6
+        timers = [0.] * 6
+        for frame in range(len(player_path) * 2):
+            agents[0] = player_path[frame // 2]
+            for i in range(1, 6):
+                timers[i] -= .1
+                if timers[i] <= 0:
+                    x, y, z = waypoints.id_to_pos[agents[i - 1]]
+                    goal = waypoints.closest_node((
+                        x + rnd.randint(1, 3) * rnd.choice((-1, 1)),
+                        y + rnd.randint(1, 3) * rnd.choice((-1, 1)),
+                        z,
+                    ))
+                    requests.append((agents[i], goal))
+                    paths[i] = astar.search(agents[i], goal) or [agents[i]]
+                    timers[i] = rnd.uniform(1, 4)
+                if len(paths[i]) > 1 and frame % 2:
+                    paths[i] = paths[i][1:]
+                agents[i] = paths[i][0]
+
+        self.run_requests("followers", waypoints, requests)
+
+        # agents walking to a few goals and re-planning every 5 steps
+        requests = []
+        goals = [rnd.randrange(waypoints.num_nodes) for i in range(3)]
+        for i in range(50):
+            node, goal = rnd.randrange(waypoints.num_nodes), rnd.choice(goals)
+            while True:
+                requests.append((node, goal))
+                path = astar.search(node, goal)
+                if not path or len(path) < 6:
+                    break
+                node = path[5]
+        self.run_requests("re-planning", waypoints, requests)
+
+    def run_requests(self, name, waypoints, requests):
+        print(f"\nlevel03 {name}, {len(requests)} requests")
+        astar = AStar(waypoints)
+        with Timer(len(requests)) as timer:
+            for start, end in requests:
+                astar.search(start, end)
+        print(f"AStar                {timer.seconds():8} sec")
+        for capacity in (16, 64, 256):
+            cache = PathCache(AStar(waypoints), capacity=capacity)
+            with Timer(len(requests)) as timer:
+                for start, end in requests:
+                    cache.search(start, end)
+            info = cache.cache_info()
+            print(
+                f"PathCache({capacity:3})       {timer.seconds():8} sec"
+                f"  hits {info.hits:4}  suffix hits {info.suffix_hits:4}  misses {info.misses:4}"
+            )
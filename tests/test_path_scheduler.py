@@ -0,0 +1,108 @@
+import unittest
+
+from lib.ai import AStar, PathCache, PathScheduler, WayPoints
+from tests.test_astar import create_waypoints, random_node_pairs
+
+
+class TestAStarSearch(unittest.TestCase):
+
+    def test_compare_search(self):
+        waypoints = create_waypoints()
+        astar = AStar(waypoints)
+        for start, end in random_node_pairs(waypoints, 20):
+            search = astar.search_incremental(start, end)
+            num_steps = 0
+            while not search.step(7):
+                num_steps += 1
+            self.assertEqual(astar.search(start, end), search.path)
+            self.assertEqual(astar.num_expanded, search.num_expanded)
+            self.assertEqual(num_steps, search.num_expanded // 7)
+            self.assertTrue(search.step())
+
+
+class TestPathScheduler(unittest.TestCase):
+
+    def test_budget(self):
+        waypoints = create_waypoints()
+        astar = AStar(waypoints)
+        scheduler = PathScheduler(astar, max_expansions=20, step_size=5)
+        pairs = random_node_pairs(waypoints, 10)
+        for i, (start, end) in enumerate(pairs):
+            scheduler.request(i, start, end)
+        self.assertEqual(10, len(scheduler))
+
+        results = dict()
+        num_updates = 0
+        while len(scheduler):
+            for request in scheduler.update():
+                results[request.name] = request.path
+            num_updates += 1
+
+        total_expanded = 0
+        for i, (start, end) in enumerate(pairs):
+            self.assertEqual(astar.search(start, end), results[i])
+            total_expanded += astar.num_expanded
+        self.assertGreaterEqual(num_updates, total_expanded // 20)
+        # requests are solved in order
+        self.assertEqual(list(range(10)), list(results))
+
+    def test_supersede(self):
+        waypoints = create_waypoints()
+        scheduler = PathScheduler(AStar(waypoints), max_expansions=5)
+        scheduler.request("a", 0, 100)
+        scheduler.update()
+        self.assertTrue(scheduler.is_pending("a"))
+        # same request is kept
+        request = scheduler.request("a", 0, 100)
+        self.assertIs(request, scheduler.request("a", 0, 100))
+        self.assertIsNotNone(request.search)
+        scheduler.request("a", 0, 50)
+        scheduler.request("b", 0, 60)
+        self.assertEqual(1, scheduler.num_superseded)
+        self.assertEqual(2, len(scheduler))
+
+        results = []
+        while len(scheduler):
+            results += scheduler.update(max_expansions=1000)
+        self.assertEqual([("a", 50), ("b", 60)], [(r.name, r.end_node) for r in results])
+        self.assertFalse(request.finished)
+
+        scheduler.request("c", 0, 60)
+        scheduler.cancel("c")
+        self.assertEqual([], scheduler.update())
+
+    def test_priority(self):
+        waypoints = create_waypoints()
+        scheduler = PathScheduler(AStar(waypoints), max_expansions=1000)
+        scheduler.request("a", 0, 100)
+        scheduler.request("b", 0, 101)
+        request_a = scheduler.request("a", 0, 100)
+        scheduler.request("player", 0, 102, priority=1)
+        results = []
+        while not results:
+            results = scheduler.update(max_expansions=1)
+        self.assertEqual(["player"], [r.name for r in results])
+        self.assertIsNone(request_a.search)
+        # raising the priority of a queued request
+        scheduler.request("b", 0, 101, priority=2)
+        self.assertEqual(["b", "a"], [r.name for r in scheduler.update()])
+
+    def test_version_and_cache(self):
+        waypoints = WayPoints()
+        waypoints.add_edge_pos((0, 0, 0), (1, 0, 0))
+        waypoints.add_edge_pos((1, 0, 0), (2, 0, 0))
+        waypoints.add_edge_pos((2, 0, 0), (3, 0, 0))
+        astar = AStar(waypoints)
+        cache = PathCache(astar)
+        scheduler = PathScheduler(astar, cache=cache, max_expansions=1, step_size=1)
+        scheduler.request("a", 0, 3)
+        self.assertEqual([], scheduler.update())
+        waypoints.add_edge(0, 3)
+        results = []
+        while len(scheduler):
+            results += scheduler.update()
+        self.assertEqual([0, 3], results[0].path)
+
+        scheduler.request("b", 0, 3)
+        self.assertEqual([0, 3], scheduler.update()[0].path)
+        self.assertEqual(1, cache.cache_info().hits)
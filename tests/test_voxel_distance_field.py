@@ -0,0 +1,190 @@
+import os
+import unittest
+
+import numpy as np
+from pyglet import gl
+
+from lib.world import VoxelDistanceField
+from tests.util import Timer
+
+
+def create_field(occupancy, method, scale=1):
+    vdf = VoxelDistanceField.from_occupancy(occupancy, scale)
+    vdf.calc_distances_by_name(method)
+    return vdf
+
+
+class TestVoxelDistanceField(unittest.TestCase):
+
+    def test_from_occupancy(self):
+        occupancy = np.random.RandomState(23).rand(3, 4, 5) < .3
+        vdf = VoxelDistanceField.from_occupancy(occupancy, scale=2)
+        self.assertEqual((10, 8, 6), vdf.size())
+        np.testing.assert_array_equal(
+            np.kron(occupancy, np.ones((2, 2, 2))) > 0,
+            vdf.occupancy()
+        )
+        for x, y, z in ((0, 0, 0), (9, 7, 5), (3, 2, 1)):
+            self.assertEqual(int(occupancy[z // 2, y // 2, x // 2]), vdf.value(x, y, z))
+
+    def test_single_voxel(self):
+        # the example from VoxelDistanceField.__main__
+        occupancy = np.zeros((2, 10, 10))
+        occupancy[1, 5, 5] = 1
+        edt = create_field(occupancy, "edt").distance_array()
+        np.testing.assert_allclose(edt, create_field(occupancy, "exact_superslow").distance_array())
+        np.testing.assert_allclose(edt, create_field(occupancy, "dead_reckoning").distance_array())
+        self.assertEqual(0., edt[1, 5, 5])
+        self.assertAlmostEqual(np.sqrt(1 + 4 + 9), edt[0, 3, 8], places=6)
+
+    def test_compare_exact(self):
+        rnd = np.random.RandomState(42)
+        for i in range(3):
+            occupancy = rnd.rand(4, 6, 7) < .15
+            edt = create_field(occupancy, "edt").distance_array()
+            exact = create_field(occupancy, "exact_superslow").distance_array()
+            # exact_superslow is unsigned and zero inside
+            np.testing.assert_allclose(exact[~occupancy], edt[~occupancy], rtol=1e-6)
+            self.assertTrue(np.all(edt[occupancy] <= 0.))
+
+    def test_inside(self):
+        occupancy = np.zeros((7, 7, 7))
+        occupancy[1:6, 1:6, 1:6] = 1
+        edt = create_field(occupancy, "edt").distance_array()
+        self.assertEqual(0., edt[1, 3, 3])
+        self.assertEqual(-1., edt[2, 3, 3])
+        self.assertEqual(-2., edt[3, 3, 3])
+        self.assertEqual(1., edt[0, 3, 3])
+        # the field border counts as empty space
+        occupancy = np.ones((3, 3, 3))
+        edt = create_field(occupancy, "edt").distance_array()
+        self.assertEqual(-1., edt[1, 1, 1])
+        self.assertEqual(0., edt[0, 1, 1])
+
+    def test_empty(self):
+        edt = create_field(np.zeros((2, 3, 4)), "edt").distance_array()
+        self.assertTrue(np.all(edt > 4.))
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            create_field(np.zeros((1, 1, 1)), "magic")
+
+
+class TestVoxelDistanceFieldUpdate(unittest.TestCase):
+
+    def assert_update(self, occupancy, box_min, box_max, value, scale=1):
+        vdf = create_field(occupancy, "edt", scale=scale)
+        (x0, y0, z0), (x1, y1, z1) = box_min, box_max
+        occupancy[z0:z1, y0:y1, x0:x1] = value
+        changed_min, changed_max = vdf.update_occupancy(occupancy, box_min, box_max)
+
+        expected = create_field(occupancy, "edt", scale=scale)
+        np.testing.assert_array_equal(expected.occupancy(), vdf.occupancy())
+        np.testing.assert_array_equal(expected.distance_array(), vdf.distance_array())
+        for i in range(3):
+            self.assertLessEqual(changed_min[i], box_min[i] * scale)
+            self.assertGreaterEqual(changed_max[i], min(box_max[i], occupancy.shape[2 - i]) * scale)
+        return changed_min, changed_max
+
+    def test_random_edits(self):
+        rnd = np.random.RandomState(23)
+        for i in range(30):
+            size = rnd.randint(2, 12, size=3)
+            occupancy = rnd.rand(*size) < rnd.choice([.05, .2, .6, .95])
+            box_min = tuple(rnd.randint(0, s) for s in reversed(size))
+            box_max = tuple(b + rnd.randint(1, 4) for b in box_min)
+            with self.subTest(i=i, size=size, box=(box_min, box_max)):
+                self.assert_update(occupancy, box_min, box_max, rnd.rand() < .5, scale=1 + i % 2)
+
+    def test_local(self):
+        occupancy = np.zeros((8, 32, 32))
+        occupancy[0] = 1
+        # a new voxel only changes the voxels that are closer to it than to the floor
+        changed_min, changed_max = self.assert_update(occupancy, (10, 10, 1), (11, 11, 2), 1)
+        self.assertEqual((5, 5, 0), changed_min)
+        self.assertEqual((16, 16, 8), changed_max)
+        changed_min, changed_max = self.assert_update(occupancy, (10, 10, 1), (11, 11, 2), 0)
+        self.assertEqual((5, 5, 0), changed_min)
+        self.assertEqual((16, 16, 8), changed_max)
+
+    def test_remove_last(self):
+        occupancy = np.zeros((3, 4, 5))
+        occupancy[1, 2, 3] = 1
+        self.assert_update(occupancy, (3, 2, 1), (4, 3, 2), 0)
+        self.assert_update(occupancy, (3, 2, 1), (4, 3, 2), 1)
+
+    def test_update_texture3d(self):
+        def _read(tex):
+            values = np.zeros(vdf.size()[::-1], dtype="float32")
+            tex.bind()
+            gl.glGetTexImage(tex.target, 0, gl.GL_RED, gl.GL_FLOAT, np.ctypeslib.as_ctypes(values.reshape(-1)))
+            return values
+
+        occupancy = np.random.RandomState(5).rand(5, 7, 9) < .2
+        vdf = create_field(occupancy, "edt")
+        tex = vdf.create_texture3d()
+        before = _read(tex)
+        occupancy[1:3, 2:5, 3:4] = True
+        changed_min, changed_max = vdf.update_occupancy(occupancy, (3, 2, 1), (4, 5, 3))
+        vdf.update_texture3d(tex, changed_min, changed_max)
+
+        expected = _read(create_field(occupancy, "edt").create_texture3d())
+        self.assertTrue(np.any(before != expected))
+        np.testing.assert_array_equal(expected, _read(tex))
+
+    def test_empty_box(self):
+        vdf = create_field(np.ones((2, 3, 4)), "edt")
+        self.assertEqual(((4, 0, 0), (4, 0, 0)), vdf.update_distances_edt((4, 0, 0), (6, 1, 1)))
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestVoxelDistanceFieldBenchmark(unittest.TestCase):
+    """
+    16x16x8        edt                   0.001 total sec
+    16x16x8        dead_reckoning       0.3159 total sec
+    16x16x8        exact_superslow      0.0741 total sec
+    48x48x8        edt                  0.0089 total sec
+    48x48x8        dead_reckoning       2.4489 total sec
+
+    64x64x16       scale 1 full recalc          0.0233 sec/edit
+    64x64x16       scale 1 update_occupancy     0.0016 sec/edit
+    64x64x16       scale 2 full recalc          0.2245 sec/edit
+    64x64x16       scale 2 update_occupancy     0.0087 sec/edit
+    """
+
+    def test_benchmark(self):
+        rnd = np.random.RandomState(1)
+        print()
+        for size, methods in (
+                ((8, 16, 16), VoxelDistanceField.METHODS),
+                ((8, 48, 48), ("edt", "dead_reckoning")),
+        ):
+            occupancy = rnd.rand(*size) < .1
+            for method in methods:
+                with Timer() as timer:
+                    create_field(occupancy, method)
+                name = "x".join(str(s) for s in reversed(size))
+                print(f"{name:14} {method:16} {timer.seconds():10} total sec")
+
+    def test_benchmark_update(self):
+        rnd = np.random.RandomState(1)
+        print()
+        for size, scale in (((16, 64, 64), 1), ((16, 64, 64), 2)):
+            occupancy = np.zeros(size, dtype="bool")
+            occupancy[:2] = True
+            occupancy[2:] = rnd.rand(size[0] - 2, *size[1:]) < .05
+            vdf = create_field(occupancy, "edt", scale)
+            edits = [tuple(rnd.randint(0, s) for s in reversed(size)) for i in range(20)]
+
+            with Timer(len(edits)) as timer:
+                for pos in edits:
+                    occupancy[pos[::-1]] = ~occupancy[pos[::-1]]
+                    create_field(occupancy, "edt", scale)
+            name = "x".join(str(s) for s in reversed(size))
+            print(f"{name:14} scale {scale} full recalc      {timer.spf():10} sec/edit")
+
+            with Timer(len(edits)) as timer:
+                for pos in edits:
+                    occupancy[pos[::-1]] = ~occupancy[pos[::-1]]
+                    vdf.update_occupancy(occupancy, pos, tuple(p + 1 for p in pos))
+            print(f"{name:14} scale {scale} update_occupancy {timer.spf():10} sec/edit")
@@ -0,0 +1,131 @@
+import math
+import os
+import random
+import unittest
+
+from lib.ai import WayPoints, WayPointsIndex
+from lib.world import WorldChunk, Tileset
+from tests.test_astar import create_waypoints
+from tests.util import Timer
+
+
+def random_positions(num, seed=23):
+    rnd = random.Random(seed)
+    return [
+        (rnd.uniform(-5, 25), rnd.uniform(-5, 20), rnd.uniform(0, 4))
+        for i in range(num)
+    ]
+
+
+class TestWayPointsIndex(unittest.TestCase):
+
+    def distances(self, waypoints, pos, manhattan=False):
+        result = []
+        for node, p in waypoints.id_to_pos.items():
+            if manhattan:
+                d = sum(abs(a - b) for a, b in zip(pos, p))
+            else:
+                d = math.sqrt(sum((a - b) ** 2 for a, b in zip(pos, p)))
+            result.append((d, node))
+        return sorted(result)
+
+    def test_closest_node(self):
+        waypoints = create_waypoints()
+        for pos in random_positions(50):
+            pos = tuple(int(p) for p in pos)
+            node = waypoints.closest_node(pos)
+            expected = waypoints.closest_node_old(pos)
+            self.assertAlmostEqual(
+                sum(abs(a - b) for a, b in zip(pos, waypoints.id_to_pos[expected])),
+                sum(abs(a - b) for a, b in zip(pos, waypoints.id_to_pos[node])),
+            )
+        self.assertEqual(5, waypoints.closest_node(waypoints.id_to_pos[5]))
+
+    def test_nearest_and_radius(self):
+        waypoints = create_waypoints()
+        for pos in random_positions(30):
+            expected = self.distances(waypoints, pos)
+            for k in (1, 5, 20):
+                self.assertEqual(
+                    [n for d, n in expected[:k]],
+                    waypoints.nearest_nodes(pos, k),
+                )
+            for radius in (.5, 3, 10):
+                self.assertEqual(
+                    [n for d, n in expected if d <= radius],
+                    waypoints.nodes_in_radius(pos, radius),
+                )
+        self.assertEqual(waypoints.num_nodes, len(waypoints.nearest_nodes((0, 0, 0), 100000)))
+
+    def test_update(self):
+        waypoints = WayPoints()
+        self.assertIsNone(waypoints.closest_node((1, 2, 3)))
+        self.assertEqual([], waypoints.nearest_nodes((1, 2, 3), 3))
+        waypoints.add_edge_pos((0, 0, 0), (1, 0, 0))
+        self.assertEqual(2, len(waypoints.index))
+        self.assertEqual(1, waypoints.closest_node((30, 0, 0)))
+        # nodes added after the index was built
+        waypoints.add_edge_pos((1, 0, 0), (40, 0, 0))
+        self.assertEqual(3, len(waypoints.index))
+        self.assertEqual(2, waypoints.closest_node((30, 0, 0)))
+        self.assertEqual([2, 1], waypoints.nodes_in_radius((30, 0, 0), 29.5))
+
+    def test_skip_nodes_without_edges(self):
+        waypoints = WayPoints()
+        for x in range(5):
+            waypoints.add_edge_pos((x, 0, 0), (x + 1, 0, 0))
+        n2, n3, n4 = (waypoints.pos_to_id[(x, 0, 0)] for x in (2, 3, 4))
+        waypoints.remove_edge(n2, n3)
+        waypoints.remove_edge(n3, n4)
+        self.assertIn((3, 0, 0), waypoints.pos_to_id)
+        self.assertIn(waypoints.closest_node((3, 0, 0)), (n2, n4))
+        self.assertEqual(n4, waypoints.closest_node((4, 0, 1)))
+        self.assertNotIn(n3, waypoints.nearest_nodes((3, 0, 0), 10))
+        self.assertEqual(5, len(waypoints.nearest_nodes((3, 0, 0), 10)))
+        self.assertEqual([n2, n4], sorted(waypoints.nodes_in_radius((3, 0, 0), 1)))
+
+    def test_index(self):
+        index = WayPointsIndex(cell_size=2)
+        index.add(0, (-3, -3, 0))
+        index.add(1, (10, 0, 0))
+        self.assertEqual([(5., 1)], index.nearest((5, 0, 0), 1))
+        self.assertEqual([(5., 1), (11., 0)], index.nearest((5, 0, 0), 2, manhattan=True))
+        self.assertEqual([], index.in_radius((5, 0, 0), 4.9))
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestWayPointsIndexBenchmark(unittest.TestCase):
+    """
+    level03 5027 nodes
+    build index                         0.0143 sec
+    closest_node_old ()       0.0951 sec      1051.06 queries/sec
+    closest_node     ()       0.0484 sec     20640.04 queries/sec
+    nearest_nodes    (10,)    0.1271 sec      7866.14 queries/sec
+    nodes_in_radius  (5,)     0.0907 sec     11031.23 queries/sec
+    """
+
+    def test_benchmark(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+        waypoints = chunk.waypoints
+        width, height, depth = chunk.size()
+        rnd = random.Random(23)
+        positions = [
+            (rnd.randrange(width), rnd.randrange(height), rnd.randrange(depth))
+            for i in range(1000)
+        ]
+        print(f"\nlevel03 {waypoints.num_nodes} nodes")
+        with Timer() as timer:
+            waypoints.index
+        print(f"build index {timer.seconds():30} sec")
+        for name, args in (
+                ("closest_node_old", ()),
+                ("closest_node", ()),
+                ("nearest_nodes", (10,)),
+                ("nodes_in_radius", (5,)),
+        ):
+            num = 100 if name == "closest_node_old" else len(positions)
+            with Timer(num) as timer:
+                for pos in positions[:num]:
+                    getattr(waypoints, name)(pos, *args)
+            print(f"{name:16} {str(args):6} {timer.seconds():8} sec {timer.fps():12} queries/sec")
@@ -0,0 +1,264 @@
+import os
+import threading
+import time
+import unittest
+from functools import partial
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from lib.gen import *
+from lib.gen.worker import _to_shared, _from_shared, _SharedArray
+from tests.util import Timer, assert_numpy_equal
+
+
+def _array(size: int, value: float = 1.):
+    return np.full((size, size), value)
+
+
+def _fail():
+    raise ValueError("expected failure")
+
+
+def _sample_misses(sampler, x: int, y: int):
+    """Sample and return the result and the number of cache misses in the worker process"""
+    return sampler(x, y, 16, 16), sampler.cache_info().misses
+
+
+def wait_for(future, timeout=20.):
+    return future.result(timeout=timeout)
+
+
+class TestWorker(unittest.TestCase):
+
+    def test_thread_futures(self):
+        worker = Worker("test-thread")
+        worker.start()
+        try:
+            results = []
+            event = threading.Event()
+
+            def _callback(result, extra):
+                results.append((result, extra))
+                event.set()
+
+            future = worker.request("a", partial(_array, 4), extra="x", callback=_callback)
+            assert_numpy_equal(_array(4), wait_for(future))
+            self.assertTrue(event.wait(10))
+            self.assertEqual("x", results[0][1])
+
+            # the polling API still works
+            result = worker.pop_result("a")
+            assert_numpy_equal(_array(4), result["result"])
+            self.assertEqual("x", result["extra"])
+            self.assertIsNone(worker.pop_result("a"))
+
+            # the worker survives failing requests
+            with self.assertRaises(ValueError):
+                wait_for(worker.request("b", _fail))
+            self.assertIsNone(worker.pop_result("b"))
+            self.assertEqual(3, wait_for(worker.request("c", lambda: 3)))
+        finally:
+            worker.stop()
+
+    def test_process_backend(self):
+        worker = Worker("test-process", backend="process", max_workers=2)
+        # requests wait for start
+        small = worker.request("small", partial(_array, 4, 2.), extra=1)
+        worker.start()
+        try:
+            large = worker.request("large", partial(_array, 512, 3.), extra=2)
+            assert_numpy_equal(_array(4, 2.), wait_for(small))
+            assert_numpy_equal(_array(512, 3.), wait_for(large))
+            self.assertEqual(2, worker.pop_result("large")["extra"])
+
+            with self.assertRaises(ValueError):
+                wait_for(worker.request("fail", _fail))
+
+            # lambdas can not be sent to processes
+            with self.assertRaises(Exception):
+                wait_for(worker.request("lambda", lambda: 1))
+        finally:
+            worker.stop()
+        self.assertFalse(worker.is_running)
+
+    def test_process_sampler_cache(self):
+        sampler = NoiseSampler2D(resolution=4, block_size=16, cache=BlockCache())
+        worker = Worker("test-process-sampler", backend="process", max_workers=1)
+        worker.start()
+        try:
+            block, misses = wait_for(worker.request("a", partial(_sample_misses, sampler, 0, 0)))
+            assert_numpy_equal(sampler(0, 0, 16, 16), block)
+            self.assertEqual(1, misses)
+            # the worker process kept the blocks of the previous request
+            block, misses = wait_for(worker.request("b", partial(_sample_misses, sampler, 8, 0)))
+            assert_numpy_equal(sampler(8, 0, 16, 16), block)
+            self.assertEqual(2, misses)
+
+            # a cleared sampler starts a new cache in the worker process
+            sampler.clear_cache()
+            block, misses = wait_for(worker.request("c", partial(_sample_misses, sampler, 0, 0)))
+            self.assertEqual(1, misses)
+        finally:
+            worker.stop()
+
+    def test_shared_memory_released(self):
+        value = (_array(200), [np.arange(3)], {"a": _array(300, 2.)})
+        shared = _to_shared(value, min_bytes=1000)
+        self.assertIsInstance(shared[0], _SharedArray)
+        self.assertIsInstance(shared[1][0], np.ndarray)
+        names = [shared[0].name, shared[2]["a"].name]
+
+        restored = _from_shared(shared)
+        assert_numpy_equal(value[0], restored[0])
+        assert_numpy_equal(value[1][0], restored[1][0])
+        assert_numpy_equal(value[2]["a"], restored[2]["a"])
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)
+
+    def test_priority(self):
+        worker, release = self.blocked_worker()
+        order = []
+        futures = [
+            worker.request(name, partial(order.append, name), priority=priority)
+            for name, priority in (("low", -1), ("normal1", 0), ("high", 5), ("normal2", 0))
+        ]
+        release()
+        for f in futures:
+            wait_for(f)
+        worker.stop()
+        self.assertEqual(["high", "normal1", "normal2", "low"], order)
+
+    def test_coalesce_and_cancel(self):
+        worker, release = self.blocked_worker()
+        order = []
+        first = worker.request("map", partial(order.append, 1), extra=1)
+        second = worker.request("map", partial(order.append, 2), extra=2)
+        other = worker.request("other", partial(order.append, 3))
+        self.assertTrue(first.cancelled())
+        self.assertEqual(1, worker.num_coalesced)
+        self.assertEqual(2, worker.num_queued)
+
+        self.assertTrue(worker.cancel("other"))
+        self.assertFalse(worker.cancel("unknown"))
+        self.assertTrue(other.cancelled())
+        release()
+        wait_for(second)
+        worker.stop()
+        self.assertEqual([2], order)
+        self.assertEqual(2, worker.pop_result("map")["extra"])
+
+    def test_cancel_running(self):
+        worker, release = self.blocked_worker()
+        future = worker.request("late", lambda: 1)
+        # the blocking request is running
+        self.assertTrue(worker.cancel("block"))
+        release()
+        wait_for(future)
+        worker.stop()
+        self.assertIsNone(worker.pop_result("block"))
+        self.assertEqual(1, worker.pop_result("late")["result"])
+
+    def test_bounded_results(self):
+        worker = Worker("test-results", max_results=3)
+        worker.start()
+        try:
+            for i in range(5):
+                wait_for(worker.request(str(i), partial(int, i)))
+        finally:
+            worker.stop()
+        self.assertEqual(2, worker.num_dropped_results)
+        self.assertIsNone(worker.pop_result("1"))
+        self.assertEqual(4, worker.pop_result("4")["result"])
+
+    def test_num_threads(self):
+        worker = Worker("test-threads", num_threads=3)
+        worker.start()
+        barrier = threading.Barrier(3, timeout=10)
+        try:
+            # would time out if the requests did not run at the same time
+            futures = [worker.request(str(i), barrier.wait) for i in range(3)]
+            self.assertEqual([0, 1, 2], sorted(wait_for(f) for f in futures))
+        finally:
+            worker.stop()
+        self.assertFalse(worker.is_running)
+
+    def blocked_worker(self):
+        """Returns a started Worker whose thread is busy with request "block" and the function to release it"""
+        worker = Worker("test-blocked")
+        started, event = threading.Event(), threading.Event()
+
+        def _block():
+            started.set()
+            event.wait(10)
+
+        worker.request("block", _block)
+        worker.start()
+        self.assertTrue(started.wait(10))
+        return worker, event.set
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            Worker("test", backend="fiber")
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestWorkerBenchmark(unittest.TestCase):
+    """
+    on a machine with 1 CPU, where the processes compete with the main thread for the core:
+    thread   20 map windows in 5.56 sec, main thread 19,528 loops/sec
+    process  20 map windows in 4.18 sec, main thread 12,906 loops/sec
+
+    a new window every frame:
+    coalesce False latest window after 2.84 sec, 60 of 60 computed
+    coalesce True  latest window after 1.29 sec, 5 of 60 computed
+    """
+
+    def test_render_thread_stalls(self):
+        from tilegame.map import TilemapSampler
+
+        for backend in Worker.BACKENDS:
+            worker = Worker("benchmark", backend=backend)
+            worker.start()
+            try:
+                sampler = TilemapSampler(cache=BlockCache())
+                futures = [
+                    worker.request(str(i), partial(sampler, i * 64, 0, 96, 96))
+                    for i in range(20)
+                ]
+                # a python loop standing in for the render thread
+                num_loops = 0
+                with Timer() as timer:
+                    while not all(f.done() for f in futures):
+                        sum(range(1000))
+                        num_loops += 1
+            finally:
+                worker.stop()
+            print(
+                f"\n{backend:8} 20 map windows in {timer.seconds():.2f} sec,"
+                f" main thread {num_loops / timer.seconds():,.0f} loops/sec"
+            )
+
+    def test_bursts(self):
+        from tilegame.map import TilemapSampler
+
+        for coalesce in (False, True):
+            worker = Worker("benchmark")
+            worker.start()
+            try:
+                sampler = TilemapSampler(cache=BlockCache())
+                # the camera moves every frame and requests a new window
+                futures = []
+                with Timer() as timer:
+                    for i in range(60):
+                        id = "map" if coalesce else f"map-{i}"
+                        futures.append(worker.request(id, partial(sampler, i * 32, 0, 128, 96)))
+                        time.sleep(1. / 60.)
+                    futures[-1].result()
+            finally:
+                worker.stop()
+            num_run = sum(1 for f in futures if not f.cancelled())
+            print(
+                f"\ncoalesce {coalesce!s:5} latest window after {timer.seconds():.2f} sec, {num_run} of 60 computed"
+            )
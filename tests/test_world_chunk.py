@@ -0,0 +1,485 @@
+import os
+import random
+import unittest
+
+import numpy as np
+
+from lib.world import WorldChunk, TiledImport, Tileset
+from tests.util import Timer
+
+
+def create_tiled(layers, width, height):
+    tiled = TiledImport()
+    tiled.width = width
+    tiled.height = height
+    tiled.layers = layers
+    return tiled
+
+
+def create_chunk(layers, width, height):
+    tileset = Tileset(16, 16)
+    tileset.width = tileset.height = 4
+    tileset.num_tiles = 16
+    chunk = WorldChunk(tileset)
+    chunk.from_tiled(create_tiled(layers, width, height))
+    return chunk
+
+
+def create_random_chunk(width, height, depth, probability=.3, seed=23):
+    rnd = random.Random(seed)
+    layers = [
+        [rnd.randrange(1, 17) if rnd.random() < probability else 0 for i in range(width * height)]
+        for z in range(depth)
+    ]
+    return create_chunk(layers, width, height)
+
+
+class TestWorldChunk(unittest.TestCase):
+
+    def test_from_tiled(self):
+        chunk = create_chunk(
+            [
+                [1, 2, 3,
+                 0, 5, 6],
+                [0, 0, 0,
+                 7, 0, 0],
+            ],
+            width=3, height=2,
+        )
+        self.assertEqual((3, 2, 2), chunk.size())
+        # tiled rows are flipped
+        self.assertEqual(
+            [[[0, 1, 1], [1, 1, 1]],
+             [[1, 0, 0], [0, 0, 0]]],
+            chunk.space_type.tolist()
+        )
+        self.assertEqual(
+            [[[0, 4, 5], [0, 1, 2]],
+             [[6, 0, 0], [0, 0, 0]]],
+            chunk.texture.tolist()
+        )
+        # border stays empty
+        self.assertEqual(
+            int(chunk.space_type.sum()),
+            int(chunk.padded_space_type.sum())
+        )
+
+    def test_block(self):
+        chunk = create_chunk([[0, 3, 0, 0]], width=2, height=2)
+        self.assertEqual(1, chunk.block(1, 1, 0).space_type)
+        self.assertEqual(2, chunk.block(1, 1, 0).texture)
+        self.assertEqual(0, chunk.block(0, 1, 0).space_type)
+        self.assertEqual(0, chunk.block(-1, 0, 0).space_type)
+        self.assertEqual(0, chunk.block(0, 0, 5).space_type)
+        self.assertTrue(chunk.is_occupied(1, 1, 0))
+        self.assertFalse(chunk.is_occupied(1, 2, 0))
+
+        chunk.set_block(0, 0, 0, 1, 7)
+        self.assertEqual(7, chunk.block(0, 0, 0).texture)
+        self.assertTrue(chunk.is_occupied(0, 0, 0))
+        with self.assertRaises(IndexError):
+            chunk.set_block(2, 0, 0, 1)
+
+    def test_from_heightmap(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.tileset.num_tiles = 4
+        chunk.from_heightmap([[0, 2], [1, 0]])
+        self.assertEqual((2, 2, 3), chunk.size())
+        self.assertEqual(
+            [[[1, 1], [1, 1]],
+             [[0, 1], [1, 0]],
+             [[0, 1], [0, 0]]],
+            chunk.space_type.tolist()
+        )
+        self.assertEqual(0, chunk.texture[0, 0, 0])
+        self.assertTrue(np.all(chunk.texture[chunk.occupancy() & (chunk.texture != 0)] < 4))
+
+    def test_density(self):
+        chunk = create_chunk([[1] * 9] * 3, width=3, height=3)
+        self.assertEqual(1., chunk.density_at(1, 1, 1))
+        self.assertEqual(8. / 27., chunk.density_at(0, 0, 0))
+        self.assertEqual(0., chunk.density_at(-2, 0, 0))
+
+    def test_density_volume(self):
+        chunk = create_random_chunk(6, 5, 4, probability=.5)
+        volume = chunk.density_volume()
+        for z in range(chunk.num_z):
+            for y in range(chunk.num_y):
+                for x in range(chunk.num_x):
+                    self.assertEqual(chunk.density_at(x, y, z), volume[z, y, x])
+
+    def test_ambient_table(self):
+        chunk = create_random_chunk(6, 5, 4, probability=.5)
+        table = chunk.ambient_table()
+        self.assertEqual((5, 6, 7), table.shape)
+        for z in range(chunk.num_z + 1):
+            for y in range(chunk.num_y + 1):
+                for x in range(chunk.num_x + 1):
+                    self.assertEqual(chunk.get_ambient_color(x, y, z)[0], table[z, y, x], f"at {x}, {y}, {z}")
+
+        # changes are picked up
+        density = chunk.density_volume()[3, 2, 2]
+        chunk.set_block(2, 2, 3, 0 if chunk.is_occupied(2, 2, 3) else 1)
+        self.assertNotEqual(density, chunk.density_volume()[3, 2, 2])
+        self.assertEqual(chunk.get_ambient_color(2, 2, 0)[0], chunk.ambient_table()[0, 2, 2])
+        self.assertEqual(chunk.density_at(2, 2, 3), chunk.density_volume()[3, 2, 2])
+
+
+class TestWorldChunkMesh(unittest.TestCase):
+
+    def assert_mesh_equal(self, chunk, do_ambient):
+        expected = chunk.create_mesh_old(do_ambient=do_ambient)
+        mesh = chunk.create_mesh(do_ambient=do_ambient)
+
+        self.assertEqual(len(expected.triangles_array()) // 3, mesh.num_triangles)
+        np.testing.assert_array_equal(
+            np.array(expected.vertices_array(), dtype="float32").reshape(-1, 3), mesh.vertices
+        )
+        np.testing.assert_array_equal(
+            np.array(expected.texcoords_array(), dtype="float32").reshape(-1, 2), mesh.texcoords
+        )
+        np.testing.assert_allclose(
+            np.array(expected.normals_array(), dtype="float32").reshape(-1, 3), mesh.normals
+        )
+        np.testing.assert_array_equal(
+            np.array(expected.triangles_array(), dtype="uint32").reshape(-1, 3), mesh.triangles
+        )
+        # TriangleMesh stores the default value for each vertex
+        #   followed by the six values that create_mesh_old adds per quad
+        ambient = np.array(expected.attributes_array("a_ambient"), dtype="float32")
+        np.testing.assert_array_equal(
+            ambient.reshape(-1, 12, 3)[:, 6:].reshape(-1, 3), mesh.attributes_array("a_ambient")
+        )
+
+    def test_mesh_single_voxel(self):
+        chunk = create_chunk([[0, 0, 0, 0, 5, 0, 0, 0, 0]], width=3, height=3)
+        mesh = chunk.create_mesh()
+        self.assertEqual(12, mesh.num_triangles)
+        self.assert_mesh_equal(chunk, do_ambient=False)
+        self.assert_mesh_equal(chunk, do_ambient=True)
+
+    def test_mesh_random(self):
+        for seed in range(3):
+            chunk = create_random_chunk(7, 6, 5, seed=seed)
+            self.assert_mesh_equal(chunk, do_ambient=False)
+            self.assert_mesh_equal(chunk, do_ambient=True)
+
+    def test_mesh_empty(self):
+        chunk = create_chunk([[0] * 4], width=2, height=2)
+        self.assertTrue(chunk.create_mesh().is_empty())
+
+
+class TestWorldChunkGreedyMesh(unittest.TestCase):
+
+    def covered_faces(self, chunk, mesh):
+        """Returns the set of (x, y, z, face, texture) covered by the quads of a greedy mesh"""
+        normals = chunk._face_normals()
+        uv_quads = {
+            tuple(np.float32(chunk.tileset.get_uv_quad(i)[0])): i
+            for i in range(chunk.tileset.num_tiles)
+        }
+        faces = set()
+        quads = mesh.vertices[mesh.triangles.reshape(-1, 6)].astype("int64")
+        tiles = mesh.attributes_array("a_tile")[mesh.triangles.reshape(-1, 6)]
+        for quad, normal, tile in zip(quads, mesh.normals[::4], tiles[:, 0]):
+            face = int(np.argmax(np.all(np.isclose(normals, normal), axis=1)))
+            texture = uv_quads[tuple(tile[:2])]
+            lo, hi = quad.min(axis=0), quad.max(axis=0)
+            axis = int(np.argmax(np.abs(normal)))
+            # voxel behind the face
+            if normal[axis] > 0:
+                lo[axis] -= 1
+            hi[axis] = lo[axis] + 1
+            for z in range(lo[2], hi[2]):
+                for y in range(lo[1], hi[1]):
+                    for x in range(lo[0], hi[0]):
+                        key = (x, y, z, face, texture)
+                        self.assertNotIn(key, faces)
+                        faces.add(key)
+        return faces
+
+    def assert_greedy_mesh(self, chunk, do_ambient):
+        mesh = chunk.create_mesh(do_ambient=do_ambient, greedy=True)
+        z, y, x, face = np.nonzero(chunk.exposed_faces())
+        expected = {
+            (int(x), int(y), int(z), int(f), int(chunk.texture[z, y, x]))
+            for z, y, x, f in zip(z, y, x, face)
+        }
+        self.assertEqual(expected, self.covered_faces(chunk, mesh))
+
+        # ambient of the merged quads is the same as in the full mesh
+        full = chunk.create_mesh(do_ambient=do_ambient)
+        ambient = {
+            tuple(p): a for p, a in zip(full.vertices.tolist(), full.attributes_array("a_ambient")[:, 0])
+        }
+        for p, a in zip(mesh.vertices.tolist(), mesh.attributes_array("a_ambient")[:, 0]):
+            self.assertEqual(ambient[tuple(p)], a)
+        return mesh
+
+    def test_floor(self):
+        chunk = create_chunk([[3] * 64], width=8, height=8)
+        mesh = chunk.create_mesh(do_ambient=False, greedy=True)
+        # top, bottom and four sides
+        self.assertEqual(12, mesh.num_triangles)
+        self.assertEqual(
+            [[0, 0], [8, 0], [8, 8], [0, 8]],
+            mesh.texcoords[4:8].tolist()
+        )
+        self.assert_greedy_mesh(chunk, do_ambient=False)
+        self.assert_greedy_mesh(chunk, do_ambient=True)
+
+    def test_random(self):
+        for seed in range(3):
+            chunk = create_random_chunk(9, 7, 4, probability=.6, seed=seed)
+            mesh = self.assert_greedy_mesh(chunk, do_ambient=False)
+            self.assertLess(mesh.num_triangles, chunk.create_mesh(do_ambient=False).num_triangles)
+            self.assert_greedy_mesh(chunk, do_ambient=True)
+
+    def test_empty(self):
+        chunk = create_chunk([[0] * 4], width=2, height=2)
+        self.assertTrue(chunk.create_mesh(greedy=True).is_empty())
+
+
+class TestWorldChunkWaypoints(unittest.TestCase):
+
+    @staticmethod
+    def edge_set(waypoints):
+        return {
+            frozenset((waypoints.id_to_pos[i1], waypoints.id_to_pos[i2]))
+            for i1 in waypoints._edge_fwd for i2 in waypoints._edge_fwd[i1]
+        }
+
+    def assert_floodfill(self, chunk):
+        """the flood-filled graph must be contained exactly in the connected component"""
+        expected = chunk.create_waypoints_floodfill()
+        waypoints = chunk.create_waypoints()
+        nodes = set(expected.pos_to_id)
+        self.assertTrue(nodes <= set(waypoints.pos_to_id))
+        self.assertEqual(
+            self.edge_set(expected),
+            {e for e in self.edge_set(waypoints) if all(p in nodes for p in e)}
+        )
+        return expected, waypoints
+
+    def test_compare_floodfill(self):
+        for seed in range(5):
+            # floor and steps
+            chunk = create_random_chunk(10, 9, 4, probability=.2, seed=seed)
+            chunk.space_type[0] = 1
+            chunk.clear_cache()
+            self.assert_floodfill(chunk)
+
+    def test_level(self):
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level01.json", cache=None)
+        expected, waypoints = self.assert_floodfill(chunk)
+        self.assertGreater(expected.num_nodes, 1000)
+
+    def test_components(self):
+        # a floor with a wall in the middle and one pillar
+        layers = [[1] * 35, [0] * 35, [0] * 35, [0] * 35]
+        for y in range(5):
+            layers[1][y * 7 + 3] = layers[2][y * 7 + 3] = 1
+        layers[1][1 * 7 + 1] = layers[2][1 * 7 + 1] = 1
+        chunk = create_chunk(layers, 7, 5)
+        waypoints = chunk.create_waypoints()
+        # left floor, right floor and the top of the wall, the pillar top is dropped
+        self.assertEqual(14 + 15 + 5, waypoints.num_nodes)
+        self.assertNotIn((1, 3, 3), waypoints.pos_to_id)
+        self.assertIn((3, 2, 3), waypoints.pos_to_id)
+        self.assertIn((6, 2, 1), waypoints.pos_to_id)
+        self.assertEqual(14 + 15 + 5 + 1, chunk.create_waypoints(min_component_size=1).num_nodes)
+        # the floodfill only reaches the left side
+        self.assertEqual(14, chunk.create_waypoints_floodfill().num_nodes)
+
+    def test_set_block(self):
+        rnd = random.Random(23)
+        chunk = create_random_chunk(10, 9, 4, probability=.2)
+        chunk.space_type[0] = 1
+        chunk.clear_cache()
+        waypoints = chunk.waypoints
+        for i in range(40):
+            x, y, z = rnd.randrange(10), rnd.randrange(9), rnd.randrange(4)
+            version = waypoints.version
+            chunk.set_block(x, y, z, 0 if chunk.is_occupied(x, y, z) else 1, 1)
+            self.assertIs(waypoints, chunk.waypoints)
+            self.assertEqual(
+                self.edge_set(chunk.create_waypoints(min_component_size=1)),
+                self.edge_set(waypoints),
+                msg=f"set_block({x}, {y}, {z})",
+            )
+            changes = waypoints.changed_edges(version)
+            for i1, i2 in changes:
+                for pos in (waypoints.id_to_pos[i1], waypoints.id_to_pos[i2]):
+                    self.assertLessEqual(abs(pos[0] - x), 2)
+                    self.assertLessEqual(abs(pos[1] - y), 2)
+
+    def test_waypoint_arrays_box(self):
+        chunk = create_random_chunk(10, 9, 4, probability=.2)
+        chunk.space_type[0] = 1
+        chunk.clear_cache()
+        positions, edges = chunk.waypoint_arrays()
+        box_positions, box_edges = chunk.waypoint_arrays((2, 3, 0), (7, 6, 0))
+        inside = (positions[:, 0] >= 2) & (positions[:, 0] < 7) & (positions[:, 1] >= 3) & (positions[:, 1] < 6)
+        self.assertEqual(positions[inside].tolist(), box_positions.tolist())
+        self.assertEqual(
+            {frozenset((tuple(p1), tuple(p2))) for p1, p2 in positions[edges].tolist()
+             if all(2 <= p[0] < 7 and 3 <= p[1] < 6 for p in (p1, p2))},
+            {frozenset((tuple(p1), tuple(p2))) for p1, p2 in box_positions[box_edges].tolist()},
+        )
+        self.assertEqual(0, len(chunk.waypoint_arrays((5, 5, 0), (5, 9, 0))[0]))
+
+    def test_empty(self):
+        chunk = create_chunk([[0] * 12], 4, 3)
+        self.assertEqual(0, chunk.create_waypoints().num_nodes)
+        self.assertEqual(0, chunk.create_waypoints_floodfill().num_nodes)
+
+
+class TestWorldChunkRays(unittest.TestCase):
+
+    def create_rays(self, num, seed=1):
+        rnd = np.random.RandomState(seed)
+        origins = rnd.uniform(-4, 14, size=(num, 3))
+        directions = rnd.normal(size=(num, 3))
+        directions /= np.linalg.norm(directions, axis=-1, keepdims=True)
+        return origins, directions
+
+    def test_compare_single(self):
+        import glm
+        chunk = create_random_chunk(12, 10, 8, probability=.05)
+        origins, directions = self.create_rays(500)
+        distances, voxels, normals = chunk.cast_voxel_rays(origins, directions, 40)
+        self.assertGreater(np.count_nonzero(np.isfinite(distances)), 20)
+        for ro, rd, dist, voxel, normal in zip(origins, directions, distances, voxels, normals):
+            t, hit = chunk.cast_voxel_ray(glm.vec3(*ro), glm.vec3(*rd), 40)
+            self.assertEqual(hit, np.isfinite(dist))
+            if hit:
+                self.assertAlmostEqual(t, dist, places=4)
+                self.assertTrue(chunk.is_occupied(*voxel))
+                # the ray came from the voxel next to the hit face
+                previous = voxel + normal
+                if not np.all(previous == np.floor(ro)):
+                    self.assertFalse(chunk.is_occupied(*previous))
+                self.assertEqual(1, np.abs(normal).sum())
+            else:
+                self.assertEqual([-1, -1, -1], voxel.tolist())
+                self.assertEqual([0, 0, 0], normal.tolist())
+
+    def test_floor(self):
+        chunk = create_chunk([[1] * 16, [0] * 16], 4, 4)
+        distances, voxels, normals = chunk.cast_voxel_rays(
+            [(1.5, 2.5, 5.), (1.5, 2.5, 5.), (-1., 2.5, .5), (1.5, 2.5, 5.)],
+            [(0, 0, -1), (0, 0, 1), (1, 0, 0), (1, 0, 0)],
+            max_steps=10,
+        )
+        self.assertAlmostEqual(4., distances[0], places=5)
+        self.assertEqual([1, 2, 0], voxels[0].tolist())
+        self.assertEqual([0, 0, 1], normals[0].tolist())
+        self.assertEqual(np.inf, distances[1])
+        self.assertAlmostEqual(1., distances[2], places=5)
+        self.assertEqual([0, 2, 0], voxels[2].tolist())
+        self.assertEqual([-1, 0, 0], normals[2].tolist())
+        self.assertEqual(np.inf, distances[3])
+
+    def test_empty(self):
+        chunk = create_random_chunk(4, 4, 4)
+        distances, voxels, normals = chunk.cast_voxel_rays(np.zeros((0, 3)), np.zeros((0, 3)))
+        self.assertEqual((0, ), distances.shape)
+        self.assertEqual((0, 3), voxels.shape)
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestWorldChunkMeshBenchmark(unittest.TestCase):
+    """
+    level01    culled ambient        16032 tris     48096 verts   2308608 bytes     0.0113 sec
+    level01    culled                16032 tris     48096 verts   2308608 bytes     0.0066 sec
+    level01    greedy ambient        13034 tris     26068 verts   1720488 bytes     0.0134 sec
+    level01    greedy                 3326 tris      6652 verts    439032 bytes     0.0063 sec
+    level02    culled ambient        20248 tris     60744 verts   2915712 bytes     0.0117 sec
+    level02    culled                20248 tris     60744 verts   2915712 bytes     0.0073 sec
+    level02    greedy ambient         9410 tris     18820 verts   1242120 bytes     0.0117 sec
+    level02    greedy                 1708 tris      3416 verts    225456 bytes     0.0071 sec
+    level03    culled ambient        31960 tris     95880 verts   4602240 bytes     0.0144 sec
+    level03    culled                31960 tris     95880 verts   4602240 bytes     0.0107 sec
+    level03    greedy ambient        23848 tris     47696 verts   3147936 bytes     0.0167 sec
+    level03    greedy                 4206 tris      8412 verts    555192 bytes     0.0088 sec
+    """
+
+    def test_benchmark(self):
+        tileset = Tileset.from_image(16, 16, "./assets/tileset02.png")
+        print()
+        for level in ("level01", "level02", "level03"):
+            chunk = WorldChunk(tileset)
+            chunk.from_tiled("./assets/tiled/%s.json" % level, cache=None)
+            for greedy in (False, True):
+                for do_ambient in (True, False):
+                    with Timer() as timer:
+                        mesh = chunk.create_mesh(do_ambient=do_ambient, greedy=greedy)
+                    num_bytes = sum(
+                        a.nbytes for a in [mesh.vertices, mesh.texcoords, mesh.normals, mesh.triangles]
+                        + [mesh.attributes_array(n) for n in mesh.attribute_names()]
+                    )
+                    task = "%s %s" % ("greedy" if greedy else "culled", "ambient" if do_ambient else "")
+                    print(
+                        f"{level:10} {task:16} {mesh.num_triangles:10} tris {mesh.num_vertices:9} verts "
+                        f"{num_bytes:9} bytes {timer.seconds():10} sec"
+                    )
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestWorldChunkRaysBenchmark(unittest.TestCase):
+    """
+    down      10000 rays  cast_voxel_rays   0.0145 sec    688030.71 rays/sec
+    down       1000 rays  cast_voxel_ray     0.028 sec     35773.84 rays/sec
+    down      50000 rays  cast_voxel_rays   0.0783 sec    638313.05 rays/sec
+    random    10000 rays  cast_voxel_rays   0.0449 sec    222548.46 rays/sec
+    random     1000 rays  cast_voxel_ray    0.1289 sec      7755.24 rays/sec
+    random    50000 rays  cast_voxel_rays   0.2029 sec    246469.76 rays/sec
+    """
+
+    def test_benchmark(self):
+        import glm
+        chunk = WorldChunk(Tileset(16, 16))
+        chunk.from_tiled("./assets/tiled/level03.json", cache=None)
+        rnd = np.random.RandomState(1)
+        print()
+        for name, num in (("down", 10000), ("down", 50000), ("random", 10000), ("random", 50000)):
+            origins = rnd.uniform(0, 1, size=(num, 3)) * chunk.size()
+            if name == "down":
+                directions = np.array([[0, 0, -1]] * num)
+            else:
+                directions = rnd.normal(size=(num, 3))
+            with Timer(num) as timer:
+                distances, voxels, normals = chunk.cast_voxel_rays(origins, directions)
+            print(f"{name:8} {num:6} rays  cast_voxel_rays {timer.seconds():8} sec {timer.fps():12} rays/sec")
+
+            num = 1000
+            with Timer(num) as timer:
+                for ro, rd in zip(origins[:num], directions[:num]):
+                    chunk.cast_voxel_ray(glm.vec3(*ro), glm.vec3(*rd))
+            print(f"{name:8} {num:6} rays  cast_voxel_ray  {timer.seconds():8} sec {timer.fps():12} rays/sec")
+
+
+@unittest.skipIf(not os.environ.get("BENCHMARK"), "define BENCHMARK to run")
+class TestWorldChunkWaypointsBenchmark(unittest.TestCase):
+    """
+    level01    create_waypoints_floodfill       0.1552 sec
+    level01    waypoint_arrays                  0.0086 sec
+    level01    create_waypoints                 0.0192 sec
+    level02    create_waypoints_floodfill       0.3134 sec
+    level02    waypoint_arrays                  0.0165 sec
+    level02    create_waypoints                 0.0372 sec
+    level03    create_waypoints_floodfill       0.3067 sec
+    level03    waypoint_arrays                  0.0144 sec
+    level03    create_waypoints                 0.0929 sec
+    """
+
+    def test_benchmark(self):
+        print()
+        for level in ("level01", "level02", "level03"):
+            chunk = WorldChunk(Tileset(16, 16))
+            chunk.from_tiled("./assets/tiled/%s.json" % level, cache=None)
+            for name in ("create_waypoints_floodfill", "waypoint_arrays", "create_waypoints"):
+                with Timer() as timer:
+                    getattr(chunk, name)()
+                print(f"{level:10} {name:28} {timer.seconds():10} sec")
@@ -0,0 +1,75 @@
+import unittest
+
+import glm
+
+from lib.world import WorldEngine
+from simulate import run_simulation, reachable_nodes
+
+
+class TestWorldEngineHeadless(unittest.TestCase):
+
+    def test_update(self):
+        engine = WorldEngine(headless=True, cache=None)
+        self.assertIsNone(engine.projection)
+        self.assertIsNone(engine.render_settings)
+        self.assertEqual(6, len(engine.agents))
+        self.assertIsNone(engine.agents["player"].renderer)
+
+        waypoints = engine.chunk.waypoints
+        nodes = reachable_nodes(waypoints)
+        start_pos = glm.vec3(waypoints.id_to_pos[int(nodes[0])])
+        goal_pos = glm.vec3(waypoints.id_to_pos[int(nodes[len(nodes) // 2])])
+        engine.agents.create_agent("walker")
+        engine.agents["walker"].set_position(start_pos + (.5, .5, 0))
+        engine.agents.set_goal("walker", goal_pos)
+        self.assertEqual(1, engine.agents.num_path_requests)
+        self.assertFalse(engine.agents.is_idle("walker"))
+        for i in range(6000):
+            engine.update(1. / 60.)
+            if engine.agents.is_idle("walker"):
+                break
+        self.assertTrue(engine.agents.is_idle("walker"))
+        self.assertGreaterEqual(engine.agents.num_paths, 1)
+        self.assertLess(glm.distance(goal_pos.xy, engine.agents["walker"].sposition.xy), 1.)
+
+        with self.assertRaises(RuntimeError):
+            engine.render(0.)
+
+    def test_chunk_manager(self):
+        with self.assertRaises(ValueError):
+            WorldEngine(chunk_size=(16, 16, 16))
+
+        engine = WorldEngine(headless=True, chunk_size=(16, 16, 16))
+        self.assertEqual(9, len(engine.chunk.keys()))
+        # let the player land
+        for i in range(60):
+            engine.update(1. / 60.)
+
+        # walk to the farthest loaded position, new chunks are loaded on the way
+        waypoints = engine.chunk.waypoints
+        version = waypoints.version
+        start = engine.agents.get_closest_waypoint("player")
+        nodes = reachable_nodes(waypoints, start)
+        goal_pos = glm.vec3(max(
+            (waypoints.id_to_pos[int(n)] for n in nodes), key=lambda pos: pos[0] + pos[1]
+        ))
+        engine.agents.set_goal("player", goal_pos)
+        for i in range(6000):
+            engine.update(1. / 60.)
+            if engine.agents.is_idle("player"):
+                break
+        self.assertTrue(engine.agents.is_idle("player"))
+        self.assertLess(glm.distance(goal_pos.xy + .5, engine.agents["player"].sposition.xy), 1.)
+
+        self.assertIn(engine.chunk.chunk_key(goal_pos.x, goal_pos.y), engine.chunk.keys())
+        self.assertGreater(len(engine.chunk.keys()), 9)
+        # the agents' waypoints were extended in place
+        self.assertIs(waypoints, engine.chunk.waypoints)
+        self.assertGreater(waypoints.version, version)
+
+    def test_run_simulation(self):
+        stats = run_simulation(num_ticks=10, num_agents=20, cache=None)
+        self.assertEqual(26, stats["agents"])
+        self.assertEqual(10, stats["ticks"])
+        self.assertGreater(stats["ticks_per_second"], 0)
+        self.assertGreaterEqual(stats["path_requests"], 20)
@@ -1,3 +1,6 @@
+from concurrent.futures import Executor
+from typing import Optional, Tuple, Union
+
 import numpy as np
 
 from lib.gen import *
@@ -9,20 +12,50 @@ class TilemapSampler(BlockSampler2DBase):
             self,
             seed: int = 1,
             block_size: int = 32,
+            cache: Optional[BlockCache] = None,
     ):
-        super().__init__(block_size=block_size)
+        super().__init__(block_size=block_size, cache=cache)
         self.biosphere_noise = NoiseSampler2D(
             resolution=2,
-            seed=seed, block_size=128,
+            seed=seed, block_size=128, cache=cache,
         )
         self.noise = NoiseSampler2D(
             resolution=8,
-            seed=seed+23, block_size=128,
+            seed=seed+23, block_size=128, cache=cache,
         )
 
-        self.ca_sampler = AutomatonSampler2D(seed=seed, block_size=self.block_size)
+        self.ca_sampler = AutomatonSampler2D(seed=seed, block_size=self.block_size, cache=cache)
         # self.random_sampler = RandomSampler2D(seed=seed, block_size=self.block_size)
 
+    def nested_samplers(self):
+        return self.biosphere_noise, self.noise, self.ca_sampler
+
+    def set_prefetch_executor(
+            self,
+            executor: Optional[Union[Executor, Worker]] = None,
+            max_in_flight: int = 2,
+            priority: float = -1,
+    ):
+        for sampler in self.nested_samplers():
+            sampler.set_prefetch_executor(executor, max_in_flight=max_in_flight, priority=priority)
+
+    def prefetch(
+            self,
+            x: float, y: float,
+            velocity: Tuple[float, float] = (0., 0.),
+            radius: float = 32.,
+            lookahead: float = 1.,
+    ) -> int:
+        # this sampler has no blocks itself, __call__ reads the nested samplers with a padding of 1
+        return sum(
+            sampler.prefetch(x, y, velocity=velocity, radius=radius + 1, lookahead=lookahead)
+            for sampler in self.nested_samplers()
+        )
+
+    def cancel_prefetch(self, outdated: bool = False):
+        for sampler in self.nested_samplers():
+            sampler.cancel_prefetch(outdated=outdated)
+
     def __call__(self, x: int, y: int, width: int, height: int) -> np.ndarray:
         padding = 1
         window = (
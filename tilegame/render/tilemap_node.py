@@ -1,3 +1,4 @@
+import time
 from functools import partial
 from typing import Optional, Dict
 
@@ -16,15 +17,27 @@ from tests.util import Timer
 
 class TileMapNode(GameShaderNode):
 
-    def __init__(self, map: TilemapSampler, name: str):
+    def __init__(self, map: TilemapSampler, name: str, worker_backend: str = "thread"):
+        """
+        :param worker_backend: "thread" or "process", the Worker backend that generates the map,
+            the process backend keeps the generation off the render thread's GIL
+        """
         super().__init__(name)
         self.map = map
         self.map_texture = Texture2D()
         self.last_map_center = None
         self.last_map_offset = None
         self.last_map_scale = None
-        self.map_worker = Worker.instance("numpy")
+        self.map_worker = Worker.instance("numpy" if worker_backend == "thread" else "numpy-process", worker_backend)
+        if worker_backend == "thread":
+            # prefetched blocks run when no map request is waiting
+            self.map.set_prefetch_executor(self.map_worker)
         self.map_requested = False
+        # Future and (center, scale) of the latest map request
+        self.map_future = None
+        self.requested_map = None
+        # (time, camera location) of the previous update, to predict the camera movement
+        self.last_location = None
 
     def get_game_shader_code(self):
         return """
@@ -99,39 +112,60 @@ class TileMapNode(GameShaderNode):
 
     def update_map(self, rs: GameRenderSettings):
         map_center = (int(rs.projection.location[0]), int(rs.projection.location[1]))
-        if self.last_map_center is None:
+        # worker processes have their own caches, blocks prefetched
+        #   into this process' cache would not be used by the map requests
+        if self.map_worker.backend == "thread":
+            self.prefetch_map(rs)
+        # compared to the requested map while waiting for it, or else to the current one
+        if self.map_requested:
+            center, scale = self.requested_map
+        else:
+            center, scale = self.last_map_center, self.last_map_scale
+        if center is None:
             do_update = True
         else:
-            dist = abs(self.last_map_center[0] - map_center[0]) + abs(self.last_map_center[1] - map_center[1])
+            dist = abs(center[0] - map_center[0]) + abs(center[1] - map_center[1])
             do_update = dist > 2
-            do_update |= self.last_map_scale * 1.1 < rs.projection.scale
-
-        if do_update or self.map_requested:
-            if self.map_requested:
-                map_array = None
-                result = self.map_worker.pop_result("map")
-                if result:
-                    self.map_requested = False
-                    map_array = result["result"]
-                    w, h, map_center, scale = result["extra"]
-            else:
-                # radius
-                w = h = max(16, int(rs.projection.scale * 1.3))
-                mx, my, mw, mh = map_center[0] - w, map_center[1] - h, w * 2 + 1, h * 2 + 1
-                self.map_worker.request(
-                    "map",
-                    partial(self.map, mx, my, mw, mh),
-                    extra=(w, h, map_center, rs.projection.scale)
-                )
-                map_array = None
-                self.map_requested = True
-
-            if map_array is not None:
-                self.upload_map(map_array)
-                self.last_map_center = map_center
-                self.last_map_offset = glm.vec2(*map_center) - glm.vec2(w, h)
+            do_update |= scale * 1.1 < rs.projection.scale
+
+        if self.map_requested:
+            result = self.map_worker.pop_result("map")
+            if result:
+                # a request that was already running when it got replaced comes first
+                self.map_requested = not self.map_future.done()
+                w, h, center, scale = result["extra"]
+                self.upload_map(result["result"])
+                self.last_map_center = center
+                self.last_map_offset = glm.vec2(*center) - glm.vec2(w, h)
                 self.last_map_scale = scale
 
+        if do_update:
+            # radius
+            w = h = max(16, int(rs.projection.scale * 1.3))
+            mx, my, mw, mh = map_center[0] - w, map_center[1] - h, w * 2 + 1, h * 2 + 1
+            # replaces the previous request if it did not start yet
+            self.map_future = self.map_worker.request(
+                "map",
+                partial(self.map, mx, my, mw, mh),
+                extra=(w, h, map_center, rs.projection.scale)
+            )
+            self.map_requested = True
+            self.requested_map = (map_center, rs.projection.scale)
+
+    def prefetch_map(self, rs: GameRenderSettings, lookahead: float = .5):
+        """Generate the map blocks that the camera will reach in the next `lookahead` seconds"""
+        location = glm.vec2(rs.projection.location[0], rs.projection.location[1])
+        cur_time = time.time()
+        velocity = glm.vec2(0)
+        if self.last_location is not None:
+            dt = cur_time - self.last_location[0]
+            if dt > 0:
+                velocity = (location - self.last_location[1]) / dt
+        self.last_location = (cur_time, location)
+
+        radius = max(16, int(rs.projection.scale * 1.3))
+        self.map.prefetch(location.x, location.y, velocity=tuple(velocity), radius=radius, lookahead=lookahead)
+
     def upload_map(self, float_array: np.ndarray):
         # print(float_array)
         if float_array.dtype.name != "float32":